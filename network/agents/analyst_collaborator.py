@@ -18,6 +18,7 @@ from openagents.models.agent_config import AgentConfig
 from storage.memory_palace import memory_palace
 from storage.framework_library import framework_library
 from storage.simple_storage import storage
+from storage.tokenizer import extract_keywords
 
 
 class AnalystCollaborator(CollaboratorAgent):
@@ -75,7 +76,7 @@ Be thorough, empathetic, and evidence-based.""",
             insights = await self.perform_analysis(content, framework_name, user_id)
             
             # 保存分析结果
-            storage.save_analysis(
+            await storage.asave_analysis(
                 user_id=user_id,
                 framework=framework_name,
                 insights=insights,
@@ -84,7 +85,7 @@ Be thorough, empathetic, and evidence-based.""",
             
             # 保存到记忆殿堂
             keywords = self._extract_keywords(content, framework_name)
-            memory_palace.add_long_term_memory(
+            await memory_palace.aadd_long_term_memory(
                 user_id=user_id,
                 memory_type="analysis",
                 content=f"Framework: {framework_name}\nInsights: {json.dumps(insights, ensure_ascii=False)}",
@@ -117,7 +118,7 @@ Be thorough, empathetic, and evidence-based.""",
     async def perform_analysis(self, content: str, framework_name: str, user_id: str) -> List[str]:
         """执行分析"""
         # 从记忆殿堂获取上下文
-        context_data = memory_palace.build_context(user_id, current_topic=content)
+        context_data = await memory_palace.abuild_context(user_id, current_topic=content)
         
         # 获取框架信息
         framework = framework_library.get_framework(framework_name)
@@ -173,21 +174,8 @@ Format as a numbered list in Chinese."""
         return "\n".join(formatted)
     
     def _extract_keywords(self, content: str, framework: str) -> List[str]:
-        """提取关键词"""
-        keywords = [framework.lower()]
-        
-        import re
-        words = re.findall(r'\w+', content.lower())
-        
-        stopwords = {'的', '了', '是', '在', '我', '有', '和', '就', '不', '人', '都', '一', '上', '也', '很', '到', '说', '要', '去', '你', '会', '着', '没有', '看', '好', '自己', '这'}
-        
-        for word in words:
-            if word not in stopwords and len(word) > 1:
-                keywords.append(word)
-                if len(keywords) >= 8:
-                    break
-        
-        return keywords
+        """提取关键词（框架名 + 内容中最多 7 个关键词）"""
+        return [framework.lower()] + extract_keywords(content, limit=7)
     
     def _parse_insights(self, response: str) -> List[str]:
         """解析 LLM 响应为洞察列表"""
@@ -61,7 +61,7 @@ class CoordinatorCollaborator(CollaboratorAgent):
         print(f"   内容: {content[:100]}...")
         
         # 保存消息
-        storage.save_message(
+        await storage.asave_message(
             user_id=sender,
             content=content,
             message_type="channel_message",
@@ -79,7 +79,7 @@ Be practical, encouraging, and specific.""",
             )
             
             # 保存行动计划
-            storage.save_action_plan(
+            await storage.asave_action_plan(
                 user_id=user_id,
                 title=action_plan["title"],
                 steps=action_plan["steps"],
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+Access Stats - 访问统计累加器
+检索路径只在内存里记账，后台线程定期把累计的访问次数批量写回
+"""
+
+import atexit
+import threading
+from typing import Callable, Dict, Iterable, List, Optional
+
+from storage.migrations import now_ms
+from storage.sqlite_pool import SQLitePool
+
+
+class AccessAccumulator:
+    """访问计数累加器 - 同一条记忆的多次访问合并成一次 UPDATE"""
+
+    def __init__(
+        self,
+        pool: SQLitePool,
+        table: str = "long_term_memory",
+        flush_interval_ms: int = 1000,
+        max_pending: int = 10000,
+        on_flush: Optional[Callable] = None
+    ):
+        """
+        flush_interval_ms: 定期写回的间隔
+        max_pending: 累计的不同记忆数达到上限时立即写回
+        on_flush: 写回后在同一事务内调用 on_flush(conn, ids)，用于维护依赖访问次数的派生列
+        """
+        self.table = table
+        self.flush_interval = flush_interval_ms / 1000
+        self.max_pending = max_pending
+        self.on_flush = on_flush
+        self._pool = pool
+        self._pending: Dict[int, List] = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._closed = False
+
+        # recorded: 记录的访问次数；rows: 实际写回的行数；coalesced: 被合并掉的写入
+        self.stats = {"recorded": 0, "rows": 0, "flushes": 0, "coalesced": 0, "errors": 0}
+
+        self._thread = threading.Thread(target=self._run, name="access-stats", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    # ==================== 公共接口 ====================
+
+    def record(self, ids: Iterable[int]):
+        """记录一次检索命中的记忆 id（只改内存）"""
+        now = now_ms()
+        with self._lock:
+            for memory_id in ids:
+                entry = self._pending.get(memory_id)
+                if entry is None:
+                    self._pending[memory_id] = [1, now]
+                else:
+                    entry[0] += 1
+                    entry[1] = now
+                self.stats["recorded"] += 1
+            full = len(self._pending) >= self.max_pending
+
+        if full:
+            self._wakeup.set()
+
+    def flush(self):
+        """把累计的访问统计写回数据库"""
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+            if not pending:
+                return
+
+            rows = [(count, last, memory_id) for memory_id, (count, last) in pending.items()]
+            try:
+                with self._pool.write() as conn:
+                    conn.executemany(f'''
+                        UPDATE {self.table}
+                        SET access_count = access_count + ?,
+                            last_accessed = MAX(COALESCE(last_accessed, 0), ?)
+                        WHERE id = ?
+                    ''', rows)
+                    if self.on_flush is not None:
+                        self.on_flush(conn, list(pending))
+            except Exception:
+                # 写回失败时放回内存，下次再试
+                with self._lock:
+                    for count, last, memory_id in rows:
+                        entry = self._pending.setdefault(memory_id, [0, last])
+                        entry[0] += count
+                        entry[1] = max(entry[1], last)
+                self.stats["errors"] += 1
+                raise
+
+            self.stats["flushes"] += 1
+            self.stats["rows"] += len(rows)
+            self.stats["coalesced"] = self.stats["recorded"] - self.stats["rows"] - self.pending_count()
+
+    def pending_count(self) -> int:
+        """尚未写回的访问次数"""
+        with self._lock:
+            return sum(count for count, _ in self._pending.values())
+
+    def close(self):
+        """写回剩余统计并停止后台线程"""
+        if self._closed:
+            return
+        self._closed = True
+        self._wakeup.set()
+        self._thread.join()
+        self.flush()
+        atexit.unregister(self.close)
+
+    # ==================== 后台写回 ====================
+
+    def _run(self):
+        """后台线程：按间隔（或累计过多时）写回"""
+        while not self._closed:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            if self._closed:
+                break
+            try:
+                self.flush()
+            except Exception:
+                pass
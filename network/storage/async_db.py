@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+"""
+Async DB - 异步存储门面
+在专用线程池中执行阻塞的 SQLite 调用，避免卡住 agent 的事件循环
+"""
+
+import asyncio
+import functools
+from concurrent.futures import Future, ThreadPoolExecutor
+
+
+def async_method(func):
+    """把同步存储方法包装成在数据库线程池中执行的协程方法"""
+
+    @functools.wraps(func)
+    async def wrapper(self, *args, **kwargs):
+        return await self._run_in_db_thread(func, self, *args, **kwargs)
+
+    wrapper.__name__ = f"a{func.__name__}"
+    return wrapper
+
+
+class AsyncStoreMixin:
+    """异步门面 - 需要子类提供 self._pool (SQLitePool)"""
+
+    db_workers = 4
+
+    _db_executor = None
+
+    def _get_db_executor(self) -> ThreadPoolExecutor:
+        """懒创建数据库线程池，每个线程持有自己的专属连接"""
+        if self._db_executor is None:
+            self._db_executor = ThreadPoolExecutor(
+                max_workers=self.db_workers,
+                thread_name_prefix=f"{type(self).__name__}-db",
+                initializer=self._pool.confine_to_thread
+            )
+        return self._db_executor
+
+    async def _run_in_db_thread(self, func, *args, **kwargs):
+        """在数据库线程池中执行 func"""
+        loop = asyncio.get_running_loop()
+        result = await loop.run_in_executor(
+            self._get_db_executor(),
+            functools.partial(func, *args, **kwargs)
+        )
+        # 写后模式返回的是 Future，继续等待真正的行 id
+        if isinstance(result, Future):
+            result = await asyncio.wrap_future(result)
+        return result
+
+    def _shutdown_db_executor(self):
+        """关闭数据库线程池"""
+        if self._db_executor is not None:
+            self._db_executor.shutdown(wait=True)
+            self._db_executor = None
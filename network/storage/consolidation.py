@@ -0,0 +1,362 @@
+#!/usr/bin/env python3
+"""
+Consolidation - 记忆整理
+用 SimHash 指纹合并近似重复的长期记忆，并把反复出现的短期记忆主题提升为长期记忆；
+每次只处理上次运行之后写入的行
+
+用法:
+    python -m storage.consolidation --db data/memory_palace.db
+"""
+
+import argparse
+import hashlib
+import json
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from storage.migrations import now_ms
+from storage.tokenizer import extract_keywords, search_text, segment
+
+
+# ==================== SimHash ====================
+
+_BANDS = 8
+_BAND_BITS = 64 // _BANDS
+
+# 把一个字节的 8 个位分别放进 8 个 32 位“计数槽”，一次大整数加法就能给 64 个位同时计数
+_LANE = 32
+_SPREAD = [sum(((byte >> i) & 1) << (i * _LANE) for i in range(8)) for byte in range(256)]
+
+
+def simhash(text: str) -> int:
+    """64 位 SimHash（词元为分词结果，按出现次数加权），返回有符号整数便于存入 SQLite"""
+    tokens = segment(text)
+    counts = 0
+    for token in tokens:
+        digest = hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest()
+        for k, byte in enumerate(digest):
+            counts += _SPREAD[byte] << (k * 8 * _LANE)
+
+    # 某一位上为 1 的词元多于一半，指纹该位为 1
+    lane_mask = (1 << _LANE) - 1
+    value = 0
+    for bit in range(64):
+        if 2 * ((counts >> (bit * _LANE)) & lane_mask) > len(tokens):
+            value |= 1 << bit
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def hamming(a: int, b: int) -> int:
+    """两个指纹的汉明距离"""
+    return bin((a ^ b) & ((1 << 64) - 1)).count("1")
+
+
+class _FingerprintIndex:
+    """
+    分段索引：64 位分成 8 段，距离不超过 7 的两个指纹至少有一段完全相同（抽屉原理），
+    只需和同段的指纹比较
+    """
+
+    def __init__(self, max_distance: int):
+        self.max_distance = max_distance
+        self._bands: List[Dict[Tuple, List[Tuple[int, int]]]] = [{} for _ in range(_BANDS)]
+
+    @staticmethod
+    def _band_keys(fingerprint: int, group) -> List[Tuple]:
+        unsigned = fingerprint & ((1 << 64) - 1)
+        mask = (1 << _BAND_BITS) - 1
+        return [(group, (unsigned >> (band * _BAND_BITS)) & mask) for band in range(_BANDS)]
+
+    def add(self, item_id: int, fingerprint: int, group=None):
+        for band, key in zip(self._bands, self._band_keys(fingerprint, group)):
+            band.setdefault(key, []).append((item_id, fingerprint))
+
+    def find(self, fingerprint: int, group=None) -> Optional[int]:
+        """返回同组内最近的（距离不超过阈值）指纹的 id"""
+        best = None
+        for band, key in zip(self._bands, self._band_keys(fingerprint, group)):
+            for item_id, other in band.get(key, ()):
+                distance = hamming(fingerprint, other)
+                if distance <= self.max_distance and (best is None or distance < best[0]):
+                    best = (distance, item_id)
+        return best[1] if best else None
+
+
+# ==================== 整理任务 ====================
+
+# 关联表没有唯一约束：改指向后 survivor 与同一记忆之间可能有多条同类关联（不分方向），只留强度最大的一条
+_DEDUP_EDGES_SQL = '''
+    DELETE FROM memory_associations WHERE id IN (
+        SELECT id FROM (
+            SELECT id, ROW_NUMBER() OVER (
+                PARTITION BY MIN(memory_id_1, memory_id_2), MAX(memory_id_1, memory_id_2), association_type
+                ORDER BY strength DESC, id
+            ) AS rank
+            FROM memory_associations
+            WHERE memory_id_1 = :survivor OR memory_id_2 = :survivor
+        )
+        WHERE rank > 1
+    )
+'''
+
+
+class MemoryConsolidator:
+    """记忆整理 - 长期记忆去重 + 短期记忆主题提升，按水位线增量执行"""
+
+    def __init__(
+        self,
+        palace,
+        max_distance: int = 6,
+        theme_distance: int = 6,
+        min_occurrences: int = 3,
+        theme_importance_bonus: float = 0.1
+    ):
+        """
+        max_distance: 长期记忆判定为近似重复的最大汉明距离（分段索引要求不超过 7）
+        theme_distance: 短期记忆归为同一主题的最大汉明距离（同上）
+        min_occurrences: 主题出现多少次才提升为长期记忆
+        """
+        if max(max_distance, theme_distance) >= _BANDS:
+            raise ValueError(f"distance must be below {_BANDS} for the banded index")
+        self.palace = palace
+        self.max_distance = max_distance
+        self.theme_distance = theme_distance
+        self.min_occurrences = min_occurrences
+        self.theme_importance_bonus = theme_importance_bonus
+
+    def run(self) -> Dict:
+        """执行一轮整理，返回统计"""
+        # 先写回内存中的访问计数，合并时才能把它们一起累加
+        self.palace.flush_access_stats()
+
+        # 先提升短期主题，新生成的长期记忆在同一轮里参与去重
+        stats = self._promote_short_term_themes()
+        stats.update(self._merge_long_term_duplicates())
+        return stats
+
+    # ==================== 水位线 ====================
+
+    def _watermark(self, conn, name: str) -> int:
+        row = conn.execute('SELECT last_id FROM consolidation_state WHERE name = ?', (name,)).fetchone()
+        return row[0] if row else 0
+
+    def _set_watermark(self, conn, name: str, last_id: int):
+        conn.execute('''
+            INSERT INTO consolidation_state (name, last_id, updated_at) VALUES (?, ?, ?)
+            ON CONFLICT (name) DO UPDATE SET last_id = excluded.last_id, updated_at = excluded.updated_at
+        ''', (name, last_id, datetime.now().isoformat()))
+
+    # ==================== 长期记忆去重 ====================
+
+    def _merge_long_term_duplicates(self) -> Dict:
+        """给新行计算指纹，并与同一用户、同一类型的已有记忆比较合并"""
+        pool = self.palace._pool
+
+        with pool.read() as conn:
+            watermark = self._watermark(conn, 'long_term')
+            new_rows = conn.execute(
+                'SELECT id, user_id, content FROM long_term_memory WHERE id > ? ORDER BY id',
+                (watermark,)
+            ).fetchall()
+
+        if not new_rows:
+            return {"long_term_scanned": 0, "long_term_merged": 0}
+
+        last_id = new_rows[-1]['id']
+        decode = self.palace.text_codec.decode
+        fingerprints = [(simhash(decode(row['content'])), row['id']) for row in new_rows]
+        with pool.write() as conn:
+            conn.executemany('UPDATE long_term_memory SET simhash = ? WHERE id = ?', fingerprints)
+
+        merged = 0
+        for user_id in sorted({row['user_id'] for row in new_rows}):
+            merged += self._merge_user(user_id, watermark, last_id)
+
+        with pool.write() as conn:
+            self._set_watermark(conn, 'long_term', last_id)
+
+        return {"long_term_scanned": len(new_rows), "long_term_merged": merged}
+
+    def _merge_user(self, user_id: str, watermark: int, last_id: int) -> int:
+        """合并一个用户的近似重复记忆：旧行之间已经比较过，只拿新行去匹配"""
+        with self.palace._pool.read() as conn:
+            rows = conn.execute('''
+                SELECT id, memory_type, simhash FROM long_term_memory
+                WHERE user_id = ? AND simhash IS NOT NULL AND id <= ?
+                ORDER BY id
+            ''', (user_id, last_id)).fetchall()
+
+        index = _FingerprintIndex(self.max_distance)
+        merges = []
+        for row in rows:
+            survivor = index.find(row['simhash'], row['memory_type']) if row['id'] > watermark else None
+            if survivor is None:
+                index.add(row['id'], row['simhash'], row['memory_type'])
+            else:
+                merges.append((row['id'], survivor))
+
+        if not merges:
+            return 0
+
+        with self.palace._pool.write() as conn:
+            # 先拿写锁再读两行：合并按读到的值写回访问次数、关键词等，不拿锁的话期间写回的访问统计会被覆盖
+            conn.execute('BEGIN IMMEDIATE')
+            for duplicate, survivor in merges:
+                self._merge_pair(conn, duplicate, survivor)
+
+        self.palace._context_cache.invalidate(user_id)
+        return len(merges)
+
+    def _merge_pair(self, conn, duplicate: int, survivor: int):
+        """把 duplicate 合并进 survivor：访问次数相加，重要度取大，关键词取并集，关联改指向 survivor"""
+        dup = conn.execute('SELECT * FROM long_term_memory WHERE id = ?', (duplicate,)).fetchone()
+        keep = conn.execute('SELECT * FROM long_term_memory WHERE id = ?', (survivor,)).fetchone()
+        if dup is None or keep is None:
+            return
+
+        keywords = list(dict.fromkeys(
+            [k for k in keep['keywords'].split(',') if k] + [k for k in dup['keywords'].split(',') if k]
+        ))
+        keywords_str = ','.join(keywords)
+        last_accessed = max(filter(None, (keep['last_accessed'], dup['last_accessed'])), default=None)
+        metadata = json.loads(keep['metadata'] or '{}')
+        metadata['merged_ids'] = metadata.get('merged_ids', []) + [duplicate]
+
+        conn.execute('''
+            UPDATE long_term_memory
+            SET access_count = ?, importance = ?, last_accessed = ?,
+                keywords = ?, search_text = ?, metadata = ?
+            WHERE id = ?
+        ''', (
+            keep['access_count'] + dup['access_count'],
+            max(keep['importance'], dup['importance']),
+            last_accessed,
+            keywords_str,
+            search_text(self.palace.text_codec.decode(keep['content']), keywords_str),
+            json.dumps(metadata, ensure_ascii=False),
+            survivor
+        ))
+        self.palace.relevance_scorer.rescore_ids(conn, [survivor])
+
+        conn.execute('UPDATE memory_associations SET memory_id_1 = ? WHERE memory_id_1 = ?', (survivor, duplicate))
+        conn.execute('UPDATE memory_associations SET memory_id_2 = ? WHERE memory_id_2 = ?', (survivor, duplicate))
+        # 合并只会产生 survivor 指向自己的边（走 memory_id_1 的邻接索引，不扫全表）
+        conn.execute(
+            'DELETE FROM memory_associations WHERE memory_id_1 = ? AND memory_id_2 = ?', (survivor, survivor)
+        )
+        conn.execute(_DEDUP_EDGES_SQL, {"survivor": survivor})
+        conn.execute('DELETE FROM long_term_memory WHERE id = ?', (duplicate,))
+
+    # ==================== 短期主题提升 ====================
+
+    def _promote_short_term_themes(self) -> Dict:
+        """新写入短期记忆的用户：把反复出现的主题提升为长期记忆"""
+        pool = self.palace._pool
+        now = now_ms()
+
+        with pool.read() as conn:
+            watermark = self._watermark(conn, 'short_term')
+            row = conn.execute('SELECT MAX(id) FROM short_term_memory').fetchone()
+            last_id = row[0] or watermark
+            users = [r[0] for r in conn.execute(
+                'SELECT DISTINCT user_id FROM short_term_memory WHERE id > ? AND id <= ?',
+                (watermark, last_id)
+            )]
+
+        codec = self.palace.text_codec
+        stats = {"themes_promoted": 0, "themes_reinforced": 0}
+        for user_id in users:
+            with pool.read() as conn:
+                # 尚未过期的短期记忆都参与聚类，主题可以跨越多次运行累积
+                rows = [codec.decode_row(dict(row)) for row in conn.execute('''
+                    SELECT id, content, importance, metadata FROM short_term_memory
+                    WHERE user_id = ? AND id <= ? AND (expires_at IS NULL OR expires_at >= ?)
+                    ORDER BY id
+                ''', (user_id, last_id, now))]
+
+            for cluster in self._cluster(rows):
+                self._promote_cluster(user_id, cluster, watermark, stats)
+
+        with pool.write() as conn:
+            self._set_watermark(conn, 'short_term', last_id)
+        return stats
+
+    def _cluster(self, rows) -> List[List]:
+        """按指纹聚类（每簇以第一条为代表）"""
+        index = _FingerprintIndex(self.theme_distance)
+        clusters: Dict[int, List] = {}
+        for row in rows:
+            fingerprint = simhash(row['content'])
+            leader = index.find(fingerprint)
+            if leader is None:
+                index.add(row['id'], fingerprint)
+                clusters[row['id']] = [row]
+            else:
+                clusters[leader].append(row)
+        return list(clusters.values())
+
+    def _promote_cluster(self, user_id: str, cluster: List, watermark: int, stats: Dict):
+        """提升一个主题簇；已提升过的主题只累加新出现的次数"""
+        new_ids = [row['id'] for row in cluster if row['id'] > watermark]
+        if not new_ids or len(cluster) < self.min_occurrences:
+            return
+
+        promoted_to = None
+        for row in cluster:
+            promoted_to = json.loads(row['metadata'] or '{}').get('promoted_to') or promoted_to
+
+        pool = self.palace._pool
+        if promoted_to is not None:
+            with pool.write() as conn:
+                reinforced = conn.execute(
+                    'UPDATE long_term_memory SET access_count = access_count + ? WHERE id = ?',
+                    (len(new_ids), promoted_to)
+                ).rowcount
+                if reinforced:
+                    self.palace.relevance_scorer.rescore_ids(conn, [promoted_to])
+                    self._mark_promoted(conn, new_ids, promoted_to)
+            if reinforced:
+                stats["themes_reinforced"] += 1
+                return
+            # 提升出的长期记忆已被配额淘汰或合并掉：按新主题重新提升，整簇的 promoted_to 改指向新记忆
+
+        latest = cluster[-1]
+        promoted_to = self.palace.add_long_term_memory(
+            user_id,
+            "recurring_theme",
+            latest['content'],
+            extract_keywords(' '.join(row['content'] for row in cluster), limit=5),
+            importance=min(1.0, max(row['importance'] for row in cluster) + self.theme_importance_bonus),
+            metadata={
+                "source": "short_term",
+                "occurrences": len(cluster),
+                "short_term_ids": [row['id'] for row in cluster]
+            }
+        )
+        with pool.write() as conn:
+            self._mark_promoted(conn, [row['id'] for row in cluster], promoted_to)
+        stats["themes_promoted"] += 1
+
+    def _mark_promoted(self, conn, ids: List[int], memory_id: int):
+        conn.execute(
+            "UPDATE short_term_memory SET metadata = json_set(metadata, '$.promoted_to', ?) "
+            "WHERE id IN (SELECT value FROM json_each(?))",
+            (memory_id, json.dumps(ids))
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Symphony 记忆整理")
+    parser.add_argument("--db", default="data/memory_palace.db")
+    parser.add_argument("--min-occurrences", type=int, default=3)
+    args = parser.parse_args()
+
+    from storage.memory_palace import MemoryPalace
+    palace = MemoryPalace(args.db)
+    result = MemoryConsolidator(palace, min_occurrences=args.min_occurrences).run()
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    palace.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+Context Cache - 上下文缓存
+进程内按用户缓存构建好的对话上下文，用户写入新数据时失效
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Hashable, Optional, Set
+
+
+class ContextCache:
+    """上下文缓存 - LRU + TTL，按用户失效"""
+
+    def __init__(self, max_entries: int = 256, ttl_s: float = 10):
+        """
+        max_entries: 最多缓存的上下文个数，超出时淘汰最久未使用的
+        ttl_s: 上下文的最长存活时间（也兜底其它进程的写入）
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl_s
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._keys_by_user: Dict[str, Set[Hashable]] = {}
+        # 失效时钟：每次 invalidate/clear 加一；_invalidated 记用户最近一次失效的时刻，
+        # 不在其中的用户按 _floor 算（clear 和清理 _invalidated 时抬高）
+        self._clock = 0
+        self._floor = 0
+        self._invalidated: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+        self.stats = {"hits": 0, "misses": 0, "expired": 0, "evictions": 0, "invalidations": 0}
+
+    # ==================== 读写 ====================
+
+    def get(self, user_id: str, key: Hashable) -> Optional[Dict]:
+        """命中返回缓存的上下文，未命中或已过期返回 None"""
+        with self._lock:
+            entry = self._entries.get((user_id, key))
+            if entry is None:
+                self.stats["misses"] += 1
+                return None
+
+            context, expires_at = entry
+            if expires_at < time.monotonic():
+                self._remove((user_id, key))
+                self.stats["expired"] += 1
+                self.stats["misses"] += 1
+                return None
+
+            self._entries.move_to_end((user_id, key))
+            self.stats["hits"] += 1
+            return context
+
+    def generation(self, user_id: str) -> int:
+        """当前的失效时刻，构建前取一次，put 时据此丢弃过时的结果"""
+        with self._lock:
+            return self._clock
+
+    def put(self, user_id: str, key: Hashable, context: Dict, generation: int):
+        """缓存上下文；构建开始后用户失效过或整个缓存清空过则不缓存"""
+        if self.max_entries <= 0:
+            return
+
+        with self._lock:
+            if generation < self._invalidated.get(user_id, self._floor):
+                return
+
+            full_key = (user_id, key)
+            self._entries[full_key] = (context, time.monotonic() + self.ttl)
+            self._entries.move_to_end(full_key)
+            self._keys_by_user.setdefault(user_id, set()).add(full_key)
+
+            while len(self._entries) > self.max_entries:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.stats["evictions"] += 1
+
+    def invalidate(self, user_id: str):
+        """丢弃用户的全部缓存上下文"""
+        with self._lock:
+            self._clock += 1
+            self._invalidated[user_id] = self._clock
+            for full_key in self._keys_by_user.pop(user_id, ()):
+                self._entries.pop(full_key, None)
+                self.stats["invalidations"] += 1
+
+            # 只写不读的用户没有缓存条目可淘汰，失效记录超过上限时整体并入 _floor
+            if len(self._invalidated) > self.max_entries:
+                self._floor = self._clock
+                self._invalidated.clear()
+
+    def clear(self):
+        """清空缓存；正在构建的上下文也不再缓存"""
+        with self._lock:
+            self._clock += 1
+            self._floor = self._clock
+            self._invalidated.clear()
+            self._entries.clear()
+            self._keys_by_user.clear()
+
+    def metrics(self) -> Dict:
+        """命中率等统计，用于评估缓存大小"""
+        with self._lock:
+            lookups = self.stats["hits"] + self.stats["misses"]
+            return dict(
+                self.stats,
+                size=len(self._entries),
+                max_entries=self.max_entries,
+                hit_rate=self.stats["hits"] / lookups if lookups else 0.0
+            )
+
+    def _remove(self, full_key):
+        """删除一个条目（调用方持有锁）；用户的最后一个条目删掉时，其失效记录并入 _floor"""
+        self._entries.pop(full_key, None)
+        user_id = full_key[0]
+        keys = self._keys_by_user.get(user_id)
+        if keys is not None:
+            keys.discard(full_key)
+            if not keys:
+                del self._keys_by_user[user_id]
+                self._floor = max(self._floor, self._invalidated.pop(user_id, 0))
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+Expiry Sweeper - 过期清理
+后台线程按计划分批删除过期行，读路径只做过滤、不再写库
+"""
+
+import atexit
+import threading
+
+from storage.migrations import now_ms
+from storage.sqlite_pool import SQLitePool
+
+
+class ExpirySweeper:
+    """过期清理器 - 每批删除有上限，批与批之间释放写锁"""
+
+    def __init__(
+        self,
+        pool: SQLitePool,
+        table: str = "short_term_memory",
+        interval_s: float = 60,
+        batch_size: int = 500
+    ):
+        """
+        interval_s: 两轮清理之间的间隔
+        batch_size: 每个删除事务最多删除的行数
+        """
+        self.table = table
+        self.interval = interval_s
+        self.batch_size = batch_size
+        self._pool = pool
+        self._sweep_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._closed = False
+
+        self.stats = {"sweeps": 0, "batches": 0, "deleted": 0, "errors": 0}
+
+        self._thread = threading.Thread(target=self._run, name="expiry-sweeper", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    # ==================== 公共接口 ====================
+
+    def sweep(self) -> int:
+        """删除当前所有过期行，返回删除行数"""
+        deleted = 0
+        now = now_ms()
+        with self._sweep_lock:
+            while True:
+                with self._pool.write() as conn:
+                    # 走 expires_at 索引，每批只锁住 batch_size 行的删除
+                    cursor = conn.execute(f'''
+                        DELETE FROM {self.table} WHERE id IN (
+                            SELECT id FROM {self.table} WHERE expires_at < ? LIMIT ?
+                        )
+                    ''', (now, self.batch_size))
+                self.stats["batches"] += 1
+                deleted += cursor.rowcount
+                if cursor.rowcount < self.batch_size:
+                    break
+
+        self.stats["sweeps"] += 1
+        self.stats["deleted"] += deleted
+        return deleted
+
+    def close(self):
+        """停止后台线程"""
+        if self._closed:
+            return
+        self._closed = True
+        self._wakeup.set()
+        self._thread.join()
+        atexit.unregister(self.close)
+
+    # ==================== 后台清理 ====================
+
+    def _run(self):
+        """后台线程：每隔 interval 清理一轮"""
+        while not self._closed:
+            self._wakeup.wait(self.interval)
+            if self._closed:
+                break
+            try:
+                self.sweep()
+            except Exception:
+                self.stats["errors"] += 1
@@ -4,9 +4,11 @@ Framework Library - 乐谱库
 存储各种人生分析框架的知识库
 """
 
-from typing import Dict, List, Optional
+from typing import Dict, FrozenSet, List, Optional
 from dataclasses import dataclass, field
 
+from storage.tokenizer import segment
+
 
 @dataclass
 class AnalysisFramework:
@@ -26,6 +28,14 @@ class FrameworkLibrary:
     def __init__(self):
         self.frameworks: Dict[str, AnalysisFramework] = {}
         self._load_default_frameworks()
+        self._build_keyword_index()
+    
+    def _build_keyword_index(self):
+        """预先把每个框架的关键词切成词元集合"""
+        self._keyword_tokens: Dict[str, List[FrozenSet[str]]] = {
+            name: [frozenset(segment(keyword)) for keyword in framework.keywords if segment(keyword)]
+            for name, framework in self.frameworks.items()
+        }
     
     def _load_default_frameworks(self):
         """加载默认框架"""
@@ -213,12 +223,12 @@ Big Five 框架解读指南：
         return list(self.frameworks.keys())
     
     def search_framework(self, query: str) -> Optional[str]:
-        """根据查询搜索合适的框架"""
-        query_lower = query.lower()
+        """根据查询搜索合适的框架（关键词的词元全部出现在查询中即命中）"""
+        query_tokens = set(segment(query))
         
         # 检查每个框架的关键词
-        for name, framework in self.frameworks.items():
-            if any(keyword in query_lower for keyword in framework.keywords):
+        for name, keyword_sets in self._keyword_tokens.items():
+            if any(tokens <= query_tokens for tokens in keyword_sets):
                 return name
         
         # 默认返回通用框架
@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+"""
+Hot Tier - 最近短期记忆的内存层
+每个用户在内存里保留最近若干条短期记忆（写穿透），取最近记忆时不访问数据库
+
+跨进程一致性：
+- short_term_versions 表由触发器维护每个用户的版本号，任何连接的增删改都会递增
+- 专用只读连接上的 PRAGMA data_version 只读共享内存，库没有任何提交时直接命中；
+  有提交时再按主键查一次该用户的版本号，变了才重新加载
+"""
+
+import bisect
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional
+
+from storage.migrations import now_ms
+from storage.sqlite_pool import SQLitePool
+
+
+class RecentRecord:
+    """一条短期记忆（字段与 short_term_memory 的列一致）"""
+
+    __slots__ = ('id', 'user_id', 'content', 'content_type', 'importance', 'timestamp', 'expires_at', 'metadata')
+
+    def __init__(self, row):
+        for field in self.__slots__:
+            setattr(self, field, row[field])
+
+    def to_dict(self) -> Dict:
+        # 读路径上每条结果调用一次，写成字面量比按 __slots__ 循环 getattr 快得多
+        return {
+            'id': self.id,
+            'user_id': self.user_id,
+            'content': self.content,
+            'content_type': self.content_type,
+            'importance': self.importance,
+            'timestamp': self.timestamp,
+            'expires_at': self.expires_at,
+            'metadata': self.metadata,
+        }
+
+
+class _UserBuffer:
+    """一个用户的环形缓冲区，按 (timestamp, id) 升序"""
+
+    __slots__ = ('records', 'keys', 'version', 'checked', 'complete')
+
+    def __init__(self, records: List[RecentRecord], version: int, checked: int, complete: bool):
+        self.records = records
+        self.keys = [(record.timestamp, record.id) for record in records]
+        self.version = version
+        # 最近一次确认版本号时看到的 data_version
+        self.checked = checked
+        # 缓冲区是否装下了该用户的全部短期记忆（是则任意 limit / 类型过滤都可直接回答）
+        self.complete = complete
+
+
+class RecentMemoryTier:
+    """最近短期记忆的写穿透内存层 - 每用户定长环形缓冲 + 全局条数上限 + 按用户 LRU 淘汰"""
+
+    def __init__(
+        self,
+        pool: SQLitePool,
+        table: str = "short_term_memory",
+        per_user: int = 50,
+        max_records: int = 100000,
+        decode: Optional[Callable] = None
+    ):
+        """
+        per_user: 每个用户缓存的最近记忆条数，get_recent_memories 的 limit 超过它时直接查库
+        max_records: 所有用户合计的缓存条数上限，超出时淘汰最久未访问的用户
+        decode: 从库里加载时解码 content 列（压缩存储时缓存解压后的文本）
+        """
+        self.table = table
+        self.per_user = per_user
+        self.max_records = max_records
+        self.decode = decode
+        self._pool = pool
+        self._buffers: "OrderedDict[str, _UserBuffer]" = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self._watch = None
+        self._watch_lock = threading.Lock()
+
+        # validations: 库有提交后按主键复核版本号的次数；reloads: 版本变化后的重新加载
+        self.stats = {"hits": 0, "misses": 0, "loads": 0, "validations": 0, "reloads": 0, "evictions": 0}
+
+    @property
+    def enabled(self) -> bool:
+        return self.per_user > 0 and self.max_records > 0
+
+    # ==================== 读 ====================
+
+    def recent(self, user_id: str, limit: int, content_type: Optional[str] = None) -> Optional[List[Dict]]:
+        """最近的未过期短期记忆（新的在前）；内存层无法回答时返回 None，由调用方查库"""
+        if not self.enabled or limit > self.per_user:
+            self.stats["misses"] += 1
+            return None
+
+        data_version = self._data_version()
+        with self._lock:
+            buffer = self._buffers.get(user_id)
+            if buffer is not None:
+                self._buffers.move_to_end(user_id)
+
+        # 库在上次确认之后有过提交：复核该用户的版本号（先取 data_version 再取版本号，不会漏掉提交）
+        if buffer is not None and buffer.checked != data_version:
+            self.stats["validations"] += 1
+            if self._user_version(user_id) == buffer.version:
+                buffer.checked = data_version
+            else:
+                self.invalidate(user_id)
+                self.stats["reloads"] += 1
+                buffer = None
+
+        if buffer is None:
+            buffer = self._load(user_id, data_version)
+
+        now = now_ms()
+        result = []
+        with self._lock:
+            for record in reversed(buffer.records):
+                if record.expires_at is not None and record.expires_at < now:
+                    continue
+                if content_type and record.content_type != content_type:
+                    continue
+                result.append(record.to_dict())
+                if len(result) >= limit:
+                    break
+
+        # 缓冲区只有最近 per_user 条时，过滤后不够 limit 条的结果可能漏掉更早的行
+        if len(result) < limit and not buffer.complete:
+            self.stats["misses"] += 1
+            return None
+
+        self.stats["hits"] += 1
+        return result
+
+    def _load(self, user_id: str, data_version: int) -> _UserBuffer:
+        """从库里加载一个用户最近的 per_user 条记忆和对应的版本号（同一个读快照）"""
+        with self._pool.read() as conn:
+            conn.execute('BEGIN')
+            rows = conn.execute(f'''
+                SELECT * FROM {self.table} WHERE user_id = ?
+                ORDER BY timestamp DESC, id DESC LIMIT ?
+            ''', (user_id, self.per_user + 1)).fetchall()
+            version = self.current_version(conn, user_id)
+
+        complete = len(rows) <= self.per_user
+        records = [RecentRecord(row) for row in reversed(rows[:self.per_user])]
+        if self.decode is not None:
+            for record in records:
+                record.content = self.decode(record.content)
+        buffer = _UserBuffer(records, version, data_version, complete)
+        self.stats["loads"] += 1
+
+        with self._lock:
+            self._drop(user_id)
+            self._buffers[user_id] = buffer
+            self._size += len(records)
+            self._evict()
+        return buffer
+
+    # ==================== 写穿透 ====================
+
+    @staticmethod
+    def current_version(conn, user_id: str) -> int:
+        """用户的短期记忆版本号（写入方在自己的写事务里读取）"""
+        row = conn.execute('SELECT version FROM short_term_versions WHERE user_id = ?', (user_id,)).fetchone()
+        return row[0] if row else 0
+
+    def added(self, user_id: str, row: Dict, version: int):
+        """
+        写入提交后追加到缓冲区；version 是写事务里读到的新版本号
+        中间有其它写入（版本号不连续）时丢弃缓冲区，下次读取重新加载
+        """
+        if not self.enabled:
+            return
+
+        with self._lock:
+            buffer = self._buffers.get(user_id)
+            if buffer is None:
+                return
+            if buffer.version != version - 1:
+                self._drop(user_id)
+                return
+
+            record = RecentRecord(row)
+            key = (record.timestamp, record.id)
+            index = bisect.bisect(buffer.keys, key)
+            buffer.keys.insert(index, key)
+            buffer.records.insert(index, record)
+            self._size += 1
+            buffer.version = version
+
+            if len(buffer.records) > self.per_user:
+                del buffer.keys[0]
+                del buffer.records[0]
+                self._size -= 1
+                buffer.complete = False
+            self._buffers.move_to_end(user_id)
+            self._evict()
+
+    def invalidate(self, user_id: str):
+        """丢弃一个用户的缓冲区"""
+        with self._lock:
+            self._drop(user_id)
+
+    def clear(self):
+        """清空内存层"""
+        with self._lock:
+            self._buffers.clear()
+            self._size = 0
+
+    def metrics(self) -> Dict:
+        """命中率和占用，用于评估 per_user / max_records"""
+        with self._lock:
+            lookups = self.stats["hits"] + self.stats["misses"]
+            return dict(
+                self.stats,
+                users=len(self._buffers),
+                records=self._size,
+                max_records=self.max_records,
+                hit_rate=self.stats["hits"] / lookups if lookups else 0.0
+            )
+
+    def close(self):
+        """关闭专用连接（连接池关闭时也会关闭它）"""
+        with self._watch_lock:
+            if self._watch is not None:
+                self._watch.close()
+                self._watch = None
+
+    # ==================== 内部 ====================
+
+    def _data_version(self) -> int:
+        """专用连接上的 PRAGMA data_version：其它任何连接（含其它进程）提交后都会变化"""
+        with self._watch_lock:
+            if self._watch is None:
+                self._watch = self._pool.open_reader()
+            return self._watch.execute('PRAGMA data_version').fetchone()[0]
+
+    def _user_version(self, user_id: str) -> int:
+        with self._watch_lock:
+            return self.current_version(self._watch, user_id)
+
+    def _drop(self, user_id: str):
+        """删除一个用户的缓冲区（调用方持有锁）"""
+        buffer = self._buffers.pop(user_id, None)
+        if buffer is not None:
+            self._size -= len(buffer.records)
+
+    def _evict(self):
+        """超出全局上限时淘汰最久未访问的用户（调用方持有锁）"""
+        while self._size > self.max_records and self._buffers:
+            oldest = next(iter(self._buffers))
+            self._drop(oldest)
+            self.stats["evictions"] += 1
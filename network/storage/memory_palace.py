@@ -5,94 +5,664 @@ Memory Palace - 记忆殿堂
 支持语义搜索、上下文检索和长期记忆管理
 """
 
-import sqlite3
 import json
+import re
 from pathlib import Path
-from typing import List, Dict, Optional, Tuple
-from datetime import datetime, timedelta
+from typing import Iterator, List, Dict, Optional, Tuple
+from datetime import datetime
 import hashlib
 
+from storage.access_stats import AccessAccumulator
+from storage.async_db import AsyncStoreMixin, async_method
+from storage.consolidation import MemoryConsolidator
+from storage.context_cache import ContextCache
+from storage.expiry_sweeper import ExpirySweeper
+from storage.hot_tier import RecentMemoryTier
+from storage.memory_transfer import LONG_TERM_COLUMNS, SHORT_TERM_COLUMNS, MemoryTransfer, dump_lines, load_lines
+from storage.memory_stats import check_memory_stats, create_memory_stats, rebuild_memory_stats
+from storage.migrations import apply_migrations, now_ms, rebuild_table
+from storage.quota import QuotaEnforcer
+from storage.relevance import RelevanceScorer
+from storage.semantic_index import HashingEmbedder, SemanticIndex
+from storage.sqlite_pool import SQLitePool
+from storage.text_codec import TextCodec, create_codec_table
+from storage.tokenizer import extract_keywords, is_cjk, search_text, segment
 
-class MemoryPalace:
+
+def _migrate_base_tables(conn):
+    """v1: 基础表和索引"""
+    cursor = conn.cursor()
+    
+    # 短期记忆表 (最近的对话和交互)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS short_term_memory (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id TEXT NOT NULL,
+            content TEXT NOT NULL,
+            content_type TEXT DEFAULT 'message',
+            importance REAL DEFAULT 0.5,
+            timestamp TEXT NOT NULL,
+            expires_at TEXT,
+            metadata TEXT DEFAULT '{}'
+        )
+    ''')
+    
+    # 长期记忆表 (重要的洞察和模式)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS long_term_memory (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id TEXT NOT NULL,
+            memory_type TEXT NOT NULL,
+            content TEXT NOT NULL,
+            keywords TEXT NOT NULL,
+            importance REAL DEFAULT 0.7,
+            access_count INTEGER DEFAULT 0,
+            last_accessed TEXT,
+            created_at TEXT NOT NULL,
+            metadata TEXT DEFAULT '{}'
+        )
+    ''')
+    
+    # 用户画像表 (用户的持久特征和偏好)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS user_profiles (
+            user_id TEXT PRIMARY KEY,
+            personality_traits TEXT DEFAULT '{}',
+            preferences TEXT DEFAULT '{}',
+            goals TEXT DEFAULT '[]',
+            frameworks_used TEXT DEFAULT '[]',
+            interaction_stats TEXT DEFAULT '{}',
+            created_at TEXT NOT NULL,
+            updated_at TEXT NOT NULL
+        )
+    ''')
+    
+    # 关联记忆表 (记忆之间的关联)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS memory_associations (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            memory_id_1 INTEGER NOT NULL,
+            memory_id_2 INTEGER NOT NULL,
+            association_type TEXT NOT NULL,
+            strength REAL DEFAULT 0.5,
+            created_at TEXT NOT NULL,
+            FOREIGN KEY (memory_id_1) REFERENCES long_term_memory(id),
+            FOREIGN KEY (memory_id_2) REFERENCES long_term_memory(id)
+        )
+    ''')
+    
+    # 创建索引
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_stm_user ON short_term_memory(user_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_stm_timestamp ON short_term_memory(timestamp)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_ltm_user ON long_term_memory(user_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_ltm_type ON long_term_memory(memory_type)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_ltm_keywords ON long_term_memory(keywords)')
+
+
+
+# ==================== 全文索引 ====================
+
+def _fts_query(user_id: str, keywords: List[str]) -> Optional[str]:
+    """
+    构造 FTS5 查询：限定用户，任一关键词命中即可
+    中文关键词匹配相邻二元组短语，英文关键词按前缀匹配（与原 LIKE '%kw%' 行为接近）
+    """
+    phrases = []
+    for keyword in keywords:
+        tokens = segment(keyword)
+        if not tokens:
+            continue
+        phrase = '"' + ' '.join(tokens) + '"'
+        if not is_cjk(tokens[-1]):
+            phrase += '*'
+        phrases.append(phrase)
+
+    if not phrases:
+        return None
+
+    query = '{keywords search_text} : (' + ' OR '.join(phrases) + ')'
+    user_tokens = re.findall(r'[^\W_]+', user_id.lower())
+    if user_tokens:
+        query = 'user_id : "' + ' '.join(user_tokens) + '" AND ' + query
+    return query
+
+
+def _migrate_fts(conn):
+    """v2: 长期记忆全文索引（FTS5 外部内容表 + 触发器同步）"""
+    conn.execute("ALTER TABLE long_term_memory ADD COLUMN search_text TEXT NOT NULL DEFAULT ''")
+    
+    rows = conn.execute('SELECT id, content, keywords FROM long_term_memory').fetchall()
+    conn.executemany(
+        'UPDATE long_term_memory SET search_text = ? WHERE id = ?',
+        [(search_text(row[1], row[2]), row[0]) for row in rows]
+    )
+    
+    conn.execute('''
+        CREATE VIRTUAL TABLE long_term_memory_fts USING fts5(
+            user_id, keywords, search_text,
+            content='long_term_memory', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2'
+        )
+    ''')
+    
+    conn.execute('''
+        CREATE TRIGGER ltm_fts_insert AFTER INSERT ON long_term_memory BEGIN
+            INSERT INTO long_term_memory_fts (rowid, user_id, keywords, search_text)
+            VALUES (new.id, new.user_id, new.keywords, new.search_text);
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER ltm_fts_delete AFTER DELETE ON long_term_memory BEGIN
+            INSERT INTO long_term_memory_fts (long_term_memory_fts, rowid, user_id, keywords, search_text)
+            VALUES ('delete', old.id, old.user_id, old.keywords, old.search_text);
+        END
+    ''')
+    # 只在索引列变化时更新，access_count 等统计列的更新不碰索引
+    conn.execute('''
+        CREATE TRIGGER ltm_fts_update AFTER UPDATE OF user_id, keywords, search_text ON long_term_memory BEGIN
+            INSERT INTO long_term_memory_fts (long_term_memory_fts, rowid, user_id, keywords, search_text)
+            VALUES ('delete', old.id, old.user_id, old.keywords, old.search_text);
+            INSERT INTO long_term_memory_fts (rowid, user_id, keywords, search_text)
+            VALUES (new.id, new.user_id, new.keywords, new.search_text);
+        END
+    ''')
+    
+    conn.execute("INSERT INTO long_term_memory_fts (long_term_memory_fts) VALUES ('rebuild')")
+
+
+def _migrate_embeddings(conn):
+    """v3: 长期记忆语义向量表（随长期记忆删除）"""
+    conn.execute('''
+        CREATE TABLE memory_embeddings (
+            memory_id INTEGER PRIMARY KEY,
+            user_id TEXT NOT NULL,
+            vector BLOB NOT NULL,
+            FOREIGN KEY (memory_id) REFERENCES long_term_memory(id)
+        )
+    ''')
+    conn.execute('CREATE INDEX idx_embeddings_user ON memory_embeddings(user_id, memory_id)')
+    
+    # 每个用户的向量版本号，语义索引据此判断内存缓存是否过期
+    conn.execute('''
+        CREATE TABLE memory_embedding_versions (
+            user_id TEXT PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    for event, row in (('INSERT', 'new'), ('DELETE', 'old')):
+        conn.execute(f'''
+            CREATE TRIGGER embedding_version_{event.lower()} AFTER {event} ON memory_embeddings BEGIN
+                INSERT INTO memory_embedding_versions (user_id, version) VALUES ({row}.user_id, 1)
+                ON CONFLICT (user_id) DO UPDATE SET version = version + 1;
+            END
+        ''')
+    conn.execute('''
+        CREATE TRIGGER ltm_embedding_delete AFTER DELETE ON long_term_memory BEGIN
+            DELETE FROM memory_embeddings WHERE memory_id = old.id;
+        END
+    ''')
+    
+    embedder = HashingEmbedder()
+    rows = conn.execute('SELECT id, user_id, content, keywords FROM long_term_memory').fetchall()
+    conn.executemany(
+        'INSERT INTO memory_embeddings (memory_id, user_id, vector) VALUES (?, ?, ?)',
+        [(row[0], row[1], embedder.embed(f'{row[3]} {row[2]}')) for row in rows]
+    )
+
+
+def _migrate_expiry_index(conn):
+    """v4: 短期记忆过期清理和按用户取最近记忆的索引"""
+    conn.execute('CREATE INDEX idx_stm_expires ON short_term_memory(expires_at)')
+    conn.execute('CREATE INDEX idx_stm_user_ts ON short_term_memory(user_id, timestamp)')
+
+
+def _migrate_association_indexes(conn):
+    """v5: 关联表两个方向的邻接索引（覆盖遍历需要的列）"""
+    conn.execute('CREATE INDEX idx_assoc_m1 ON memory_associations(memory_id_1, strength, memory_id_2)')
+    conn.execute('CREATE INDEX idx_assoc_m2 ON memory_associations(memory_id_2, strength, memory_id_1)')
+
+
+def _migrate_consolidation(conn):
+    """v6: 长期记忆 SimHash 指纹列和记忆整理的增量水位线"""
+    conn.execute('ALTER TABLE long_term_memory ADD COLUMN simhash INTEGER')
+    conn.execute('''
+        CREATE TABLE consolidation_state (
+            name TEXT PRIMARY KEY,
+            last_id INTEGER NOT NULL,
+            updated_at TEXT NOT NULL
+        )
+    ''')
+
+
+def _migrate_relevance(conn):
+    """v7: 长期记忆持久化相关度列和按用户取 top-k 的索引（分数在初始化时按评分参数补算）"""
+    conn.execute('ALTER TABLE long_term_memory ADD COLUMN relevance REAL')
+    conn.execute('CREATE INDEX idx_ltm_user_relevance ON long_term_memory(user_id, relevance DESC)')
+    conn.execute('''
+        CREATE TABLE settings (
+            name TEXT PRIMARY KEY,
+            value TEXT NOT NULL
+        )
+    ''')
+
+
+def _migrate_short_term_versions(conn):
+    """v8: 每个用户短期记忆的版本号（触发器维护），最近记忆内存层据此判断是否过期"""
+    conn.execute('''
+        CREATE TABLE short_term_versions (
+            user_id TEXT PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    bump = '''
+        INSERT INTO short_term_versions (user_id, version) SELECT {row}.user_id, 1 WHERE {condition}
+        ON CONFLICT (user_id) DO UPDATE SET version = version + 1;
+    '''
+    for event, row in (('INSERT', 'new'), ('DELETE', 'old')):
+        conn.execute(f'''
+            CREATE TRIGGER stm_version_{event.lower()} AFTER {event} ON short_term_memory BEGIN
+                {bump.format(row=row, condition='1')}
+            END
+        ''')
+    conn.execute(f'''
+        CREATE TRIGGER stm_version_update AFTER UPDATE ON short_term_memory BEGIN
+            {bump.format(row='old', condition='1')}
+            {bump.format(row='new', condition='new.user_id != old.user_id')}
+        END
+    ''')
+
+
+def _migrate_memory_quotas(conn):
+    """v9: 按用户覆盖的长期记忆配额"""
+    conn.execute('''
+        CREATE TABLE memory_quotas (
+            user_id TEXT PRIMARY KEY,
+            max_long_term INTEGER
+        )
+    ''')
+
+
+def _migrate_memory_stats(conn):
+    """v10: 触发器维护的按用户记忆统计（按现有数据回填）"""
+    create_memory_stats(conn)
+
+
+def _migrate_epoch_ms(conn):
+    """v11: 短期 / 长期记忆的时间列改为 epoch 毫秒整数，按 (user_id, 时间) 的复合索引取最近记忆"""
+    # 被新索引取代的单列索引，以及引用生成列的元数据索引（启动时按声明重建）不随表重建
+    obsolete = ['idx_stm_user', 'idx_stm_timestamp', 'idx_stm_expires', 'idx_ltm_user']
+    obsolete += [row[0] for row in conn.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'index' AND name GLOB 'idx_[ls]tm_meta_*'"
+    )]
+    for name in obsolete:
+        conn.execute(f'DROP INDEX IF EXISTS {name}')
+    
+    rebuild_table(conn, 'short_term_memory', '''
+        CREATE TABLE {table} (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id TEXT NOT NULL,
+            content TEXT NOT NULL,
+            content_type TEXT DEFAULT 'message',
+            importance REAL DEFAULT 0.5,
+            timestamp INTEGER NOT NULL,
+            expires_at INTEGER,
+            metadata TEXT DEFAULT '{{}}'
+        )
+    ''', '''
+        SELECT id, user_id, content, content_type, importance,
+               COALESCE(iso_to_ms(timestamp), 0), iso_to_ms(expires_at), metadata
+        FROM short_term_memory
+    ''')
+    
+    rebuild_table(conn, 'long_term_memory', '''
+        CREATE TABLE {table} (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id TEXT NOT NULL,
+            memory_type TEXT NOT NULL,
+            content TEXT NOT NULL,
+            keywords TEXT NOT NULL,
+            importance REAL DEFAULT 0.7,
+            access_count INTEGER DEFAULT 0,
+            last_accessed INTEGER,
+            created_at INTEGER NOT NULL,
+            metadata TEXT DEFAULT '{{}}',
+            search_text TEXT NOT NULL DEFAULT '',
+            simhash INTEGER,
+            relevance REAL
+        )
+    ''', '''
+        SELECT id, user_id, memory_type, content, keywords, importance, access_count,
+               iso_to_ms(last_accessed), COALESCE(iso_to_ms(created_at), 0),
+               metadata, search_text, simhash, relevance
+        FROM long_term_memory
+    ''')
+    
+    # 取最近记忆按 (timestamp DESC, id DESC)：反向扫描升序索引正好是这个顺序（rowid 在索引末尾），
+    # 建成 DESC 索引反而要为 id 排序；带类型过滤的查询用第二个索引
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_stm_user_ts ON short_term_memory(user_id, timestamp)')
+    conn.execute('CREATE INDEX idx_stm_user_type_ts ON short_term_memory(user_id, content_type, timestamp)')
+    # 过期清理和统计里扣除过期行都只需要 (expires_at, user_id, id)，覆盖索引不回表
+    conn.execute('CREATE INDEX idx_stm_expires ON short_term_memory(expires_at, user_id)')
+
+
+def _migrate_codec_dictionaries(conn):
+    """v12: 文本压缩字典"""
+    create_codec_table(conn)
+
+
+MIGRATIONS = [
+    (1, "base tables", _migrate_base_tables),
+    (2, "long-term memory FTS5 index", _migrate_fts),
+    (3, "long-term memory embeddings", _migrate_embeddings),
+    (4, "short-term memory expiry and recency indexes", _migrate_expiry_index),
+    (5, "memory association adjacency indexes", _migrate_association_indexes),
+    (6, "memory consolidation fingerprints", _migrate_consolidation),
+    (7, "persisted long-term memory relevance", _migrate_relevance),
+    (8, "short-term memory versions", _migrate_short_term_versions),
+    (9, "per-user long-term memory quotas", _migrate_memory_quotas),
+    (10, "materialized memory statistics", _migrate_memory_stats),
+    (11, "epoch-ms memory timestamps and (user_id, time) indexes", _migrate_epoch_ms),
+    (12, "text compression dictionaries", _migrate_codec_dictionaries),
+]
+
+
+# 返回给调用方的列（与导出格式一致）；search_text、simhash、relevance 和元数据生成列是内部列，不随结果返回
+_LTM_COLUMNS = ', '.join(LONG_TERM_COLUMNS)
+_LTM_COLUMNS_AS_LTM = ', '.join('ltm.' + column for column in LONG_TERM_COLUMNS)
+_STM_COLUMNS = ', '.join(SHORT_TERM_COLUMNS)
+
+# 固定的查询语句：每个连接的语句缓存会复用它们的预编译结果
+_PROFILE_SQL = 'SELECT * FROM user_profiles WHERE user_id = ?'
+
+_IMPORTANT_SQL = f'''
+    SELECT {_LTM_COLUMNS} FROM long_term_memory 
+    WHERE user_id = ? AND importance >= ?
+    ORDER BY importance DESC, access_count DESC
+    LIMIT ?
+'''
+
+
+# 用户画像的 JSON 列及其默认值
+_PROFILE_JSON_COLUMNS = {
+    'personality_traits': "'{}'",
+    'preferences': "'{}'",
+    'goals': "'[]'",
+    'frameworks_used': "'[]'",
+    'interaction_stats': "'{}'",
+}
+
+_PROFILE_OPS = ('replace', 'set', 'add', 'increment')
+
+
+def _json_path(key: str) -> str:
+    """对象字段的 JSON 路径"""
+    if '"' in key:
+        raise ValueError(f"unsupported profile key: {key!r}")
+    return f'$."{key}"'
+
+
+# 可以声明索引的元数据字段名（会拼进列名、索引名和 JSON 路径）
+_METADATA_FIELD_PATTERN = re.compile(r'[A-Za-z_][A-Za-z0-9_]*')
+
+
+def _metadata_expr(field: str, alias: str = '') -> str:
+    """元数据字段的取值表达式（查询里必须与索引定义逐字一致才会用上表达式索引）"""
+    return f"json_extract({alias}metadata, '$.{field}')"
+
+
+def _create_metadata_indexes(conn, fields: Tuple[str, ...]):
+    """
+    为声明的元数据字段建索引（幂等，每次启动执行；已有的列和索引不动）
+    - 长期记忆：虚拟生成列 meta_<字段>，索引 (user_id, meta_<字段>, relevance DESC)
+    - 短期记忆：同一表达式上的表达式索引 (user_id, 表达式, timestamp)；
+      不加生成列，行的列和内存层缓存的记录保持一致
+    """
+    columns = {row[1] for row in conn.execute('PRAGMA table_xinfo(long_term_memory)')}
+    for field in fields:
+        if f'meta_{field}' not in columns:
+            conn.execute(f'''
+                ALTER TABLE long_term_memory ADD COLUMN meta_{field}
+                GENERATED ALWAYS AS ({_metadata_expr(field)}) VIRTUAL
+            ''')
+        conn.execute(f'''
+            CREATE INDEX IF NOT EXISTS idx_ltm_meta_{field}
+            ON long_term_memory(user_id, meta_{field}, relevance DESC)
+        ''')
+        conn.execute(f'''
+            CREATE INDEX IF NOT EXISTS idx_stm_meta_{field}
+            ON short_term_memory(user_id, {_metadata_expr(field)}, timestamp)
+        ''')
+
+
+def _profile_column_expr(column: str, base: str, ops: Dict) -> Tuple[str, List]:
+    """
+    在 base（现有列值或默认值）上叠加修改，得到新列值的 SQL 表达式
+    顺序：replace -> set -> increment -> add
+    """
+    expr, params = base, []
+    
+    if column in ops.get('replace', {}):
+        expr, params = 'json(?)', [json.dumps(ops['replace'][column])]
+    
+    fields = ops.get('set', {}).get(column)
+    if fields:
+        pairs = ', '.join('?, json(?)' for _ in fields)
+        expr = f'json_set({expr}, {pairs})'
+        for key, value in fields.items():
+            params += [_json_path(key), json.dumps(value)]
+    
+    counters = ops.get('increment', {}).get(column)
+    if counters:
+        # 在前面修改后的中间结果上累加
+        pairs = ', '.join('?, COALESCE(json_extract(v, ?), 0) + ?' for _ in counters)
+        expr = f'(WITH base(v) AS (SELECT {expr}) SELECT json_set(v, {pairs}) FROM base)'
+        for key, amount in counters.items():
+            path = _json_path(key)
+            params += [path, path, amount]
+    
+    items = ops.get('add', {}).get(column)
+    if items:
+        # 保持原有顺序，只追加还没有的元素
+        expr = f'''(
+            WITH base(v) AS (SELECT {expr})
+            SELECT json_group_array(value) FROM (
+                SELECT 0 AS src, key, value FROM base, json_each(base.v)
+                UNION ALL
+                SELECT 1, key, value FROM json_each(?)
+                WHERE value NOT IN (SELECT value FROM base, json_each(base.v))
+                ORDER BY src, key
+            )
+        )'''
+        params.append(json.dumps(list(dict.fromkeys(items))))
+    
+    return expr, params
+
+
+def _profile_upsert(update: Dict) -> Tuple[str, List]:
+    """一个画像更新 -> 一条 INSERT ... ON CONFLICT DO UPDATE 语句"""
+    columns = set()
+    for op in _PROFILE_OPS:
+        for column in update.get(op, {}):
+            if column not in _PROFILE_JSON_COLUMNS:
+                raise ValueError(f"unknown profile column: {column}")
+            columns.add(column)
+    columns = sorted(columns)
+    
+    now = datetime.now().isoformat()
+    insert_exprs, insert_params = [], []
+    update_sets, update_params = [], []
+    for column in columns:
+        expr, params = _profile_column_expr(column, _PROFILE_JSON_COLUMNS[column], update)
+        insert_exprs.append(expr)
+        insert_params += params
+        expr, params = _profile_column_expr(column, column, update)
+        update_sets.append(f'{column} = {expr}')
+        update_params += params
+    update_sets.append('updated_at = excluded.updated_at')
+    
+    # 只有集合并时，元素都已存在就不写（最常见的"框架已用过"不产生写入）
+    guard, guard_params = '', []
+    if not any(update.get(op) for op in ('replace', 'set', 'increment')) and columns:
+        conditions = []
+        for column in columns:
+            conditions.append(
+                f'EXISTS (SELECT 1 FROM json_each(?) WHERE value NOT IN (SELECT value FROM json_each({column})))'
+            )
+            guard_params.append(json.dumps(list(update['add'][column])))
+        guard = 'WHERE ' + ' OR '.join(conditions)
+    
+    sql = f'''
+        INSERT INTO user_profiles (user_id, created_at, updated_at{''.join(', ' + c for c in columns)})
+        SELECT ?, ?, ?{''.join(', ' + e for e in insert_exprs)}
+        WHERE true
+        ON CONFLICT (user_id) DO UPDATE SET {', '.join(update_sets)} {guard}
+    '''
+    return sql, [update["user_id"], now, now] + insert_params + update_params + guard_params
+
+
+# 一层邻居：frontier 中每个节点的双向边
+_NEIGHBOR_EDGES_SQL = '''
+    SELECT memory_id_1, memory_id_2, strength FROM memory_associations
+    WHERE memory_id_1 IN (SELECT value FROM json_each(?)) AND strength >= ?
+    UNION ALL
+    SELECT memory_id_2, memory_id_1, strength FROM memory_associations
+    WHERE memory_id_2 IN (SELECT value FROM json_each(?)) AND strength >= ?
+'''
+
+
+class MemoryPalace(AsyncStoreMixin):
     """记忆殿堂 - 轻量级记忆存储系统"""
     
-    def __init__(self, db_path="data/memory_palace.db"):
+    # 按用户分片时需要整体迁移的表：(表名, 选出某个用户数据的条件)，
+    # 依赖其它表的放在后面；short_term_versions 不迁移，版本号在每个库里只增不减；
+    # memory_stats 不迁移，两边的计数由触发器随行的插入和删除维护
+    SHARD_TABLES = (
+        ("user_profiles", "user_id = ?"),
+        ("short_term_memory", "user_id = ?"),
+        ("long_term_memory", "user_id = ?"),
+        ("memory_embedding_versions", "user_id = ?"),
+        ("memory_embeddings", "user_id = ?"),
+        ("memory_associations", "memory_id_1 IN (SELECT id FROM long_term_memory WHERE user_id = ?)"),
+        ("memory_quotas", "user_id = ?"),
+    )
+    
+    # 分片之间共用的表：迁移用户前整表复制到目标分片（已有的行不动），不从源分片删除
+    SHARD_SHARED_TABLES = ("codec_dictionaries",)
+    
+    # 可以压缩的文本列
+    TEXT_COLUMNS = (
+        ("short_term_memory", "content"),
+        ("long_term_memory", "content"),
+    )
+    
+    def __init__(
+        self,
+        db_path="data/memory_palace.db",
+        max_readers=4,
+        busy_timeout_ms=5000,
+        semantic_index: Optional[SemanticIndex] = None,
+        access_flush_interval_ms=1000,
+        expiry_sweep_interval_s=60,
+        expiry_batch_size=500,
+        context_cache_size=256,
+        context_cache_ttl_s=10,
+        relevance_scorer: Optional[RelevanceScorer] = None,
+        recent_per_user=50,
+        recent_max_records=100000,
+        long_term_quota: Optional[int] = None,
+        quota_interval_s=30,
+        quota_batch_size=500,
+        eviction_archive_dir=None,
+        indexed_metadata_fields=(),
+        compress_text=False,
+        compress_min_length=200
+    ):
+        """
+        indexed_metadata_fields: 建索引的元数据字段（如 ("framework",)），
+            metadata_filters 按这些字段过滤时走索引，其它字段逐行解析 JSON
+        compress_text: 新写入的记忆内容按库里最新的字典压缩（见 text_codec），
+            不短于 compress_min_length 字节的才压缩；已压缩的行无论是否开启都能读取
+        """
         self.db_path = Path(db_path)
+        for field in indexed_metadata_fields:
+            if not _METADATA_FIELD_PATTERN.fullmatch(field):
+                raise ValueError(f"unsupported metadata field: {field!r}")
+        self.indexed_metadata_fields = tuple(indexed_metadata_fields)
+        self.semantic_index = semantic_index or SemanticIndex()
+        self.relevance_scorer = relevance_scorer or RelevanceScorer()
         self.db_path.parent.mkdir(exist_ok=True)
+        self._pool = SQLitePool(
+            self.db_path,
+            max_readers=max_readers,
+            busy_timeout_ms=busy_timeout_ms
+        )
         self._init_db()
-    
-    def _init_db(self):
-        """初始化数据库"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        # 短期记忆表 (最近的对话和交互)
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS short_term_memory (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id TEXT NOT NULL,
-                content TEXT NOT NULL,
-                content_type TEXT DEFAULT 'message',
-                importance REAL DEFAULT 0.5,
-                timestamp TEXT NOT NULL,
-                expires_at TEXT,
-                metadata TEXT DEFAULT '{}'
-            )
-        ''')
         
-        # 长期记忆表 (重要的洞察和模式)
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS long_term_memory (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id TEXT NOT NULL,
-                memory_type TEXT NOT NULL,
-                content TEXT NOT NULL,
-                keywords TEXT NOT NULL,
-                importance REAL DEFAULT 0.7,
-                access_count INTEGER DEFAULT 0,
-                last_accessed TEXT,
-                created_at TEXT NOT NULL,
-                metadata TEXT DEFAULT '{}'
-            )
-        ''')
+        # 记忆内容写入时压缩，只有返回给调用方的行才解压
+        self.text_codec = TextCodec(self._pool, enabled=compress_text, min_length=compress_min_length)
         
-        # 用户画像表 (用户的持久特征和偏好)
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS user_profiles (
-                user_id TEXT PRIMARY KEY,
-                personality_traits TEXT DEFAULT '{}',
-                preferences TEXT DEFAULT '{}',
-                goals TEXT DEFAULT '[]',
-                frameworks_used TEXT DEFAULT '[]',
-                interaction_stats TEXT DEFAULT '{}',
-                created_at TEXT NOT NULL,
-                updated_at TEXT NOT NULL
-            )
-        ''')
+        # build_context 的结果按 (用户, 话题关键词) 缓存，该用户写入时失效
+        self._context_cache = ContextCache(max_entries=context_cache_size, ttl_s=context_cache_ttl_s)
         
-        # 关联记忆表 (记忆之间的关联)
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS memory_associations (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                memory_id_1 INTEGER NOT NULL,
-                memory_id_2 INTEGER NOT NULL,
-                association_type TEXT NOT NULL,
-                strength REAL DEFAULT 0.5,
-                created_at TEXT NOT NULL,
-                FOREIGN KEY (memory_id_1) REFERENCES long_term_memory(id),
-                FOREIGN KEY (memory_id_2) REFERENCES long_term_memory(id)
-            )
-        ''')
+        # 检索只在内存里记访问次数，定期批量写回
+        # 写回访问次数的同一个事务里重算这些记忆的相关度
+        self._access = AccessAccumulator(
+            self._pool,
+            flush_interval_ms=access_flush_interval_ms,
+            on_flush=self.relevance_scorer.rescore_ids
+        )
         
-        # 创建索引
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_stm_user ON short_term_memory(user_id)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_stm_timestamp ON short_term_memory(timestamp)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_ltm_user ON long_term_memory(user_id)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_ltm_type ON long_term_memory(memory_type)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_ltm_keywords ON long_term_memory(keywords)')
+        # 每个用户最近的短期记忆写穿透缓存在内存里，取最近记忆不查库
+        self._recent = RecentMemoryTier(
+            self._pool,
+            per_user=recent_per_user,
+            max_records=recent_max_records,
+            decode=self.text_codec.decode
+        )
+        
+        # 长期记忆超出配额的用户由后台淘汰相关度最低的记忆，写入路径只登记用户
+        self._quota = QuotaEnforcer(
+            self._pool,
+            default_quota=long_term_quota,
+            interval_s=quota_interval_s,
+            batch_size=quota_batch_size,
+            archive_dir=eviction_archive_dir,
+            on_evict=self._context_cache.invalidate,
+            decode=self.text_codec.decode
+        )
         
-        conn.commit()
-        conn.close()
+        # 过期的短期记忆由后台分批删除，读路径只过滤
+        self._sweeper = ExpirySweeper(
+            self._pool,
+            interval_s=expiry_sweep_interval_s,
+            batch_size=expiry_batch_size
+        )
+    
+    def close(self):
+        """停止后台清理，写回访问统计，关闭数据库线程池和连接池"""
+        self._sweeper.close()
+        self._quota.close()
+        self._access.close()
+        self._recent.close()
+        self._shutdown_db_executor()
+        self._pool.close()
+    
+    def _init_db(self):
+        """初始化数据库（执行尚未应用的版本迁移）"""
+        with self._pool.write() as conn:
+            apply_migrations(conn, MIGRATIONS)
+            _create_metadata_indexes(conn, self.indexed_metadata_fields)
+            row = conn.execute("SELECT value FROM settings WHERE name = 'relevance_scorer'").fetchone()
+        
+        # 评分参数变了（或刚迁移完）就按新参数全量重算
+        config = self.relevance_scorer.config()
+        if row is None or row[0] != config:
+            self.relevance_scorer.rescore_all(self._pool)
+            with self._pool.write() as conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO settings (name, value) VALUES ('relevance_scorer', ?)",
+                    (config,)
+                )
     
     # ==================== 短期记忆管理 ====================
     
@@ -106,69 +676,105 @@ class MemoryPalace:
         metadata: Dict = None
     ) -> int:
         """添加短期记忆"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        now = datetime.now()
-        expires_at = now + timedelta(hours=ttl_hours)
-        
-        cursor.execute('''
-            INSERT INTO short_term_memory 
-            (user_id, content, content_type, importance, timestamp, expires_at, metadata)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-        ''', (
-            user_id,
-            content,
-            content_type,
-            importance,
-            now.isoformat(),
-            expires_at.isoformat(),
-            json.dumps(metadata or {})
-        ))
-        
-        memory_id = cursor.lastrowid
-        conn.commit()
-        conn.close()
-        
-        return memory_id
+        now = now_ms()
+        row = {
+            "user_id": user_id,
+            "content": content,
+            "content_type": content_type,
+            "importance": importance,
+            "timestamp": now,
+            "expires_at": now + int(ttl_hours * 3600 * 1000),
+            "metadata": json.dumps(metadata or {})
+        }
+        
+        with self._pool.write() as conn:
+            cursor = conn.execute('''
+                INSERT INTO short_term_memory 
+                (user_id, content, content_type, importance, timestamp, expires_at, metadata)
+                VALUES (:user_id, :content, :content_type, :importance, :timestamp, :expires_at, :metadata)
+            ''', dict(row, content=self.text_codec.encode(content)))
+            version = RecentMemoryTier.current_version(conn, user_id)
+        
+        row["id"] = cursor.lastrowid
+        self._recent.added(user_id, row, version)
+        self._context_cache.invalidate(user_id)
+        return cursor.lastrowid
     
     def get_recent_memories(
         self, 
         user_id: str, 
         limit: int = 10,
-        content_type: Optional[str] = None
+        content_type: Optional[str] = None,
+        metadata_filters: Optional[Dict] = None
     ) -> List[Dict]:
-        """获取最近的短期记忆"""
-        conn = sqlite3.connect(self.db_path)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        
-        # 清理过期记忆
-        self._cleanup_expired_memories(cursor)
-        
-        query = '''
-            SELECT * FROM short_term_memory 
-            WHERE user_id = ?
+        """
+        获取最近的短期记忆（已过期未清理的行直接过滤掉；优先由内存层回答）
+        metadata_filters: 元数据字段的等值过滤，如 {"framework": "MBTI"}（带过滤时直接查库）
+        """
+        if not metadata_filters:
+            memories = self._recent.recent(user_id, limit, content_type)
+            if memories is not None:
+                return memories
+        
+        query, params = self._recent_query(user_id, limit, content_type, metadata_filters)
+        with self._pool.read() as conn:
+            rows = conn.execute(query, params).fetchall()
+        
+        return self._decoded(rows)
+    
+    def _recent_query(
+        self,
+        user_id: str,
+        limit: int,
+        content_type: Optional[str] = None,
+        metadata_filters: Optional[Dict] = None
+    ) -> Tuple[str, List]:
+        """最近短期记忆的查询语句和参数"""
+        query = f'''
+            SELECT {_STM_COLUMNS} FROM short_term_memory 
+            WHERE user_id = ? AND (expires_at IS NULL OR expires_at >= ?)
         '''
-        params = [user_id]
+        params = [user_id, now_ms()]
         
         if content_type:
             query += ' AND content_type = ?'
             params.append(content_type)
         
-        query += ' ORDER BY timestamp DESC LIMIT ?'
-        params.append(limit)
-        
-        cursor.execute(query, params)
-        rows = cursor.fetchall()
-        conn.close()
+        conditions, condition_params = self._metadata_conditions(metadata_filters, long_term=False)
+        query += conditions
+        params += condition_params
         
-        return [dict(row) for row in rows]
+        # 毫秒时间戳会重复，按 id 决定先后（与内存层的顺序一致）
+        query += ' ORDER BY timestamp DESC, id DESC LIMIT ?'
+        params.append(limit)
+        return query, params
     
-    def _cleanup_expired_memories(self, cursor):
-        """清理过期的短期记忆"""
-        now = datetime.now().isoformat()
-        cursor.execute('DELETE FROM short_term_memory WHERE expires_at < ?', (now,))
+    def _metadata_conditions(
+        self,
+        metadata_filters: Optional[Dict],
+        long_term: bool,
+        alias: str = ''
+    ) -> Tuple[str, List]:
+        """
+        元数据等值过滤 -> 追加到 WHERE 的条件和参数
+        声明过索引的字段用生成列（长期记忆）或与表达式索引一致的表达式（短期记忆），
+        其它字段逐行 json_extract；值按 IS 比较，None 匹配缺失的字段
+        """
+        conditions, params = '', []
+        for field, value in (metadata_filters or {}).items():
+            if field not in self.indexed_metadata_fields:
+                conditions += f' AND json_extract({alias}metadata, ?) IS ?'
+                params.append(_json_path(field))
+            elif long_term:
+                conditions += f' AND {alias}meta_{field} IS ?'
+            else:
+                conditions += f' AND {_metadata_expr(field, alias)} IS ?'
+            params.append(value)
+        return conditions, params
+    
+    def cleanup_expired_memories(self) -> int:
+        """立即清理过期的短期记忆（通常由后台清理器定期执行），返回删除行数"""
+        return self._sweeper.sweep()
     
     # ==================== 长期记忆管理 ====================
     
@@ -182,136 +788,210 @@ class MemoryPalace:
         metadata: Dict = None
     ) -> int:
         """添加长期记忆"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
         keywords_str = ','.join(keywords)
+        vector = self.semantic_index.embed(f'{keywords_str} {content}')
+        created_at = now_ms()
+        
+        with self._pool.write() as conn:
+            cursor = conn.execute('''
+                INSERT INTO long_term_memory
+                (user_id, memory_type, content, keywords, importance, created_at, metadata, search_text, relevance)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (
+                user_id,
+                memory_type,
+                self.text_codec.encode(content),
+                keywords_str,
+                importance,
+                created_at,
+                json.dumps(metadata or {}),
+                search_text(content, keywords_str),
+                self.relevance_scorer.score(importance, 0, created_at)
+            ))
+            conn.execute(
+                'INSERT INTO memory_embeddings (memory_id, user_id, vector) VALUES (?, ?, ?)',
+                (cursor.lastrowid, user_id, vector)
+            )
         
-        cursor.execute('''
-            INSERT INTO long_term_memory 
-            (user_id, memory_type, content, keywords, importance, created_at, metadata)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-        ''', (
-            user_id,
-            memory_type,
-            content,
-            keywords_str,
-            importance,
-            datetime.now().isoformat(),
-            json.dumps(metadata or {})
-        ))
-        
-        memory_id = cursor.lastrowid
-        conn.commit()
-        conn.close()
-        
-        return memory_id
+        self._quota.touch(user_id)
+        self._context_cache.invalidate(user_id)
+        return cursor.lastrowid
     
     def search_memories(
         self,
         user_id: str,
         keywords: List[str],
         memory_type: Optional[str] = None,
-        limit: int = 5
+        limit: int = 5,
+        metadata_filters: Optional[Dict] = None
     ) -> List[Dict]:
-        """搜索长期记忆（基于关键词）"""
-        conn = sqlite3.connect(self.db_path)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        
-        # 构建搜索条件
-        query = '''
-            SELECT *, 
-                   (importance * access_count * 0.1) as relevance_score
-            FROM long_term_memory 
-            WHERE user_id = ?
-        '''
-        params = [user_id]
-        
-        if memory_type:
-            query += ' AND memory_type = ?'
-            params.append(memory_type)
-        
-        # 关键词匹配
-        if keywords:
-            keyword_conditions = []
-            for keyword in keywords:
-                keyword_conditions.append('keywords LIKE ?')
-                params.append(f'%{keyword}%')
+        """
+        搜索长期记忆（FTS5 全文检索，BM25 与重要度加权排序）
+        没有关键词时按持久化的相关度取 top-k（索引范围扫描）
+        metadata_filters: 元数据字段的等值过滤，声明过索引的字段走 (user_id, 字段, relevance) 索引
+        """
+        query, params = self._search_query(user_id, keywords, memory_type, limit, metadata_filters)
+        with self._pool.read() as conn:
+            rows = conn.execute(query, params).fetchall()
+        
+        self._access.record(row['id'] for row in rows)
+        return self._search_results(rows)
+    
+    def _search_query(
+        self,
+        user_id: str,
+        keywords: List[str],
+        memory_type: Optional[str],
+        limit: int,
+        metadata_filters: Optional[Dict] = None
+    ) -> Tuple[str, List]:
+        """关键词搜索的查询语句和参数"""
+        match = _fts_query(user_id, keywords) if keywords else None
+        
+        if match:
+            # bm25() 越小越相关，取反后乘以重要度加权；user_id 列只用于过滤，不参与打分
+            query = f'''
+                SELECT {_LTM_COLUMNS_AS_LTM},
+                       -bm25(long_term_memory_fts, 0.0, 2.0, 1.0) * (0.5 + ltm.importance) as relevance_score
+                FROM long_term_memory_fts
+                JOIN long_term_memory ltm ON ltm.id = long_term_memory_fts.rowid
+                WHERE long_term_memory_fts MATCH ? AND ltm.user_id = ?
+            '''
+            params = [match, user_id]
             
-            query += ' AND (' + ' OR '.join(keyword_conditions) + ')'
-        
-        query += ' ORDER BY relevance_score DESC, importance DESC LIMIT ?'
-        params.append(limit)
-        
-        cursor.execute(query, params)
-        rows = cursor.fetchall()
-        
-        # 更新访问计数
-        for row in rows:
-            cursor.execute('''
-                UPDATE long_term_memory 
-                SET access_count = access_count + 1,
-                    last_accessed = ?
-                WHERE id = ?
-            ''', (datetime.now().isoformat(), row['id']))
+            if memory_type:
+                query += ' AND ltm.memory_type = ?'
+                params.append(memory_type)
+            
+            conditions, condition_params = self._metadata_conditions(metadata_filters, long_term=True, alias='ltm.')
+            query += conditions
+            params += condition_params
+            
+            query += ' ORDER BY relevance_score DESC, ltm.importance DESC LIMIT ?'
+            params.append(limit)
+        else:
+            # 沿 (user_id, relevance DESC) 索引取前 limit 条，relevance_score 由 _search_results 换算
+            query = f'SELECT {_LTM_COLUMNS}, relevance FROM long_term_memory WHERE user_id = ?'
+            params = [user_id]
+            
+            if memory_type:
+                query += ' AND memory_type = ?'
+                params.append(memory_type)
+            
+            conditions, condition_params = self._metadata_conditions(metadata_filters, long_term=True)
+            query += conditions
+            params += condition_params
+            
+            query += ' ORDER BY relevance DESC LIMIT ?'
+            params.append(limit)
         
-        conn.commit()
-        conn.close()
+        return query, params
+    
+    def _decoded(self, rows) -> List[Dict]:
+        """结果行转成字典并解压内容（只解压返回给调用方的行）"""
+        return [self.text_codec.decode_row(dict(row)) for row in rows]
+    
+    def _search_results(self, rows) -> List[Dict]:
+        """搜索结果转成字典；按持久化相关度排序的结果把 relevance 换算成此刻衰减后的 relevance_score"""
+        results = self._decoded(rows)
+        for result in results:
+            if 'relevance_score' not in result:
+                relevance = result.pop('relevance')
+                result['relevance_score'] = 0.0 if relevance is None else self.relevance_scorer.current(relevance)
+        return results
+    
+    def recompute_relevance(self, user_id: Optional[str] = None) -> int:
+        """按当前评分参数重算相关度（可限定用户），返回行数"""
+        count = self.relevance_scorer.rescore_all(self._pool, user_id)
+        if user_id is None:
+            self._context_cache.clear()
+        else:
+            self._context_cache.invalidate(user_id)
+        return count
+    
+    def semantic_search(
+        self,
+        user_id: str,
+        query: str,
+        limit: int = 5
+    ) -> List[Dict]:
+        """语义搜索长期记忆（本地向量余弦相似度），结果带 similarity 字段"""
+        with self._pool.read() as conn:
+            memories = self._semantic_memories(conn, user_id, query, limit)
         
-        return [dict(row) for row in rows]
+        self._access.record(memory['id'] for memory in memories)
+        return memories
+    
+    def _semantic_memories(self, conn, user_id: str, query: str, limit: int) -> List[Dict]:
+        """在给定连接上做语义搜索"""
+        hits = self.semantic_index.search(conn, user_id, query, limit=limit)
+        if not hits:
+            return []
+        
+        similarity = dict(hits)
+        placeholders = ','.join('?' * len(hits))
+        rows = conn.execute(
+            f'SELECT {_LTM_COLUMNS} FROM long_term_memory WHERE id IN ({placeholders})',
+            list(similarity)
+        ).fetchall()
+        
+        rows.sort(key=lambda row: similarity[row['id']], reverse=True)
+        return [self.text_codec.decode_row(dict(row, similarity=similarity[row['id']])) for row in rows]
+    
+    def flush_access_stats(self):
+        """立即写回累计的访问统计"""
+        self._access.flush()
+    
+    def get_access_stats(self) -> Dict:
+        """访问统计累加器的计数（coalesced 为被合并掉的 UPDATE 数）"""
+        return dict(self._access.stats, pending=self._access.pending_count())
     
     def get_important_memories(
         self,
         user_id: str,
         min_importance: float = 0.7,
-        limit: int = 10
+        limit: int = 10,
+        metadata_filters: Optional[Dict] = None
     ) -> List[Dict]:
-        """获取重要的长期记忆"""
-        conn = sqlite3.connect(self.db_path)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT * FROM long_term_memory 
-            WHERE user_id = ? AND importance >= ?
-            ORDER BY importance DESC, access_count DESC
-            LIMIT ?
-        ''', (user_id, min_importance, limit))
-        
-        rows = cursor.fetchall()
-        conn.close()
-        
-        return [dict(row) for row in rows]
+        """获取重要的长期记忆（metadata_filters 同 search_memories）"""
+        query, params = _IMPORTANT_SQL, [user_id, min_importance, limit]
+        if metadata_filters:
+            conditions, condition_params = self._metadata_conditions(metadata_filters, long_term=True)
+            query = f'''
+                SELECT {_LTM_COLUMNS} FROM long_term_memory
+                WHERE user_id = ? AND importance >= ?{conditions}
+                ORDER BY importance DESC, access_count DESC
+                LIMIT ?
+            '''
+            params = [user_id, min_importance] + condition_params + [limit]
+        
+        with self._pool.read() as conn:
+            rows = conn.execute(query, params).fetchall()
+        
+        return self._decoded(rows)
     
     # ==================== 用户画像管理 ====================
     
     def get_or_create_profile(self, user_id: str) -> Dict:
         """获取或创建用户画像"""
-        conn = sqlite3.connect(self.db_path)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        
-        cursor.execute('SELECT * FROM user_profiles WHERE user_id = ?', (user_id,))
-        row = cursor.fetchone()
+        with self._pool.read() as conn:
+            row = conn.execute(_PROFILE_SQL, (user_id,)).fetchone()
         
         if row:
-            conn.close()
             return dict(row)
         
         # 创建新画像
         now = datetime.now().isoformat()
-        cursor.execute('''
-            INSERT INTO user_profiles 
-            (user_id, created_at, updated_at)
-            VALUES (?, ?, ?)
-        ''', (user_id, now, now))
-        
-        conn.commit()
-        
-        cursor.execute('SELECT * FROM user_profiles WHERE user_id = ?', (user_id,))
-        row = cursor.fetchone()
-        conn.close()
+        with self._pool.write() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                INSERT OR IGNORE INTO user_profiles 
+                (user_id, created_at, updated_at)
+                VALUES (?, ?, ?)
+            ''', (user_id, now, now))
+            
+            cursor.execute('SELECT * FROM user_profiles WHERE user_id = ?', (user_id,))
+            row = cursor.fetchone()
         
         return dict(row)
     
@@ -324,54 +1004,46 @@ class MemoryPalace:
         frameworks_used: Optional[List[str]] = None,
         interaction_stats: Optional[Dict] = None
     ):
-        """更新用户画像"""
-        profile = self.get_or_create_profile(user_id)
-        
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        updates = []
-        params = []
-        
-        if personality_traits is not None:
-            updates.append('personality_traits = ?')
-            params.append(json.dumps(personality_traits))
-        
-        if preferences is not None:
-            updates.append('preferences = ?')
-            params.append(json.dumps(preferences))
-        
-        if goals is not None:
-            updates.append('goals = ?')
-            params.append(json.dumps(goals))
-        
-        if frameworks_used is not None:
-            updates.append('frameworks_used = ?')
-            params.append(json.dumps(frameworks_used))
-        
-        if interaction_stats is not None:
-            updates.append('interaction_stats = ?')
-            params.append(json.dumps(interaction_stats))
-        
-        updates.append('updated_at = ?')
-        params.append(datetime.now().isoformat())
-        
-        params.append(user_id)
-        
-        query = f'UPDATE user_profiles SET {", ".join(updates)} WHERE user_id = ?'
-        cursor.execute(query, params)
-        
-        conn.commit()
-        conn.close()
+        """更新用户画像（整列替换，画像不存在时创建）"""
+        replace = {
+            column: value
+            for column, value in (
+                ('personality_traits', personality_traits),
+                ('preferences', preferences),
+                ('goals', goals),
+                ('frameworks_used', frameworks_used),
+                ('interaction_stats', interaction_stats),
+            )
+            if value is not None
+        }
+        self.apply_profile_updates([{"user_id": user_id, "replace": replace}])
     
     def add_framework_usage(self, user_id: str, framework: str):
-        """记录框架使用"""
-        profile = self.get_or_create_profile(user_id)
-        frameworks = json.loads(profile.get('frameworks_used', '[]'))
-        
-        if framework not in frameworks:
-            frameworks.append(framework)
-            self.update_profile(user_id, frameworks_used=frameworks)
+        """记录框架使用（在库内做集合并，并发安全）"""
+        self.apply_profile_updates([{"user_id": user_id, "add": {"frameworks_used": [framework]}}])
+    
+    def apply_profile_updates(self, updates: List[Dict]):
+        """
+        批量更新用户画像：一个事务，每个更新一条 upsert 语句，JSON 修改在库内完成
+        每个更新形如:
+            {
+                "user_id": "u1",
+                "replace": {"goals": [...]},                       # 整列替换
+                "set": {"preferences": {"language": "zh"}},        # 对象字段 json_set
+                "add": {"frameworks_used": ["SWOT"]},              # 数组集合并
+                "increment": {"interaction_stats": {"messages": 1}}  # 对象数值字段累加
+            }
+        """
+        statements = [_profile_upsert(update) for update in updates]
+        if not statements:
+            return
+        
+        with self._pool.write() as conn:
+            for sql, params in statements:
+                conn.execute(sql, params)
+        
+        for update in updates:
+            self._context_cache.invalidate(update["user_id"])
     
     # ==================== 记忆关联 ====================
     
@@ -383,52 +1055,134 @@ class MemoryPalace:
         strength: float = 0.5
     ):
         """创建记忆关联"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            INSERT INTO memory_associations 
-            (memory_id_1, memory_id_2, association_type, strength, created_at)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (
-            memory_id_1,
-            memory_id_2,
-            association_type,
-            strength,
-            datetime.now().isoformat()
-        ))
-        
-        conn.commit()
-        conn.close()
+        with self._pool.write() as conn:
+            conn.execute('''
+                INSERT INTO memory_associations 
+                (memory_id_1, memory_id_2, association_type, strength, created_at)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (
+                memory_id_1,
+                memory_id_2,
+                association_type,
+                strength,
+                datetime.now().isoformat()
+            ))
     
     def get_associated_memories(
         self,
         memory_id: int,
         min_strength: float = 0.3
     ) -> List[Dict]:
-        """获取关联的记忆"""
-        conn = sqlite3.connect(self.db_path)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT ltm.*, ma.association_type, ma.strength
-            FROM memory_associations ma
-            JOIN long_term_memory ltm ON (
-                CASE 
-                    WHEN ma.memory_id_1 = ? THEN ltm.id = ma.memory_id_2
-                    WHEN ma.memory_id_2 = ? THEN ltm.id = ma.memory_id_1
-                END
-            )
-            WHERE (ma.memory_id_1 = ? OR ma.memory_id_2 = ?)
-            AND ma.strength >= ?
-            ORDER BY ma.strength DESC
-        ''', (memory_id, memory_id, memory_id, memory_id, min_strength))
-        
-        rows = cursor.fetchall()
-        conn.close()
+        """获取关联的记忆（两个方向各走一次邻接索引）"""
+        with self._pool.read() as conn:
+            rows = conn.execute(f'''
+                SELECT {_LTM_COLUMNS_AS_LTM}, edges.association_type, edges.strength
+                FROM (
+                    SELECT memory_id_2 AS neighbor, association_type, strength
+                    FROM memory_associations
+                    WHERE memory_id_1 = ? AND strength >= ?
+                    UNION ALL
+                    SELECT memory_id_1 AS neighbor, association_type, strength
+                    FROM memory_associations
+                    WHERE memory_id_2 = ? AND strength >= ?
+                ) AS edges
+                JOIN long_term_memory ltm ON ltm.id = edges.neighbor
+                ORDER BY edges.strength DESC
+            ''', (memory_id, min_strength, memory_id, min_strength)).fetchall()
+        
+        return self._decoded(rows)
+    
+    def get_memory_neighborhood(
+        self,
+        memory_id: int,
+        depth: int = 2,
+        min_strength: float = 0.3,
+        limit: int = 20
+    ) -> List[Dict]:
+        """
+        多跳关联：depth 跳以内可达的记忆，按路径强度（沿途强度之积）降序
+        结果带 hops（最强路径的跳数）和 path_strength 字段
+        """
+        best = {memory_id: (1.0, 0)}
+        frontier = [memory_id]
+        
+        with self._pool.read() as conn:
+            conn.execute('BEGIN')
+            for hop in range(1, depth + 1):
+                if not frontier:
+                    break
+                
+                # 一层一次查询；frontier 作为 JSON 数组传入，不受参数个数限制
+                ids = json.dumps(frontier)
+                edges = conn.execute(_NEIGHBOR_EDGES_SQL, (ids, min_strength, ids, min_strength)).fetchall()
+                
+                improved = {}
+                for source, neighbor, strength in edges:
+                    path_strength = best[source][0] * strength
+                    if path_strength < min_strength:
+                        continue
+                    if path_strength > best.get(neighbor, (0.0, 0))[0] and path_strength > improved.get(neighbor, 0.0):
+                        improved[neighbor] = path_strength
+                
+                for neighbor, path_strength in improved.items():
+                    best[neighbor] = (path_strength, hop)
+                # 只有路径强度变大的节点需要继续扩展
+                frontier = list(improved)
+            
+            del best[memory_id]
+            ranked = sorted(best.items(), key=lambda item: (-item[1][0], item[1][1]))[:limit]
+            if not ranked:
+                return []
+            
+            rows = conn.execute(
+                f'SELECT {_LTM_COLUMNS} FROM long_term_memory WHERE id IN (SELECT value FROM json_each(?))',
+                (json.dumps([node for node, _ in ranked]),)
+            ).fetchall()
+        
+        by_id = {row['id']: row for row in rows}
+        return [
+            self.text_codec.decode_row(dict(by_id[node], hops=hops, path_strength=path_strength))
+            for node, (path_strength, hops) in ranked
+            if node in by_id
+        ]
+    
+    def decay_associations(
+        self,
+        factor: float = 0.95,
+        prune_below: float = 0.05,
+        batch_size: int = 10000
+    ) -> Dict:
+        """
+        关联强度整体衰减：按 id 区间分批更新，每批一个短事务；
+        衰减后低于 prune_below 的关联删除
+        """
+        result = {"updated": 0, "pruned": 0, "batches": 0}
+        last_id = 0
+        
+        while True:
+            with self._pool.write() as conn:
+                row = conn.execute(
+                    'SELECT MAX(id) FROM (SELECT id FROM memory_associations WHERE id > ? ORDER BY id LIMIT ?)',
+                    (last_id, batch_size)
+                ).fetchone()
+                if row[0] is None:
+                    break
+                
+                cursor = conn.execute(
+                    'UPDATE memory_associations SET strength = strength * ? WHERE id > ? AND id <= ?',
+                    (factor, last_id, row[0])
+                )
+                result["updated"] += cursor.rowcount
+                cursor = conn.execute(
+                    'DELETE FROM memory_associations WHERE id > ? AND id <= ? AND strength < ?',
+                    (last_id, row[0], prune_below)
+                )
+                result["pruned"] += cursor.rowcount
+            
+            result["batches"] += 1
+            last_id = row[0]
         
-        return [dict(row) for row in rows]
+        return result
     
     # ==================== 上下文构建 ====================
     
@@ -437,9 +1191,47 @@ class MemoryPalace:
         user_id: str,
         current_topic: Optional[str] = None,
         max_short_term: int = 5,
-        max_long_term: int = 3
+        max_long_term: int = 3,
+        semantic: bool = False,
+        snapshot: bool = True
     ) -> Dict:
-        """构建对话上下文"""
+        """
+        构建对话上下文（结果有缓存）
+        semantic=True 时按语义相似度召回相关长期记忆；
+        snapshot=True 时在一个读事务中读取全部内容，得到一致的快照
+        """
+        if current_topic and semantic:
+            topic_key = ('semantic', ' '.join(current_topic.lower().split()))
+        elif current_topic:
+            topic_key = ('keywords', tuple(self._extract_keywords(current_topic)))
+        else:
+            topic_key = ('important',)
+        cache_key = (topic_key, max_short_term, max_long_term)
+        
+        cached = self._context_cache.get(user_id, cache_key)
+        if cached is not None:
+            # 命中也要计入访问统计，和未命中时的检索保持一致
+            if current_topic:
+                self._access.record(row['id'] for row in cached["relevant_long_term"])
+            return self._copy_context(cached)
+        
+        generation = self._context_cache.generation(user_id)
+        if snapshot:
+            context = self._build_context_snapshot(user_id, current_topic, max_short_term, max_long_term, semantic)
+        else:
+            context = self._build_context(user_id, current_topic, max_short_term, max_long_term, semantic)
+        self._context_cache.put(user_id, cache_key, context, generation)
+        return self._copy_context(context)
+    
+    def _build_context(
+        self,
+        user_id: str,
+        current_topic: Optional[str],
+        max_short_term: int,
+        max_long_term: int,
+        semantic: bool
+    ) -> Dict:
+        """从数据库构建对话上下文"""
         context = {
             "user_id": user_id,
             "profile": self.get_or_create_profile(user_id),
@@ -449,7 +1241,13 @@ class MemoryPalace:
         }
         
         # 如果有当前话题，搜索相关长期记忆
-        if current_topic:
+        if current_topic and semantic:
+            context["relevant_long_term"] = self.semantic_search(
+                user_id,
+                current_topic,
+                limit=max_long_term
+            )
+        elif current_topic:
             keywords = self._extract_keywords(current_topic)
             context["relevant_long_term"] = self.search_memories(
                 user_id, 
@@ -465,56 +1263,184 @@ class MemoryPalace:
         
         return context
     
-    def _extract_keywords(self, text: str) -> List[str]:
-        """提取关键词（简化版）"""
-        # 移除常见停用词
-        stopwords = {'的', '了', '是', '在', '我', '有', '和', '就', '不', '人', '都', '一', '一个', '上', '也', '很', '到', '说', '要', '去', '你', '会', '着', '没有', '看', '好', '自己', '这'}
+    def _build_context_snapshot(
+        self,
+        user_id: str,
+        current_topic: Optional[str],
+        max_short_term: int,
+        max_long_term: int,
+        semantic: bool
+    ) -> Dict:
+        """在一个连接、一个读事务中构建对话上下文（不写库）"""
+        recent_query, recent_params = self._recent_query(user_id, max_short_term)
+        if current_topic and not semantic:
+            keywords = self._extract_keywords(current_topic)
+            search_query, search_params = self._search_query(user_id, keywords, None, max_long_term)
         
-        # 简单分词（按空格和标点）
-        import re
-        words = re.findall(r'\w+', text.lower())
+        with self._pool.read() as conn:
+            # 读事务内的所有查询看到同一个 WAL 快照，连接归还时结束事务
+            conn.execute('BEGIN')
+            profile = conn.execute(_PROFILE_SQL, (user_id,)).fetchone()
+            recent = conn.execute(recent_query, recent_params).fetchall()
+            
+            if current_topic and semantic:
+                relevant = self._semantic_memories(conn, user_id, current_topic, max_long_term)
+            elif current_topic:
+                relevant = self._search_results(conn.execute(search_query, search_params).fetchall())
+            else:
+                relevant = self._decoded(conn.execute(_IMPORTANT_SQL, (user_id, 0.7, max_long_term)).fetchall())
+        
+        if current_topic:
+            self._access.record(memory['id'] for memory in relevant)
         
-        # 过滤停用词和短词
-        keywords = [w for w in words if w not in stopwords and len(w) > 1]
+        # 新用户的画像在读事务结束后再创建
+        profile = dict(profile) if profile else self.get_or_create_profile(user_id)
         
-        # 返回前5个关键词
-        return keywords[:5]
+        return {
+            "user_id": user_id,
+            "profile": profile,
+            "recent_memories": self._decoded(recent),
+            "relevant_long_term": relevant,
+            "timestamp": datetime.now().isoformat()
+        }
+    
+    def _copy_context(self, context: Dict) -> Dict:
+        """复制缓存的上下文，调用方修改返回值不影响缓存"""
+        return dict(
+            context,
+            profile=dict(context["profile"]),
+            recent_memories=[dict(row) for row in context["recent_memories"]],
+            relevant_long_term=[dict(row) for row in context["relevant_long_term"]],
+            timestamp=datetime.now().isoformat()
+        )
+    
+    def get_context_cache_stats(self) -> Dict:
+        """上下文缓存的命中/未命中统计"""
+        return self._context_cache.metrics()
+    
+    def get_recent_tier_stats(self) -> Dict:
+        """最近记忆内存层的命中率、复核和淘汰统计"""
+        return self._recent.metrics()
+    
+    def _extract_keywords(self, text: str) -> List[str]:
+        """提取关键词（中英文混合分词，最多 5 个）"""
+        return extract_keywords(text, limit=5)
     
     # ==================== 统计和维护 ====================
     
+    def consolidate_memories(self, **options) -> Dict:
+        """
+        整理记忆（增量）：合并近似重复的长期记忆，提升反复出现的短期主题
+        options 传给 MemoryConsolidator（max_distance, min_occurrences 等）
+        """
+        return MemoryConsolidator(self, **options).run()
+    
+    def export_user(self, user_id: str) -> Iterator[str]:
+        """流式导出一个用户的画像、长期记忆、关联和短期记忆（NDJSON 行，第一行是 header）"""
+        return dump_lines(MemoryTransfer(self).export_users([user_id]))
+    
+    def import_users(self, stream: Iterator[str], **options) -> Dict:
+        """
+        从 NDJSON 行流（文件对象等）导入 export_user 的输出，可以是多个用户的拼接
+        options 传给 MemoryTransfer（batch_size, transaction_rows），返回行数和 rows_per_second
+        """
+        result = MemoryTransfer(self, **options).import_records(load_lines(stream))
+        self._quota.request_full_scan()
+        return result
+    
+    def set_user_quota(self, user_id: str, max_long_term: Optional[int]):
+        """设置用户的长期记忆配额（覆盖默认配额；None 表示该用户不限）"""
+        with self._pool.write() as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO memory_quotas (user_id, max_long_term) VALUES (?, ?)',
+                (user_id, max_long_term)
+            )
+        self._quota.touch(user_id)
+    
+    def enforce_quotas(self, user_id: Optional[str] = None) -> int:
+        """立即执行配额淘汰（通常由后台线程执行），返回淘汰行数"""
+        return self._quota.enforce(None if user_id is None else [user_id])
+    
+    def get_quota_stats(self) -> Dict:
+        """配额淘汰的统计（evicted 为淘汰行数，archived 为写入归档的行数）"""
+        return dict(self._quota.stats)
+    
     def get_memory_stats(self, user_id: str) -> Dict:
-        """获取记忆统计"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        stats = {}
-        
-        # 短期记忆数量
-        cursor.execute(
-            'SELECT COUNT(*) FROM short_term_memory WHERE user_id = ?',
-            (user_id,)
-        )
-        stats['short_term_count'] = cursor.fetchone()[0]
-        
-        # 长期记忆数量
-        cursor.execute(
-            'SELECT COUNT(*) FROM long_term_memory WHERE user_id = ?',
-            (user_id,)
-        )
-        stats['long_term_count'] = cursor.fetchone()[0]
-        
-        # 按类型统计长期记忆
-        cursor.execute('''
-            SELECT memory_type, COUNT(*) as count
-            FROM long_term_memory 
-            WHERE user_id = ?
-            GROUP BY memory_type
-        ''', (user_id,))
-        stats['memory_by_type'] = dict(cursor.fetchall())
+        """获取记忆统计（读物化的 memory_stats）"""
+        return self.get_memory_stats_many([user_id])[user_id]
+    
+    def get_memory_stats_many(self, user_ids: List[str]) -> Dict[str, Dict]:
+        """批量获取记忆统计：{user_id: get_memory_stats 的结果}，一个读事务两条查询"""
+        user_list = json.dumps(list(user_ids))
+        stats = {
+            user_id: {'short_term_count': 0, 'long_term_count': 0, 'memory_by_type': {}}
+            for user_id in user_ids
+        }
         
-        conn.close()
+        with self._pool.read() as conn:
+            conn.execute('BEGIN')
+            rows = conn.execute('''
+                SELECT user_id, scope, memory_type, count FROM memory_stats
+                WHERE user_id IN (SELECT value FROM json_each(?)) AND count > 0
+            ''', (user_list,)).fetchall()
+            # 已过期但还没被清理的短期记忆不计入：后台清理让这部分行保持很少，
+            # 固定走 expires_at 索引只扫这一小段（按 user_id 查会扫用户的全部短期记忆）
+            expired = conn.execute('''
+                SELECT user_id, COUNT(*) FROM short_term_memory INDEXED BY idx_stm_expires
+                WHERE expires_at < ? AND user_id IN (SELECT value FROM json_each(?))
+                GROUP BY user_id
+            ''', (now_ms(), user_list)).fetchall()
+        
+        for user_id, scope, memory_type, count in rows:
+            user_stats = stats[user_id]
+            if scope == 'short_term':
+                user_stats['short_term_count'] += count
+            else:
+                user_stats['long_term_count'] += count
+                user_stats['memory_by_type'][memory_type] = count
+        for user_id, count in expired:
+            stats[user_id]['short_term_count'] -= count
         
         return stats
+    
+    def check_memory_stats(self, repair: bool = False) -> Dict:
+        """检查物化统计与原表是否一致；repair=True 时在同一个写事务里全量重建"""
+        if not repair:
+            with self._pool.read() as conn:
+                return {"mismatches": check_memory_stats(conn), "repaired": False}
+        
+        with self._pool.write() as conn:
+            mismatches = check_memory_stats(conn)
+            if mismatches:
+                rebuild_memory_stats(conn)
+        return {"mismatches": mismatches, "repaired": bool(mismatches)}
+    
+    # ==================== 异步接口 ====================
+    
+    aadd_short_term_memory = async_method(add_short_term_memory)
+    aget_recent_memories = async_method(get_recent_memories)
+    acleanup_expired_memories = async_method(cleanup_expired_memories)
+    aadd_long_term_memory = async_method(add_long_term_memory)
+    asearch_memories = async_method(search_memories)
+    asemantic_search = async_method(semantic_search)
+    arecompute_relevance = async_method(recompute_relevance)
+    aget_important_memories = async_method(get_important_memories)
+    aget_or_create_profile = async_method(get_or_create_profile)
+    aupdate_profile = async_method(update_profile)
+    aadd_framework_usage = async_method(add_framework_usage)
+    aapply_profile_updates = async_method(apply_profile_updates)
+    acreate_association = async_method(create_association)
+    aget_associated_memories = async_method(get_associated_memories)
+    aget_memory_neighborhood = async_method(get_memory_neighborhood)
+    adecay_associations = async_method(decay_associations)
+    abuild_context = async_method(build_context)
+    aget_memory_stats = async_method(get_memory_stats)
+    aget_memory_stats_many = async_method(get_memory_stats_many)
+    acheck_memory_stats = async_method(check_memory_stats)
+    aconsolidate_memories = async_method(consolidate_memories)
+    aimport_users = async_method(import_users)
+    aset_user_quota = async_method(set_user_quota)
+    aenforce_quotas = async_method(enforce_quotas)
 
 
 # 全局实例
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Memory Stats - 记忆统计物化表
+memory_stats 按 (用户, 范围, 记忆类型) 保存行数，由 short_term_memory / long_term_memory 上的触发器维护；
+这里是建表、全量重建和一致性检查（也可以作为命令行工具运行）
+"""
+
+import argparse
+import json
+from typing import Dict, List
+
+
+# 从原表现算的统计，和 memory_stats 的列一一对应
+ACTUAL_STATS_SQL = '''
+    SELECT user_id, 'short_term' AS scope, '' AS memory_type, COUNT(*) AS count
+    FROM short_term_memory GROUP BY user_id
+    UNION ALL
+    SELECT user_id, 'long_term', memory_type, COUNT(*)
+    FROM long_term_memory GROUP BY user_id, memory_type
+'''
+
+_BUMP = '''
+    INSERT INTO memory_stats (user_id, scope, memory_type, count) VALUES ({user}, '{scope}', {memory_type}, {delta})
+    ON CONFLICT (user_id, scope, memory_type) DO UPDATE SET count = count + {delta};
+'''
+
+
+def create_memory_stats(conn):
+    """建表、建触发器并按现有数据回填（在迁移事务中调用）"""
+    conn.execute('''
+        CREATE TABLE memory_stats (
+            user_id TEXT NOT NULL,
+            scope TEXT NOT NULL,
+            memory_type TEXT NOT NULL,
+            count INTEGER NOT NULL,
+            PRIMARY KEY (user_id, scope, memory_type)
+        ) WITHOUT ROWID
+    ''')
+
+    for table, scope, memory_type in (
+        ('short_term_memory', 'short_term', None),
+        ('long_term_memory', 'long_term', 'memory_type'),
+    ):
+        def bump(row, delta):
+            return _BUMP.format(
+                user=f'{row}.user_id',
+                scope=scope,
+                memory_type=f'{row}.{memory_type}' if memory_type else "''",
+                delta=delta
+            )
+
+        conn.execute(f'''
+            CREATE TRIGGER {scope}_stats_insert AFTER INSERT ON {table} BEGIN
+                {bump('new', 1)}
+            END
+        ''')
+        conn.execute(f'''
+            CREATE TRIGGER {scope}_stats_delete AFTER DELETE ON {table} BEGIN
+                {bump('old', -1)}
+            END
+        ''')
+        # 只有计数依据的列变化时才需要挪动计数
+        columns = 'user_id, memory_type' if memory_type else 'user_id'
+        conn.execute(f'''
+            CREATE TRIGGER {scope}_stats_update AFTER UPDATE OF {columns} ON {table} BEGIN
+                {bump('old', -1)}
+                {bump('new', 1)}
+            END
+        ''')
+
+    rebuild_memory_stats(conn)
+
+
+def rebuild_memory_stats(conn):
+    """按原表全量重算（调用方负责事务）"""
+    conn.execute('DELETE FROM memory_stats')
+    conn.execute(f'INSERT INTO memory_stats (user_id, scope, memory_type, count) {ACTUAL_STATS_SQL}')
+
+
+def check_memory_stats(conn) -> List[Dict]:
+    """比较物化统计和原表，返回不一致的 (user_id, scope, memory_type, stored, actual)"""
+    rows = conn.execute(f'''
+        WITH actual AS ({ACTUAL_STATS_SQL}),
+        keys AS (
+            SELECT user_id, scope, memory_type FROM actual
+            UNION
+            SELECT user_id, scope, memory_type FROM memory_stats WHERE count != 0
+        )
+        SELECT k.user_id, k.scope, k.memory_type,
+               COALESCE(s.count, 0) AS stored, COALESCE(a.count, 0) AS actual
+        FROM keys k
+        LEFT JOIN memory_stats s USING (user_id, scope, memory_type)
+        LEFT JOIN actual a USING (user_id, scope, memory_type)
+        WHERE COALESCE(s.count, 0) != COALESCE(a.count, 0)
+    ''').fetchall()
+    return [dict(row) for row in rows]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Symphony 记忆统计检查/重建")
+    parser.add_argument("command", choices=["check", "rebuild"])
+    parser.add_argument("--db", default="data/memory_palace.db")
+    args = parser.parse_args()
+
+    from storage.memory_palace import MemoryPalace
+    palace = MemoryPalace(args.db)
+    result = palace.check_memory_stats(repair=args.command == "rebuild")
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    palace.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,427 @@
+#!/usr/bin/env python3
+"""
+Memory Transfer - 记忆导入导出
+按用户把画像、长期记忆（含语义向量）、关联和短期记忆流式导出为 NDJSON，
+或从 NDJSON 流批量导入；导出按批读取，导入时内存占用与单个用户的长期记忆数有关（id 映射），与文件大小无关
+
+每行一个 JSON 对象，kind 字段区分类型，第一行是 header：
+    {"kind": "header", "format": "memory_palace", ...}
+    {"kind": "profile", "user_id": ..., ...}
+    {"kind": "long_term", "id": ..., "vector": "<base64>", ...}
+    {"kind": "association", "memory_id_1": ..., "memory_id_2": ..., ...}
+    {"kind": "short_term", ...}
+同一用户的记录连续出现，长期记忆在关联和短期记忆之前（导入时据此重映射 id）；
+长期 / 短期记忆的时间列是 epoch 毫秒，导入旧版导出文件时把 ISO 时间字符串换算过来
+"""
+
+import argparse
+import base64
+import gzip
+import io
+import itertools
+import json
+import sys
+import time
+from datetime import datetime
+from typing import Dict, Iterable, Iterator, List, Optional
+
+from storage.migrations import iso_to_ms
+from storage.tokenizer import search_text
+
+
+FORMAT = "memory_palace"
+
+PROFILE_COLUMNS = (
+    'user_id', 'personality_traits', 'preferences', 'goals', 'frameworks_used',
+    'interaction_stats', 'created_at', 'updated_at'
+)
+LONG_TERM_COLUMNS = (
+    'id', 'user_id', 'memory_type', 'content', 'keywords', 'importance',
+    'access_count', 'last_accessed', 'created_at', 'metadata'
+)
+ASSOCIATION_COLUMNS = ('memory_id_1', 'memory_id_2', 'association_type', 'strength', 'created_at')
+SHORT_TERM_COLUMNS = (
+    'id', 'user_id', 'content', 'content_type', 'importance', 'timestamp', 'expires_at', 'metadata'
+)
+
+# 导入时刷新缓冲的顺序：关联依赖长期记忆的新 id
+_KINDS = ('profile', 'long_term', 'association', 'short_term')
+
+# 长期记忆连同语义向量一起读出（导出和淘汰归档共用）
+LONG_TERM_SELECT = f'''
+    SELECT {", ".join('ltm.' + c for c in LONG_TERM_COLUMNS)}, e.vector
+    FROM long_term_memory ltm LEFT JOIN memory_embeddings e ON e.memory_id = ltm.id
+'''
+
+
+# 导出时按向量表的 (user_id, memory_id) 索引分批读长期记忆；第一列 id 即键集游标
+LONG_TERM_BY_EMBEDDING = f'''
+    SELECT {", ".join('ltm.' + c for c in LONG_TERM_COLUMNS)}, e.vector
+    FROM memory_embeddings e JOIN long_term_memory ltm ON ltm.id = e.memory_id
+'''
+
+
+def header() -> Dict:
+    """导出流的第一条记录"""
+    return {"kind": "header", "format": FORMAT, "exported_at": datetime.now().isoformat()}
+
+
+def long_term_record(row, decode=None) -> Dict:
+    """LONG_TERM_SELECT 读出的一行 -> 导出记录（向量转 base64，decode 解码压缩存储的内容）"""
+    record = dict(row, kind="long_term")
+    if decode is not None:
+        record['content'] = decode(record['content'])
+    vector = record.pop('vector')
+    if vector is not None:
+        record['vector'] = base64.b64encode(vector).decode('ascii')
+    return record
+
+
+class MemoryTransfer:
+    """记忆导入导出 - 导出按键集分批流式读取，导入分批 executemany，多批合成一个大事务"""
+
+    def __init__(self, palace, batch_size: int = 1000, transaction_rows: int = 50000):
+        """
+        batch_size: 每次 executemany 的行数
+        transaction_rows: 每个写事务处理的记录数（事务之间释放写锁）
+        """
+        self.palace = palace
+        self.batch_size = batch_size
+        self.transaction_rows = transaction_rows
+
+    # ==================== 导出 ====================
+
+    def export_users(self, user_ids: Optional[Iterable[str]] = None) -> Iterator[Dict]:
+        """导出多个用户（默认全部），第一条是 header"""
+        yield header()
+        for user_id in (self.user_ids() if user_ids is None else user_ids):
+            yield from self.export_user(user_id)
+
+    def export_user(self, user_id: str) -> Iterator[Dict]:
+        """
+        导出一个用户的全部记录（内容解压成文本）
+        各表按键集分批读取，每批最多 batch_size 行、单独借还读连接，内存占用与用户的数据量无关；
+        不是同一个读快照：导出期间写入的行可能导出也可能不导出，指向未导出记忆的关联在导入时跳过
+        """
+        codec = self.palace.text_codec
+        pool = self.palace._pool
+
+        with pool.read() as conn:
+            profile = conn.execute(
+                f'SELECT {", ".join(PROFILE_COLUMNS)} FROM user_profiles WHERE user_id = ?', (user_id,)
+            ).fetchone()
+        if profile is not None:
+            yield dict(profile, kind="profile")
+
+        for batch in self._memory_batches(user_id, LONG_TERM_BY_EMBEDDING):
+            for row in batch:
+                yield long_term_record(row, codec.decode)
+
+        # 关联放在全部长期记忆之后（导入时两端都要已有新 id）；按起点分批，CROSS JOIN 固定从这批 id 出发走邻接索引，
+        # 只导出两端都属于该用户的
+        for batch in self._memory_batches(user_id, 'SELECT e.memory_id FROM memory_embeddings e'):
+            with pool.read() as conn:
+                rows = conn.execute(f'''
+                    SELECT {", ".join('a.' + c for c in ASSOCIATION_COLUMNS)}
+                    FROM json_each(?) batch
+                    CROSS JOIN memory_associations a ON a.memory_id_1 = batch.value
+                    JOIN long_term_memory m2 ON m2.id = a.memory_id_2
+                    WHERE m2.user_id = ?
+                ''', (json.dumps([row[0] for row in batch]), user_id)).fetchall()
+            for row in rows:
+                yield dict(row, kind="association", user_id=user_id)
+
+        # 与 SimpleStorage 的键集遍历相同：按 (timestamp, id) 走 idx_stm_user_ts
+        key = (-2 ** 63, 0)
+        while True:
+            with pool.read() as conn:
+                rows = conn.execute(f'''
+                    SELECT {", ".join(SHORT_TERM_COLUMNS)} FROM short_term_memory
+                    WHERE user_id = ? AND (timestamp, id) > (?, ?)
+                    ORDER BY timestamp, id
+                    LIMIT ?
+                ''', (user_id, *key, self.batch_size)).fetchall()
+            for row in rows:
+                yield codec.decode_row(dict(row, kind="short_term"))
+            if len(rows) < self.batch_size:
+                break
+            key = (rows[-1]['timestamp'], rows[-1]['id'])
+
+    def _memory_batches(self, user_id: str, select: str) -> Iterator[List]:
+        """按 memory_embeddings 的 (user_id, memory_id) 索引分批遍历用户的长期记忆（每条长期记忆都有向量行）"""
+        memory_id = 0
+        while True:
+            with self.palace._pool.read() as conn:
+                rows = conn.execute(
+                    f'{select} WHERE e.user_id = ? AND e.memory_id > ? ORDER BY e.memory_id LIMIT ?',
+                    (user_id, memory_id, self.batch_size)
+                ).fetchall()
+            if rows:
+                yield rows
+            if len(rows) < self.batch_size:
+                break
+            memory_id = rows[-1][0]
+
+    def user_ids(self) -> List[str]:
+        """库中出现过的全部 user_id"""
+        with self.palace._pool.read() as conn:
+            return [row[0] for row in conn.execute('''
+                SELECT user_id FROM user_profiles
+                UNION SELECT user_id FROM long_term_memory
+                UNION SELECT user_id FROM short_term_memory
+            ''')]
+
+    # ==================== 导入 ====================
+
+    def import_records(self, records: Iterable[Dict], progress=None) -> Dict:
+        """
+        导入记录流，返回各类行数和吞吐（rows_per_second）
+        长期记忆分配新 id，关联和短期记忆里的 promoted_to 按新 id 重映射；
+        指向流中不存在的长期记忆的关联跳过。画像已存在时覆盖
+        progress: 每个事务提交后调用 progress(stats)
+        """
+        stats = {kind: 0 for kind in _KINDS}
+        stats["skipped"] = 0
+        state = {"user_id": None, "id_map": {}}
+        started = time.perf_counter()
+
+        records = iter(records)
+        header = next(records, None)
+        if header is not None and (header.get("kind") != "header" or header.get("format") != FORMAT):
+            raise ValueError("not a memory palace export (missing header)")
+
+        while True:
+            # 逐条消费输入流，内存里最多只有 batch_size 条待写入的记录
+            with self.palace._pool.write() as conn:
+                count = self._import_chunk(conn, itertools.islice(records, self.transaction_rows), state, stats)
+            if not count:
+                break
+            if progress is not None:
+                progress(self._throughput(stats, started))
+
+        # 导入的用户可能已有缓存的上下文
+        self.palace._context_cache.clear()
+        return self._throughput(stats, started)
+
+    def _import_chunk(self, conn, chunk: Iterable[Dict], state: Dict, stats: Dict) -> int:
+        """在一个写事务里导入一段记录，返回消费的记录数"""
+        # 先拿写锁再读当前最大 id：记录是边读输入流边写入的，不拿锁的话其它连接在这期间插入的行会占用分配出去的 id
+        conn.execute('BEGIN IMMEDIATE')
+        row = conn.execute('''
+            SELECT MAX(COALESCE((SELECT seq FROM sqlite_sequence WHERE name = 'long_term_memory'), 0),
+                       COALESCE((SELECT MAX(id) FROM long_term_memory), 0))
+        ''').fetchone()
+        next_id = row[0] + 1
+        pending = {kind: [] for kind in _KINDS}
+        count = 0
+
+        for record in chunk:
+            count += 1
+            kind = record.get("kind")
+            if kind == "header":
+                # 多个导出文件拼接时中间会出现 header
+                continue
+            if kind not in pending:
+                stats["skipped"] += 1
+                continue
+
+            # 同一用户的记录连续出现，换用户时丢弃上一个用户的 id 映射
+            if record["user_id"] != state["user_id"]:
+                self._flush(conn, pending, stats)
+                state["user_id"] = record["user_id"]
+                state["id_map"] = {}
+            id_map = state["id_map"]
+
+            if kind == "long_term":
+                id_map[record["id"]] = next_id
+                record = dict(record, id=next_id)
+                next_id += 1
+            elif kind == "association":
+                if record["memory_id_1"] not in id_map or record["memory_id_2"] not in id_map:
+                    stats["skipped"] += 1
+                    continue
+                record = dict(
+                    record,
+                    memory_id_1=id_map[record["memory_id_1"]],
+                    memory_id_2=id_map[record["memory_id_2"]]
+                )
+            elif kind == "short_term":
+                record = self._remap_promoted(record, id_map)
+
+            pending[kind].append(record)
+            if len(pending[kind]) >= self.batch_size:
+                self._flush(conn, pending, stats)
+
+        self._flush(conn, pending, stats)
+        return count
+
+    def _remap_promoted(self, record: Dict, id_map: Dict) -> Dict:
+        """短期记忆 metadata 里的 promoted_to 指向长期记忆，换成新 id（找不到就去掉）"""
+        metadata = record.get("metadata")
+        if not metadata or '"promoted_to"' not in metadata:
+            return record
+        data = json.loads(metadata)
+        promoted_to = id_map.get(data.pop("promoted_to", None))
+        if promoted_to is not None:
+            data["promoted_to"] = promoted_to
+        return dict(record, metadata=json.dumps(data, ensure_ascii=False))
+
+    def _flush(self, conn, pending: Dict, stats: Dict):
+        """按依赖顺序写入缓冲的记录"""
+        for kind in _KINDS:
+            rows = pending[kind]
+            if rows:
+                getattr(self, f'_insert_{kind}')(conn, rows)
+                stats[kind] += len(rows)
+                pending[kind] = []
+
+    def _insert_profile(self, conn, rows: List[Dict]):
+        conn.executemany(
+            f'INSERT OR REPLACE INTO user_profiles ({", ".join(PROFILE_COLUMNS)}) '
+            f'VALUES ({", ".join("?" * len(PROFILE_COLUMNS))})',
+            [tuple(row[c] for c in PROFILE_COLUMNS) for row in rows]
+        )
+
+    def _insert_long_term(self, conn, rows: List[Dict]):
+        palace = self.palace
+        rows = [
+            dict(row, created_at=iso_to_ms(row['created_at']), last_accessed=iso_to_ms(row['last_accessed']))
+            for row in rows
+        ]
+        encode = palace.text_codec.encode
+        relevance = palace.relevance_scorer.score_many([
+            (row['importance'], row['access_count'], row['created_at'], row['last_accessed'])
+            for row in rows
+        ])
+        conn.executemany(
+            f'INSERT INTO long_term_memory ({", ".join(LONG_TERM_COLUMNS)}, search_text, relevance) '
+            f'VALUES ({", ".join("?" * len(LONG_TERM_COLUMNS))}, ?, ?)',
+            [
+                tuple(encode(row[c]) if c == 'content' else row[c] for c in LONG_TERM_COLUMNS)
+                + (search_text(row['content'], row['keywords']), score)
+                for row, score in zip(rows, relevance)
+            ]
+        )
+        conn.executemany(
+            'INSERT INTO memory_embeddings (memory_id, user_id, vector) VALUES (?, ?, ?)',
+            [
+                (
+                    row['id'],
+                    row['user_id'],
+                    base64.b64decode(row['vector']) if row.get('vector')
+                    else palace.semantic_index.embed(f"{row['keywords']} {row['content']}")
+                )
+                for row in rows
+            ]
+        )
+
+    def _insert_association(self, conn, rows: List[Dict]):
+        conn.executemany(
+            f'INSERT INTO memory_associations ({", ".join(ASSOCIATION_COLUMNS)}) '
+            f'VALUES ({", ".join("?" * len(ASSOCIATION_COLUMNS))})',
+            [tuple(row[c] for c in ASSOCIATION_COLUMNS) for row in rows]
+        )
+
+    def _insert_short_term(self, conn, rows: List[Dict]):
+        # 短期记忆的 id 没有被引用，由库自动分配
+        columns = SHORT_TERM_COLUMNS[1:]
+        rows = [
+            dict(
+                row,
+                content=self.palace.text_codec.encode(row['content']),
+                timestamp=iso_to_ms(row['timestamp']),
+                expires_at=iso_to_ms(row['expires_at'])
+            )
+            for row in rows
+        ]
+        conn.executemany(
+            f'INSERT INTO short_term_memory ({", ".join(columns)}) VALUES ({", ".join("?" * len(columns))})',
+            [tuple(row[c] for c in columns) for row in rows]
+        )
+
+    @staticmethod
+    def _throughput(stats: Dict, started: float) -> Dict:
+        rows = sum(stats[kind] for kind in _KINDS)
+        seconds = time.perf_counter() - started
+        return dict(stats, rows=rows, seconds=round(seconds, 3),
+                    rows_per_second=round(rows / seconds) if seconds > 0 else 0)
+
+
+# ==================== NDJSON ====================
+
+def dump_lines(records: Iterable[Dict]) -> Iterator[str]:
+    """记录 -> NDJSON 行"""
+    for record in records:
+        yield json.dumps(record, ensure_ascii=False) + '\n'
+
+
+def load_lines(lines: Iterable) -> Iterator[Dict]:
+    """NDJSON 行 -> 记录（跳过空行）"""
+    for line in lines:
+        if line.strip():
+            yield json.loads(line)
+
+
+def _open(path: str, mode: str):
+    """打开文件，'-' 表示标准输入输出，.gz 结尾按 gzip 读写"""
+    if path == '-':
+        return io.TextIOWrapper(
+            sys.stdin.buffer if 'r' in mode else sys.stdout.buffer, encoding='utf-8'
+        )
+    if path.endswith('.gz'):
+        # gzip 默认的 9 级压缩是导出的瓶颈，1 级快数倍而体积相差不大
+        return gzip.open(path, mode + 't', encoding='utf-8', compresslevel=1)
+    return open(path, mode, encoding='utf-8')
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Symphony 记忆导入导出（NDJSON）")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    export = sub.add_parser("export", help="导出用户记忆")
+    export.add_argument("--db", default="data/memory_palace.db")
+    export.add_argument("--user", action="append", help="要导出的用户，可重复；默认全部")
+    export.add_argument("--output", "-o", default="-", help="输出文件（.gz 压缩），默认标准输出")
+
+    load = sub.add_parser("import", help="导入用户记忆")
+    load.add_argument("--db", default="data/memory_palace.db")
+    load.add_argument("--input", "-i", default="-", help="输入文件（.gz 压缩），默认标准输入")
+    load.add_argument("--batch-size", type=int, default=1000)
+    load.add_argument("--transaction-rows", type=int, default=50000)
+
+    args = parser.parse_args()
+
+    from storage.memory_palace import MemoryPalace
+    palace = MemoryPalace(args.db)
+    try:
+        if args.command == "export":
+            transfer = MemoryTransfer(palace)
+            started = time.perf_counter()
+            rows = 0
+            with _open(args.output, 'w') as output:
+                for line in dump_lines(transfer.export_users(args.user)):
+                    output.write(line)
+                    rows += 1
+            rows -= 1  # header
+            seconds = time.perf_counter() - started
+            result = {"rows": rows, "seconds": round(seconds, 3),
+                      "rows_per_second": round(rows / seconds) if seconds > 0 else 0}
+        else:
+            transfer = MemoryTransfer(palace, args.batch_size, args.transaction_rows)
+            with _open(args.input, 'r') as source:
+                result = transfer.import_records(
+                    load_lines(source),
+                    progress=lambda stats: print(
+                        f"{stats['rows']} rows, {stats['rows_per_second']} rows/s", file=sys.stderr
+                    )
+                )
+    finally:
+        palace.close()
+
+    # 导出到标准输出时统计写到标准错误
+    print(json.dumps(result, ensure_ascii=False, indent=2),
+          file=sys.stderr if args.command == "export" and args.output == '-' else sys.stdout)
+
+
+if __name__ == "__main__":
+    main()
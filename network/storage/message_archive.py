@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+"""
+Message Archive - 消息归档
+把超过保留期的消息和分析结果按月迁移到归档库，并维护跨归档索引
+"""
+
+import sqlite3
+import zlib
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+from storage.migrations import now_ms
+
+
+# 可归档的表：表名 -> (时间列, 可压缩的文本列, 归档表结构)
+ARCHIVED_TABLES = {
+    "user_messages": ("timestamp", "content", '''
+        CREATE TABLE IF NOT EXISTS arc.user_messages (
+            id INTEGER PRIMARY KEY,
+            user_id TEXT NOT NULL,
+            content NOT NULL,
+            message_type TEXT,
+            metadata TEXT,
+            timestamp INTEGER NOT NULL
+        )
+    '''),
+    "analysis_results": ("timestamp", "insights", '''
+        CREATE TABLE IF NOT EXISTS arc.analysis_results (
+            id INTEGER PRIMARY KEY,
+            user_id TEXT NOT NULL,
+            framework TEXT NOT NULL,
+            insights NOT NULL,
+            confidence REAL,
+            timestamp INTEGER NOT NULL
+        )
+    '''),
+}
+
+MONTH_SQL = "strftime('%Y_%m', {column} / 1000, 'unixepoch', 'localtime')"
+
+DAY_MS = 24 * 60 * 60 * 1000
+
+
+def _compress(value):
+    """归档压缩：文本压缩为 zlib BLOB"""
+    if value is None or isinstance(value, bytes):
+        return value
+    return zlib.compress(value.encode("utf-8"), 6)
+
+
+def decompress(value):
+    """读取归档列：BLOB 解压回文本，文本原样返回"""
+    if isinstance(value, bytes):
+        return zlib.decompress(value).decode("utf-8")
+    return value
+
+
+class MessageArchiver:
+    """消息归档器 - 按月分区的归档库 + 增量 VACUUM"""
+
+    def __init__(
+        self,
+        pool,
+        archive_dir,
+        retention_days: Optional[int] = None,
+        compress: bool = False,
+        decode: Callable = decompress
+    ):
+        """decode: 读取归档的文本列（在线库用字典压缩时，已压缩的行原样归档，由它解压）"""
+        self._pool = pool
+        self.archive_dir = Path(archive_dir)
+        self.retention_days = retention_days
+        self.compress = compress
+        self.decode = decode
+
+    def archive_path(self, month: str) -> Path:
+        """某个月的归档文件"""
+        return self.archive_dir / f"symphony_{month}.db"
+
+    # ==================== 归档 ====================
+
+    def run(self, retention_days: Optional[int] = None, vacuum_pages: int = 2000) -> Dict:
+        """把早于保留期的行移入归档库，返回各表移动的行数"""
+        days = retention_days if retention_days is not None else self.retention_days
+        if days is None:
+            return {}
+
+        self.archive_dir.mkdir(parents=True, exist_ok=True)
+        cutoff = now_ms() - days * DAY_MS
+        moved = {}
+
+        for table, (time_column, text_column, _) in ARCHIVED_TABLES.items():
+            with self._pool.read() as conn:
+                months = [row[0] for row in conn.execute(
+                    f'SELECT DISTINCT {MONTH_SQL.format(column=time_column)} FROM {table} WHERE {time_column} < ?',
+                    (cutoff,)
+                )]
+
+            moved[table] = 0
+            for month in months:
+                moved[table] += self._archive_month(table, month, cutoff)
+
+        self.incremental_vacuum(vacuum_pages)
+        return moved
+
+    def _archive_month(self, table: str, month: str, cutoff: int) -> int:
+        """归档一张表某个月的数据：先写归档库，再删除在线数据"""
+        time_column, text_column, create_sql = ARCHIVED_TABLES[table]
+        month_filter = f'{time_column} < ? AND {MONTH_SQL.format(column=time_column)} = ?'
+
+        with self._pool.write() as conn:
+            conn.create_function('archive_compress', 1, _compress, deterministic=True)
+            # ATTACH/DETACH 不能在事务中执行
+            conn.commit()
+            conn.execute('ATTACH DATABASE ? AS arc', (str(self.archive_path(month)),))
+            try:
+                columns = [row[1] for row in conn.execute(f'PRAGMA main.table_info({table})')]
+                select = [
+                    f'archive_compress({c})' if (c == text_column and self.compress) else c
+                    for c in columns
+                ]
+
+                conn.execute('BEGIN IMMEDIATE')
+                conn.execute(create_sql)
+                conn.execute(f'''
+                    CREATE INDEX IF NOT EXISTS arc.idx_{table}_user_ts
+                    ON {table}(user_id, {time_column})
+                ''')
+                # OR IGNORE：中途失败后重跑是幂等的
+                conn.execute(f'''
+                    INSERT OR IGNORE INTO arc.{table} ({", ".join(columns)})
+                    SELECT {", ".join(select)} FROM main.{table} WHERE {month_filter}
+                ''', (cutoff, month))
+                conn.commit()
+
+                conn.execute('BEGIN IMMEDIATE')
+                # 索引只累加本次移走的行：同一目录下的月度归档库由各分片共用，里面还有别的分片的用户；
+                # 与删除在同一事务里，中途失败重跑时不会重复计数
+                conn.execute(f'''
+                    INSERT INTO archive_index (user_id, table_name, month, row_count, min_ts, max_ts)
+                    SELECT user_id, ?, ?, COUNT(*), MIN({time_column}), MAX({time_column})
+                    FROM main.{table} WHERE {month_filter}
+                    GROUP BY user_id
+                    ON CONFLICT (user_id, table_name, month) DO UPDATE SET
+                        row_count = row_count + excluded.row_count,
+                        min_ts = MIN(min_ts, excluded.min_ts),
+                        max_ts = MAX(max_ts, excluded.max_ts)
+                ''', (table, month, cutoff, month))
+                moved = conn.execute(
+                    f'DELETE FROM main.{table} WHERE {month_filter}', (cutoff, month)
+                ).rowcount
+                conn.commit()
+            finally:
+                if conn.in_transaction:
+                    conn.rollback()
+                conn.execute('DETACH DATABASE arc')
+
+        return moved
+
+    def incremental_vacuum(self, pages: int = 2000):
+        """增量回收空闲页；首次使用时把库切换到 INCREMENTAL 模式"""
+        with self._pool.write() as conn:
+            conn.commit()
+            if conn.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+                # 切换 auto_vacuum 模式需要一次完整 VACUUM
+                conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+                conn.execute('VACUUM')
+            conn.execute(f'PRAGMA incremental_vacuum({int(pages)})').fetchall()
+
+    # ==================== 查询 ====================
+
+    def fetch_user_messages(self, user_id: str, before: Optional[int], limit: int) -> List[Dict]:
+        """从归档库中按时间倒序取用户消息"""
+        return self._fetch('user_messages', user_id, before, limit)
+
+    def _fetch(self, table: str, user_id: str, before: Optional[int], limit: int) -> List[Dict]:
+        """借助 archive_index 只打开包含该用户数据的月份"""
+        time_column, text_column, _ = ARCHIVED_TABLES[table]
+        before = before if before is not None else 2 ** 63 - 1
+
+        with self._pool.read() as conn:
+            months = [row[0] for row in conn.execute('''
+                SELECT month FROM archive_index
+                WHERE user_id = ? AND table_name = ? AND min_ts < ?
+                ORDER BY month DESC
+            ''', (user_id, table, before))]
+
+        results = []
+        for month in months:
+            path = self.archive_path(month)
+            if not path.exists():
+                continue
+
+            conn = sqlite3.connect(f"{path.resolve().as_uri()}?mode=ro", uri=True)
+            conn.row_factory = sqlite3.Row
+            try:
+                rows = conn.execute(f'''
+                    SELECT * FROM {table}
+                    WHERE user_id = ? AND {time_column} < ?
+                    ORDER BY {time_column} DESC, id DESC
+                    LIMIT ?
+                ''', (user_id, before, limit - len(results))).fetchall()
+            finally:
+                conn.close()
+
+            for row in rows:
+                item = dict(row)
+                item[text_column] = self.decode(item[text_column])
+                results.append(item)
+
+            if len(results) >= limit:
+                break
+
+        return results
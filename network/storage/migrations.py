@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Migrations - 数据库版本迁移
+按版本号顺序执行迁移，并记录在 schema_version 表中
+"""
+
+import sqlite3
+import time
+from datetime import datetime
+from typing import Callable, List, Optional, Tuple
+
+
+Migration = Tuple[int, str, Callable[[sqlite3.Connection], None]]
+
+
+def now_ms() -> int:
+    """当前时间（epoch 毫秒）"""
+    return int(time.time() * 1000)
+
+
+def iso_to_ms(value) -> Optional[int]:
+    """把旧版 ISO-8601 时间字符串（本地时间）转换为 epoch 毫秒"""
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return int(value)
+    try:
+        return int(datetime.fromisoformat(value).timestamp() * 1000)
+    except ValueError:
+        return None
+
+
+def current_version(conn: sqlite3.Connection) -> int:
+    """当前 schema 版本，未迁移过的库为 0"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            description TEXT NOT NULL,
+            applied_at INTEGER NOT NULL
+        )
+    ''')
+    return conn.execute('SELECT COALESCE(MAX(version), 0) FROM schema_version').fetchone()[0]
+
+
+def apply_migrations(conn: sqlite3.Connection, migrations: List[Migration]) -> int:
+    """执行尚未应用的迁移，每个迁移一个事务，返回最终版本"""
+    conn.create_function('iso_to_ms', 1, iso_to_ms, deterministic=True)
+    version = current_version(conn)
+
+    for target, description, migrate in sorted(migrations, key=lambda m: m[0]):
+        if target <= version:
+            continue
+
+        # IMMEDIATE 事务拿到写锁，多个进程同时启动时只有一个执行迁移
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            version = current_version(conn)
+            if target > version:
+                migrate(conn)
+                conn.execute(
+                    'INSERT INTO schema_version (version, description, applied_at) VALUES (?, ?, ?)',
+                    (target, description, now_ms())
+                )
+                version = target
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    return version
+
+
+def rebuild_table(conn: sqlite3.Connection, table: str, create_sql: str, select_sql: str):
+    """
+    按 SQLite 推荐的步骤重建表（修改列类型等 ALTER 无法完成的变更）
+    create_sql 中的表名写作 {table}，select_sql 从旧表读出新表的全部列
+    """
+    saved = conn.execute(
+        "SELECT sql FROM sqlite_master WHERE tbl_name = ? AND type IN ('index', 'trigger') AND sql IS NOT NULL",
+        (table,)
+    ).fetchall()
+
+    sequence = None
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'sqlite_sequence'").fetchone():
+        row = conn.execute('SELECT seq FROM sqlite_sequence WHERE name = ?', (table,)).fetchone()
+        sequence = row[0] if row else None
+
+    new_table = f'{table}__new'
+    conn.execute(create_sql.format(table=new_table))
+    conn.execute(f'INSERT INTO {new_table} {select_sql}')
+
+    conn.execute('PRAGMA legacy_alter_table = ON')
+    try:
+        conn.execute(f'DROP TABLE {table}')
+        conn.execute(f'ALTER TABLE {new_table} RENAME TO {table}')
+    finally:
+        conn.execute('PRAGMA legacy_alter_table = OFF')
+
+    # 保留 AUTOINCREMENT 计数，避免已删除的 id 被重新分配
+    if sequence is not None:
+        conn.execute('UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = ?', (sequence, table))
+
+    for (sql,) in saved:
+        conn.execute(sql)
@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+"""
+Quota - 长期记忆配额
+每个用户的长期记忆条数有上限，超出后由后台线程分批淘汰相关度最低的记忆
+
+淘汰顺序就是持久化的 relevance 列（重要度 + 访问次数的对数，按最近访问时间衰减，
+即带老化的 LFU），沿 (user_id, relevance) 索引从低分一端取；
+可选先把被淘汰的行追加到归档文件（与 memory_transfer 相同的 NDJSON 格式，可用 import_users 恢复）
+"""
+
+import atexit
+import gzip
+import json
+import threading
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional
+
+from storage.memory_transfer import LONG_TERM_SELECT, dump_lines, header, long_term_record
+from storage.sqlite_pool import SQLitePool
+
+
+class QuotaEnforcer:
+    """配额执行器 - 写入路径只登记用户，后台按批淘汰；每批一个短事务"""
+
+    def __init__(
+        self,
+        pool: SQLitePool,
+        default_quota: Optional[int] = None,
+        interval_s: float = 30,
+        batch_size: int = 500,
+        headroom: float = 0.1,
+        archive_dir=None,
+        on_evict: Optional[Callable[[str], None]] = None,
+        decode: Optional[Callable] = None
+    ):
+        """
+        default_quota: 每个用户的长期记忆上限，None 表示不限（可用 memory_quotas 表按用户覆盖）
+        headroom: 超限后淘汰到上限的 (1 - headroom) 倍，避免每次写入都触发一次淘汰
+        archive_dir: 被淘汰的记忆追加到该目录下按月的 evicted_YYYY_MM.ndjson.gz，None 表示直接删除
+        on_evict: 淘汰某个用户的记忆后调用 on_evict(user_id)
+        decode: 归档前解码 content 列（压缩存储时）
+        """
+        self.default_quota = default_quota
+        self.interval = interval_s
+        self.batch_size = batch_size
+        self.headroom = headroom
+        self.archive_dir = Path(archive_dir) if archive_dir else None
+        self.on_evict = on_evict
+        self.decode = decode
+        self._pool = pool
+        self._dirty = set()
+        self._full_scan = True
+        self._dirty_lock = threading.Lock()
+        self._enforce_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._closed = False
+
+        self.stats = {"runs": 0, "users_checked": 0, "evicted": 0, "archived": 0, "errors": 0}
+
+        self._thread = threading.Thread(target=self._run, name="memory-quota", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    # ==================== 公共接口 ====================
+
+    def touch(self, user_id: str):
+        """写入路径调用：登记一个可能超限的用户（只改内存）"""
+        with self._dirty_lock:
+            self._dirty.add(user_id)
+
+    def request_full_scan(self):
+        """下一轮后台检查覆盖全部用户（批量导入之后调用）"""
+        with self._dirty_lock:
+            self._full_scan = True
+        self._wakeup.set()
+
+    def enforce(self, user_ids: Optional[Iterable[str]] = None) -> int:
+        """检查给定用户（默认全部用户）并淘汰超出配额的记忆，返回淘汰行数"""
+        with self._enforce_lock:
+            with self._pool.read() as conn:
+                overrides = dict(conn.execute('SELECT user_id, max_long_term FROM memory_quotas').fetchall())
+                if self.default_quota is None and not overrides:
+                    return 0
+
+                if user_ids is None:
+                    counts = conn.execute(
+                        'SELECT user_id, COUNT(*) FROM long_term_memory GROUP BY user_id'
+                    ).fetchall()
+                else:
+                    counts = [
+                        (user_id, conn.execute(
+                            'SELECT COUNT(*) FROM long_term_memory WHERE user_id = ?', (user_id,)
+                        ).fetchone()[0])
+                        for user_id in user_ids
+                    ]
+
+            evicted = 0
+            for user_id, count in counts:
+                self.stats["users_checked"] += 1
+                quota = overrides.get(user_id, self.default_quota)
+                if quota is None or count <= quota:
+                    continue
+                evicted += self._evict_user(user_id, count - int(quota * (1 - self.headroom)))
+
+            self.stats["runs"] += 1
+            return evicted
+
+    def close(self):
+        """停止后台线程"""
+        if self._closed:
+            return
+        self._closed = True
+        self._wakeup.set()
+        self._thread.join()
+        atexit.unregister(self.close)
+
+    # ==================== 淘汰 ====================
+
+    def _evict_user(self, user_id: str, excess: int) -> int:
+        """分批淘汰一个用户相关度最低的 excess 条记忆"""
+        evicted = 0
+        while evicted < excess:
+            with self._pool.write() as conn:
+                ids = [row[0] for row in conn.execute('''
+                    SELECT id FROM long_term_memory WHERE user_id = ?
+                    ORDER BY relevance ASC LIMIT ?
+                ''', (user_id, min(self.batch_size, excess - evicted)))]
+                if not ids:
+                    break
+
+                id_list = json.dumps(ids)
+                if self.archive_dir is not None:
+                    # 先写归档再删除：删除事务失败时归档里会多出重复记录，不会丢数据
+                    rows = conn.execute(
+                        LONG_TERM_SELECT + ' WHERE ltm.id IN (SELECT value FROM json_each(?))', (id_list,)
+                    ).fetchall()
+                    self._archive([long_term_record(row, self.decode) for row in rows])
+
+                # 语义向量和全文索引由触发器随之删除，关联没有触发器
+                conn.execute(
+                    'DELETE FROM memory_associations WHERE memory_id_1 IN (SELECT value FROM json_each(?)) '
+                    'OR memory_id_2 IN (SELECT value FROM json_each(?))',
+                    (id_list, id_list)
+                )
+                conn.execute('DELETE FROM long_term_memory WHERE id IN (SELECT value FROM json_each(?))', (id_list,))
+
+            evicted += len(ids)
+
+        self.stats["evicted"] += evicted
+        if evicted and self.on_evict is not None:
+            self.on_evict(user_id)
+        return evicted
+
+    def archive_path(self, month: str) -> Path:
+        """某个月的淘汰归档文件"""
+        return self.archive_dir / f"evicted_{month}.ndjson.gz"
+
+    def _archive(self, records: List[Dict]):
+        """追加到当月归档文件（每批一个 gzip 成员，新文件先写 header）"""
+        self.archive_dir.mkdir(parents=True, exist_ok=True)
+        path = self.archive_path(datetime.now().strftime('%Y_%m'))
+        lines = list(dump_lines(records))
+        if not path.exists():
+            lines.insert(0, next(dump_lines([header()])))
+        with gzip.open(path, 'at', encoding='utf-8', compresslevel=1) as output:
+            output.writelines(lines)
+        self.stats["archived"] += len(records)
+
+    # ==================== 后台淘汰 ====================
+
+    def _run(self):
+        """后台线程：启动时检查全部用户，之后每隔 interval 只检查有新写入的用户"""
+        while not self._closed:
+            with self._dirty_lock:
+                user_ids = None if self._full_scan else self._dirty
+                self._dirty, self._full_scan = set(), False
+            try:
+                self.enforce(user_ids)
+            except Exception:
+                # 下一轮重试这些用户
+                with self._dirty_lock:
+                    if user_ids is None:
+                        self._full_scan = True
+                    else:
+                        self._dirty |= user_ids
+                self.stats["errors"] += 1
+
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
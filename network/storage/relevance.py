@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+Relevance - 相关度评分
+按重要度、访问次数和时间衰减给长期记忆打分，分数持久化在 relevance 列上
+
+存的是以固定纪元为基准的对数分数：
+    relevance = ln(重要度 + access_weight * ln(1 + 访问次数)) + ln2 * 最近时间(天) / 半衰期
+指数衰减对所有记忆是同一个系数，按这个量排序和按“当前衰减后的分数”排序完全一致，
+所以时间流逝不需要重写任何行；只有重要度、访问次数或最近访问时间变化时才重算
+"""
+
+import json
+import math
+from datetime import datetime
+from typing import Iterable, List, Optional
+
+try:
+    import numpy as np
+except ImportError:  # 没有 NumPy 时逐行计算
+    np = None
+
+
+_LN2 = math.log(2)
+_DAY_SECONDS = 86400
+
+
+def _days(value) -> float:
+    """epoch 毫秒 -> 纪元以来的天数"""
+    return value / (_DAY_SECONDS * 1000) if value else 0.0
+
+
+class RelevanceScorer:
+    """相关度评分器 - 参数按部署配置，变化后由 MemoryPalace 触发全量重算"""
+
+    def __init__(
+        self,
+        half_life_days: float = 30.0,
+        importance_weight: float = 1.0,
+        access_weight: float = 0.1,
+        batch_size: int = 5000
+    ):
+        """
+        half_life_days: 分数衰减一半所需的天数（从最近一次访问或创建时间算起）
+        importance_weight / access_weight: 重要度与 ln(1 + 访问次数) 的权重
+        batch_size: 全量重算时每个事务处理的行数
+        """
+        self.half_life_days = half_life_days
+        self.importance_weight = importance_weight
+        self.access_weight = access_weight
+        self.batch_size = batch_size
+
+    def config(self) -> str:
+        """参数的规范化表示，用来判断库里的分数是否按当前参数计算"""
+        return json.dumps({
+            "half_life_days": self.half_life_days,
+            "importance_weight": self.importance_weight,
+            "access_weight": self.access_weight,
+        }, sort_keys=True)
+
+    # ==================== 打分 ====================
+
+    def score(self, importance: float, access_count: int, created_at, last_accessed=None) -> float:
+        """单行的持久化分数"""
+        return self.score_many([(importance, access_count, created_at, last_accessed)])[0]
+
+    def score_many(self, rows: List) -> List[float]:
+        """批量打分，rows 为 (importance, access_count, created_at, last_accessed)"""
+        if not rows:
+            return []
+
+        days = [max(_days(created), _days(accessed)) for _, _, created, accessed in rows]
+        decay_rate = _LN2 / self.half_life_days
+
+        if np is None:
+            return [
+                math.log(max(self.importance_weight * (importance or 0.0)
+                             + self.access_weight * math.log1p(count or 0), 1e-9))
+                + decay_rate * day
+                for (importance, count, _, _), day in zip(rows, days)
+            ]
+
+        importance = np.fromiter((row[0] or 0.0 for row in rows), dtype=np.float64, count=len(rows))
+        access = np.fromiter((row[1] or 0 for row in rows), dtype=np.float64, count=len(rows))
+        base = self.importance_weight * importance + self.access_weight * np.log1p(access)
+        scores = np.log(np.maximum(base, 1e-9)) + decay_rate * np.asarray(days)
+        return scores.tolist()
+
+    def current(self, relevance: float, now: Optional[datetime] = None) -> float:
+        """持久化分数 -> 此刻衰减后的分数（仅用于展示，排序直接用持久化分数）"""
+        now_days = (now or datetime.now()).timestamp() / _DAY_SECONDS
+        return math.exp(relevance - _LN2 / self.half_life_days * now_days)
+
+    # ==================== 重算 ====================
+
+    def rescore_ids(self, conn, ids: Iterable[int]):
+        """在给定连接（写事务）内重算指定记忆的分数"""
+        ids = list(ids)
+        if not ids:
+            return
+        rows = conn.execute('''
+            SELECT id, importance, access_count, created_at, last_accessed
+            FROM long_term_memory WHERE id IN (SELECT value FROM json_each(?))
+        ''', (json.dumps(ids),)).fetchall()
+        self._write(conn, rows)
+
+    def rescore_all(self, pool, user_id: Optional[str] = None) -> int:
+        """按 id 分批全量重算（可限定用户），每批一个短事务，返回行数"""
+        total = 0
+        last_id = 0
+        while True:
+            with pool.write() as conn:
+                query = '''
+                    SELECT id, importance, access_count, created_at, last_accessed
+                    FROM long_term_memory WHERE id > ?
+                '''
+                params = [last_id]
+                if user_id is not None:
+                    query += ' AND user_id = ?'
+                    params.append(user_id)
+                query += ' ORDER BY id LIMIT ?'
+                params.append(self.batch_size)
+
+                rows = conn.execute(query, params).fetchall()
+                if not rows:
+                    break
+                self._write(conn, rows)
+
+            total += len(rows)
+            last_id = rows[-1][0]
+        return total
+
+    def _write(self, conn, rows):
+        scores = self.score_many([tuple(row[1:]) for row in rows])
+        conn.executemany(
+            'UPDATE long_term_memory SET relevance = ? WHERE id = ?',
+            [(score, row[0]) for score, row in zip(scores, rows)]
+        )
@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+"""
+Semantic Index - 语义索引
+本地计算的哈希字符 n-gram 向量，不依赖网络或外部模型；
+向量以 float32 BLOB 存储，检索时用 NumPy 向量化计算余弦相似度
+"""
+
+import math
+import re
+import threading
+import zlib
+from array import array
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # 没有 NumPy 时退化为纯 Python 计算
+    np = None
+
+
+_NORMALIZE = re.compile(r'[\W_]+')
+
+
+class HashingEmbedder:
+    """哈希字符 n-gram 向量化器（特征哈希 + 符号位，L2 归一化）"""
+
+    def __init__(self, dim: int = 512, ngram_range: Tuple[int, int] = (1, 3)):
+        self.dim = dim
+        self.ngram_range = ngram_range
+
+    def _features(self, text: str) -> Dict[int, float]:
+        """n-gram -> (桶, ±1) 累加"""
+        features = {}
+        for chunk in _NORMALIZE.split(text.lower()):
+            if not chunk:
+                continue
+            for n in range(self.ngram_range[0], self.ngram_range[1] + 1):
+                for i in range(len(chunk) - n + 1):
+                    h = zlib.crc32(chunk[i:i + n].encode("utf-8"))
+                    bucket = h % self.dim
+                    # 用哈希的高位决定符号，减少碰撞带来的偏差
+                    sign = 1.0 if (h >> 31) & 1 else -1.0
+                    features[bucket] = features.get(bucket, 0.0) + sign
+        return features
+
+    def embed(self, text: str) -> bytes:
+        """文本 -> 归一化 float32 向量的字节串"""
+        vector = array("f", bytes(4 * self.dim))
+        features = self._features(text)
+        norm = math.sqrt(sum(v * v for v in features.values())) or 1.0
+        for bucket, value in features.items():
+            vector[bucket] = value / norm
+        return vector.tobytes()
+
+
+class _UserVectors:
+    """
+    一个用户的向量缓存（可选近似索引）
+    ids / matrix 是 id_buffer / matrix_buffer 的前缀视图；追加新向量时生成新的缓存项，
+    写入缓冲区的空余部分（容量不够时按倍数扩容），已发出的缓存项看到的内容不变
+    """
+
+    __slots__ = ("version", "ids", "matrix", "center", "planes", "buckets", "id_buffer", "matrix_buffer")
+
+    def __init__(self, version, ids, matrix, id_buffer=None, matrix_buffer=None):
+        self.version = version
+        self.ids = ids
+        self.matrix = matrix
+        self.id_buffer = id_buffer
+        self.matrix_buffer = matrix_buffer
+        self.center = None
+        self.planes = None
+        self.buckets = None
+
+
+class SemanticIndex:
+    """
+    语义索引 - 每个用户的向量在内存中缓存为矩阵
+    用户记忆数超过 ann_threshold 时，额外构建随机超平面 LSH 近似索引
+    """
+
+    def __init__(
+        self,
+        embedder: Optional[HashingEmbedder] = None,
+        ann_threshold: int = 20000,
+        lsh_tables: int = 24,
+        lsh_bits: int = 8,
+        cache_users: int = 64
+    ):
+        self.embedder = embedder or HashingEmbedder()
+        self.ann_threshold = ann_threshold
+        self.lsh_tables = lsh_tables
+        self.lsh_bits = lsh_bits
+        self.cache_users = cache_users
+        self._cache: "OrderedDict[str, _UserVectors]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def embed(self, text: str) -> bytes:
+        return self.embedder.embed(text)
+
+    # ==================== 检索 ====================
+
+    def search(self, conn, user_id: str, query: str, limit: int = 5) -> List[Tuple[int, float]]:
+        """返回 [(memory_id, 相似度)]，按相似度降序"""
+        entry = self._load(conn, user_id)
+        if entry is None:
+            return []
+
+        query_vector = self.embed(query)
+
+        if np is None:
+            q = array("f", query_vector)
+            scores = [sum(a * b for a, b in zip(q, row)) for row in entry.matrix]
+            ranked = sorted(zip(entry.ids, scores), key=lambda item: item[1], reverse=True)
+            return [(memory_id, float(score)) for memory_id, score in ranked[:limit] if score > 0]
+
+        q = np.frombuffer(query_vector, dtype=np.float32)
+        candidates = self._candidates(entry, q)
+        if candidates is None:
+            ids, scores = entry.ids, entry.matrix @ q
+        else:
+            ids, scores = entry.ids[candidates], entry.matrix[candidates] @ q
+
+        if len(scores) > limit:
+            top = np.argpartition(-scores, limit)[:limit]
+        else:
+            top = np.arange(len(scores))
+        top = top[np.argsort(-scores[top])]
+        return [(int(ids[i]), float(scores[i])) for i in top if scores[i] > 0]
+
+    def _candidates(self, entry: _UserVectors, q):
+        """LSH 候选集；未建近似索引或候选过少时返回 None（精确计算）"""
+        if entry.planes is None:
+            return None
+
+        signatures = self._signatures(entry.planes, (q - entry.center)[np.newaxis, :])[:, 0]
+        hits = [entry.buckets[t].get(int(sig)) for t, sig in enumerate(signatures)]
+        hits = [h for h in hits if h is not None]
+        if not hits:
+            return None
+        candidates = np.unique(np.concatenate(hits))
+        # 候选过少召回不足，过多则不如直接精确计算
+        if len(candidates) < 32 or len(candidates) > len(entry.ids) // 4:
+            return None
+        return candidates
+
+    # ==================== 缓存 ====================
+
+    def _load(self, conn, user_id: str) -> Optional[_UserVectors]:
+        """
+        按用户的向量版本号（由触发器维护，每次增删加 1）判断缓存是否过期：
+        期间只有新增时只读新增的向量追加到缓存，有删除时整体重新加载
+        """
+        row = conn.execute(
+            'SELECT version FROM memory_embedding_versions WHERE user_id = ?',
+            (user_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        version = row[0]
+
+        with self._lock:
+            entry = self._cache.get(user_id)
+            if entry is not None:
+                self._cache.move_to_end(user_id)
+                if entry.version == version:
+                    return entry
+
+        if entry is not None and version > entry.version:
+            # 新记忆的 id 都比缓存里的大；读到的行数等于版本差，说明期间没有删除
+            rows = conn.execute(
+                'SELECT memory_id, vector FROM memory_embeddings WHERE user_id = ? AND memory_id > ? ORDER BY memory_id',
+                (user_id, int(entry.ids[-1]))
+            ).fetchall()
+            if len(rows) == version - entry.version:
+                with self._lock:
+                    # 别的线程已经更新过缓存时按整体重新加载处理
+                    if self._cache.get(user_id) is entry:
+                        entry = self._extend(entry, version, rows)
+                        self._cache[user_id] = entry
+                        return entry
+
+        rows = conn.execute(
+            'SELECT memory_id, vector FROM memory_embeddings WHERE user_id = ? ORDER BY memory_id',
+            (user_id,)
+        ).fetchall()
+        if not rows:
+            return None
+
+        if np is None:
+            entry = _UserVectors(version, [row[0] for row in rows], [array("f", row[1]) for row in rows])
+        else:
+            ids = np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+            matrix = np.frombuffer(b"".join(row[1] for row in rows), dtype=np.float32).reshape(len(rows), -1)
+            entry = _UserVectors(version, ids, matrix, ids, matrix)
+            if len(rows) >= self.ann_threshold:
+                self._build_lsh(entry)
+
+        with self._lock:
+            if user_id in self._cache:
+                self._cache.move_to_end(user_id)
+            elif len(self._cache) >= self.cache_users:
+                # 淘汰最久未使用的用户
+                self._cache.popitem(last=False)
+            self._cache[user_id] = entry
+        return entry
+
+    def _extend(self, entry: _UserVectors, version: int, rows) -> _UserVectors:
+        """把新增的 (memory_id, vector) 追加到缓存项后面，返回新的缓存项（调用方持有锁）"""
+        if np is None:
+            return _UserVectors(
+                version,
+                entry.ids + [row[0] for row in rows],
+                entry.matrix + [array("f", row[1]) for row in rows]
+            )
+
+        count, total = len(entry.ids), len(entry.ids) + len(rows)
+        id_buffer, matrix_buffer = entry.id_buffer, entry.matrix_buffer
+        if total > len(id_buffer):
+            capacity = max(total, 2 * count)
+            id_buffer = np.empty(capacity, dtype=np.int64)
+            id_buffer[:count] = entry.ids
+            matrix_buffer = np.empty((capacity, entry.matrix.shape[1]), dtype=np.float32)
+            matrix_buffer[:count] = entry.matrix
+
+        vectors = np.frombuffer(b"".join(row[1] for row in rows), dtype=np.float32).reshape(len(rows), -1)
+        id_buffer[count:total] = [row[0] for row in rows]
+        matrix_buffer[count:total] = vectors
+        extended = _UserVectors(version, id_buffer[:total], matrix_buffer[:total], id_buffer, matrix_buffer)
+
+        if entry.planes is not None:
+            # 沿用已有的超平面和中心，新向量只放进各自的桶
+            extended.center, extended.planes = entry.center, entry.planes
+            extended.buckets = self._extend_buckets(entry, count, vectors)
+        elif total >= self.ann_threshold:
+            self._build_lsh(extended)
+        return extended
+
+    def _extend_buckets(self, entry: _UserVectors, start: int, vectors) -> List[Dict]:
+        """新向量（行号从 start 开始）放进 LSH 桶；只复制桶字典和被改动的桶"""
+        signatures = self._signatures(entry.planes, vectors - entry.center)
+        buckets = []
+        for table, keys in zip(entry.buckets, signatures):
+            table = dict(table)
+            for offset, key in enumerate(keys.tolist()):
+                index = np.array([start + offset], dtype=np.int64)
+                table[key] = np.concatenate((table[key], index)) if key in table else index
+            buckets.append(table)
+        return buckets
+
+    def _signatures(self, planes, vectors):
+        """每张 LSH 表的签名：超平面两侧 -> 比特位"""
+        bits = (np.einsum('tbd,nd->tnb', planes, vectors) > 0).astype(np.int64)
+        return bits @ (1 << np.arange(self.lsh_bits, dtype=np.int64))
+
+    def _build_lsh(self, entry: _UserVectors):
+        """随机超平面 LSH：lsh_tables 张表，每张 lsh_bits 位"""
+        rng = np.random.default_rng(0)
+        dim = entry.matrix.shape[1]
+        entry.planes = rng.standard_normal((self.lsh_tables, self.lsh_bits, dim)).astype(np.float32)
+
+        # 哈希向量普遍带有公共分量（常见 n-gram），去中心化后超平面才能均匀切分
+        entry.center = entry.matrix.mean(axis=0)
+        signatures = self._signatures(entry.planes, entry.matrix - entry.center)
+        entry.buckets = []
+        for table in signatures:
+            order = np.argsort(table, kind="stable")
+            keys, starts = np.unique(table[order], return_index=True)
+            groups = np.split(order, starts[1:])
+            entry.buckets.append({int(k): g for k, g in zip(keys, groups)})
@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+"""
+Sharding - 按用户分片
+用一致性哈希把 user_id 路由到 N 个 SQLite 文件之一，
+支持跨分片汇总查询和调整分片数后的数据迁移
+
+用法:
+    python -m storage.sharding rebalance --kind storage --db data/symphony_mvp.db --from 4 --to 8
+    python -m storage.sharding stats --kind memory --db data/memory_palace.db --shards 4
+"""
+
+import argparse
+import bisect
+import hashlib
+import inspect
+import json
+from pathlib import Path
+from typing import Dict, List
+
+
+# 每个分片的自增 id 从 shard_index << ID_SHIFT 开始，保证 id 全局唯一，
+# 迁移用户时可以原样复制行（包括 id 和以 id 关联的表）
+ID_SHIFT = 40
+
+
+def _hash(key: str) -> int:
+    """稳定的 64 位哈希"""
+    return int.from_bytes(hashlib.md5(key.encode("utf-8")).digest()[:8], "big")
+
+
+class ConsistentHashRing:
+    """一致性哈希环（带虚拟节点）"""
+
+    def __init__(self, nodes: List[str], vnodes: int = 64):
+        self._ring = sorted(
+            (_hash(f"{node}#{i}"), node)
+            for node in nodes
+            for i in range(vnodes)
+        )
+        self._keys = [h for h, _ in self._ring]
+
+    def node_for(self, key: str) -> str:
+        """key 所在的节点"""
+        index = bisect.bisect(self._keys, _hash(key)) % len(self._keys)
+        return self._ring[index][1]
+
+
+def shard_path(db_path, index: int) -> Path:
+    """分片文件路径：data/symphony_mvp.db -> data/symphony_mvp.shard03.db"""
+    db_path = Path(db_path)
+    return db_path.with_name(f"{db_path.stem}.shard{index:02d}{db_path.suffix}")
+
+
+class ShardedStore:
+    """
+    分片存储门面 - 包装 SimpleStorage 或 MemoryPalace
+    第一个参数是 user_id 的方法（包括异步版本）自动路由到对应分片；
+    其它方法（如按记忆 id 查询）需要先 for_user(user_id) 取得分片
+    """
+
+    def __init__(self, store_class, db_path, shard_count: int, vnodes: int = 64, **store_kwargs):
+        self.store_class = store_class
+        self.db_path = Path(db_path)
+        self.shard_count = shard_count
+        self.vnodes = vnodes
+        self.store_kwargs = store_kwargs
+
+        self.shards = {}
+        for index in range(shard_count):
+            self.shards[self._name(index)] = self._open_shard(index)
+        self._ring = ConsistentHashRing(list(self.shards), vnodes)
+
+    @staticmethod
+    def _name(index: int) -> str:
+        return f"shard{index:02d}"
+
+    def _open_shard(self, index: int):
+        """打开（必要时创建）一个分片，并设置它的 id 起点"""
+        store = self.store_class(shard_path(self.db_path, index), **self.store_kwargs)
+        base = index << ID_SHIFT
+        with store._pool.write() as conn:
+            for table, _ in store.SHARD_TABLES:
+                has_id = conn.execute(
+                    "SELECT 1 FROM pragma_table_info(?) WHERE name = 'id' AND pk = 1", (table,)
+                ).fetchone()
+                if not has_id:
+                    continue
+
+                row = conn.execute('SELECT seq FROM sqlite_sequence WHERE name = ?', (table,)).fetchone()
+                if row is None:
+                    conn.execute('INSERT INTO sqlite_sequence (name, seq) VALUES (?, ?)', (table, base))
+                elif row[0] < base:
+                    conn.execute('UPDATE sqlite_sequence SET seq = ? WHERE name = ?', (base, table))
+        return store
+
+    # ==================== 路由 ====================
+
+    def for_user(self, user_id: str):
+        """用户所在的分片"""
+        return self.shards[self._ring.node_for(user_id)]
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        method = getattr(self.store_class, name)
+        if not callable(method):
+            raise AttributeError(name)
+
+        params = list(inspect.signature(method).parameters)
+        if len(params) < 2 or params[1] != "user_id":
+            raise AttributeError(
+                f"{name}() is not routed by user_id; use for_user(user_id).{name}() or fan_out()"
+            )
+
+        def routed(*args, **kwargs):
+            user_id = args[0] if args else kwargs["user_id"]
+            return getattr(self.for_user(user_id), name)(*args, **kwargs)
+
+        routed.__name__ = name
+        return routed
+
+    def fan_out(self, method: str, *args, **kwargs) -> Dict:
+        """在所有分片上执行同一方法，返回 {分片名: 结果}"""
+        return {
+            name: getattr(store, method)(*args, **kwargs)
+            for name, store in self.shards.items()
+        }
+
+    def table_counts(self) -> Dict:
+        """管理查询：各分片各表的行数和用户数"""
+        counts = {}
+        for name, store in self.shards.items():
+            with store._pool.read() as conn:
+                counts[name] = {
+                    table: conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+                    for table, _ in store.SHARD_TABLES
+                }
+                counts[name]["users"] = len(self._users(conn, store))
+        return counts
+
+    def close(self):
+        """关闭所有分片"""
+        for store in self.shards.values():
+            store.close()
+
+    # ==================== 重新分片 ====================
+
+    @staticmethod
+    def _users(conn, store) -> List[str]:
+        """分片中出现过的全部 user_id"""
+        selects = [
+            f'SELECT user_id FROM {table}'
+            for table, where in store.SHARD_TABLES
+            if where == "user_id = ?"
+        ]
+        return [row[0] for row in conn.execute(' UNION '.join(selects))]
+
+    def rebalance(self, new_shard_count: int) -> Dict:
+        """调整分片数：把路由发生变化的用户整体迁移到新分片"""
+        for index in range(self.shard_count, new_shard_count):
+            self.shards[self._name(index)] = self._open_shard(index)
+
+        new_ring = ConsistentHashRing(
+            [self._name(i) for i in range(new_shard_count)], self.vnodes
+        )
+
+        moved = {"users": 0, "rows": 0}
+        for name, store in list(self.shards.items()):
+            with store._pool.read() as conn:
+                users = self._users(conn, store)
+
+            for user_id in users:
+                target = new_ring.node_for(user_id)
+                if target != name:
+                    moved["rows"] += self._move_user(user_id, store, self.shards[target])
+                    moved["users"] += 1
+
+        # 缩容时旧分片已清空，关闭后由运维删除文件
+        for index in range(new_shard_count, self.shard_count):
+            self.shards.pop(self._name(index)).close()
+
+        self.shard_count = new_shard_count
+        self._ring = new_ring
+        return moved
+
+    @staticmethod
+    def _move_user(user_id: str, source, target) -> int:
+        """把一个用户的全部行从 source 复制到 target 后删除"""
+        rows = 0
+        with source._pool.write() as conn:
+            conn.commit()
+            conn.execute('ATTACH DATABASE ? AS dst', (str(target.db_path),))
+            try:
+                conn.execute('BEGIN IMMEDIATE')
+                # 共用的表（压缩字典）整表复制，目标分片已有的行不动，迁移过去的压缩行照常解压
+                for table in source.SHARD_SHARED_TABLES:
+                    conn.execute(f'INSERT OR IGNORE INTO dst.{table} SELECT * FROM main.{table}')
+                for table, where in source.SHARD_TABLES:
+                    columns = ", ".join(
+                        row[1] for row in conn.execute(f'PRAGMA main.table_info({table})')
+                    )
+                    rows += conn.execute(f'''
+                        INSERT OR IGNORE INTO dst.{table} ({columns})
+                        SELECT {columns} FROM main.{table} WHERE {where}
+                    ''', (user_id,)).rowcount
+                conn.commit()
+
+                # 依赖其它表的行（按 SHARD_TABLES 顺序靠后）先删
+                conn.execute('BEGIN IMMEDIATE')
+                for table, where in reversed(source.SHARD_TABLES):
+                    conn.execute(f'DELETE FROM main.{table} WHERE {where}', (user_id,))
+                conn.commit()
+            finally:
+                if conn.in_transaction:
+                    conn.rollback()
+                conn.execute('DETACH DATABASE dst')
+        return rows
+
+
+def _store_class(kind: str):
+    if kind == "storage":
+        from storage.simple_storage import SimpleStorage
+        return SimpleStorage
+    from storage.memory_palace import MemoryPalace
+    return MemoryPalace
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Symphony 分片管理")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    rebalance = sub.add_parser("rebalance", help="调整分片数并迁移数据")
+    rebalance.add_argument("--kind", choices=["storage", "memory"], required=True)
+    rebalance.add_argument("--db", required=True, help="未分片时的数据库路径")
+    rebalance.add_argument("--from", dest="old", type=int, required=True)
+    rebalance.add_argument("--to", dest="new", type=int, required=True)
+
+    stats = sub.add_parser("stats", help="各分片行数")
+    stats.add_argument("--kind", choices=["storage", "memory"], required=True)
+    stats.add_argument("--db", required=True)
+    stats.add_argument("--shards", type=int, required=True)
+
+    args = parser.parse_args()
+    store_class = _store_class(args.kind)
+
+    if args.command == "rebalance":
+        sharded = ShardedStore(store_class, args.db, args.old)
+        result = sharded.rebalance(args.new)
+    else:
+        sharded = ShardedStore(store_class, args.db, args.shards)
+        result = sharded.table_counts()
+
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    sharded.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -2,166 +2,380 @@
 简化存储 - 使用SQLite
 """
 
-import sqlite3
 import json
 from pathlib import Path
-from typing import List, Dict, Optional
-from datetime import datetime
+from typing import List, Dict, Iterator, Optional, Tuple, Union
 
-class SimpleStorage:
+from storage.async_db import AsyncStoreMixin, async_method
+from storage.message_archive import MessageArchiver
+from storage.migrations import apply_migrations, now_ms, rebuild_table
+from storage.sqlite_pool import SQLitePool
+from storage.text_codec import TextCodec, create_codec_table
+from storage.write_behind import WriteBehindQueue
+
+def _migrate_base_tables(conn):
+    """v1: 基础表"""
+    cursor = conn.cursor()
+    
+    # 用户消息表
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS user_messages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id TEXT NOT NULL,
+            content TEXT NOT NULL,
+            message_type TEXT DEFAULT 'direct_message',
+            metadata TEXT DEFAULT '{}',
+            timestamp TEXT NOT NULL
+        )
+    ''')
+    
+    # 分析结果表
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS analysis_results (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id TEXT NOT NULL,
+            framework TEXT NOT NULL,
+            insights TEXT NOT NULL,
+            confidence REAL DEFAULT 0.8,
+            timestamp TEXT NOT NULL
+        )
+    ''')
+    
+    # 行动计划表
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS action_plans (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id TEXT NOT NULL,
+            title TEXT NOT NULL,
+            steps TEXT NOT NULL,
+            created_at TEXT NOT NULL,
+            due_date TEXT
+        )
+    ''')
+
+def _migrate_epoch_ms(conn):
+    """v2: 时间列改为 epoch 毫秒整数，并按 (user_id, 时间) 建复合索引"""
+    rebuild_table(conn, 'user_messages', '''
+        CREATE TABLE {table} (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id TEXT NOT NULL,
+            content TEXT NOT NULL,
+            message_type TEXT DEFAULT 'direct_message',
+            metadata TEXT DEFAULT '{{}}',
+            timestamp INTEGER NOT NULL
+        )
+    ''', '''
+        SELECT id, user_id, content, message_type, metadata,
+               COALESCE(iso_to_ms(timestamp), 0)
+        FROM user_messages
+    ''')
+    
+    rebuild_table(conn, 'analysis_results', '''
+        CREATE TABLE {table} (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id TEXT NOT NULL,
+            framework TEXT NOT NULL,
+            insights TEXT NOT NULL,
+            confidence REAL DEFAULT 0.8,
+            timestamp INTEGER NOT NULL
+        )
+    ''', '''
+        SELECT id, user_id, framework, insights, confidence,
+               COALESCE(iso_to_ms(timestamp), 0)
+        FROM analysis_results
+    ''')
+    
+    rebuild_table(conn, 'action_plans', '''
+        CREATE TABLE {table} (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id TEXT NOT NULL,
+            title TEXT NOT NULL,
+            steps TEXT NOT NULL,
+            created_at INTEGER NOT NULL,
+            due_date TEXT
+        )
+    ''', '''
+        SELECT id, user_id, title, steps,
+               COALESCE(iso_to_ms(created_at), 0), due_date
+        FROM action_plans
+    ''')
+    
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_messages_user_ts ON user_messages(user_id, timestamp)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_analysis_user_ts ON analysis_results(user_id, timestamp)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_plans_user_created ON action_plans(user_id, created_at)')
+
+def _migrate_archive_index(conn):
+    """v3: 归档索引（记录每个用户的数据在哪些月份归档库中）"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS archive_index (
+            user_id TEXT NOT NULL,
+            table_name TEXT NOT NULL,
+            month TEXT NOT NULL,
+            row_count INTEGER NOT NULL,
+            min_ts INTEGER NOT NULL,
+            max_ts INTEGER NOT NULL,
+            PRIMARY KEY (user_id, table_name, month)
+        )
+    ''')
+
+def _migrate_codec_dictionaries(conn):
+    """v4: 文本压缩字典"""
+    create_codec_table(conn)
+
+MIGRATIONS = [
+    (1, "base tables", _migrate_base_tables),
+    (2, "epoch-ms timestamps and (user_id, time) indexes", _migrate_epoch_ms),
+    (3, "archive index", _migrate_archive_index),
+    (4, "text compression dictionaries", _migrate_codec_dictionaries),
+]
+
+# 键集分页的起点：比任何 (时间, id) 都小
+_KEYSET_START = (-(2 ** 63), -(2 ** 63))
+
+INSERT_MESSAGE_SQL = '''
+    INSERT INTO user_messages 
+    (user_id, content, message_type, metadata, timestamp)
+    VALUES (?, ?, ?, ?, ?)
+'''
+
+INSERT_ANALYSIS_SQL = '''
+    INSERT INTO analysis_results 
+    (user_id, framework, insights, confidence, timestamp)
+    VALUES (?, ?, ?, ?, ?)
+'''
+
+INSERT_ACTION_PLAN_SQL = '''
+    INSERT INTO action_plans 
+    (user_id, title, steps, created_at)
+    VALUES (?, ?, ?, ?)
+'''
+
+class SimpleStorage(AsyncStoreMixin):
     """简化存储"""
     
-    def __init__(self, db_path="data/symphony_mvp.db"):
+    # 按用户分片时需要整体迁移的表：(表名, 选出某个用户数据的条件)
+    SHARD_TABLES = (
+        ("user_messages", "user_id = ?"),
+        ("analysis_results", "user_id = ?"),
+        ("action_plans", "user_id = ?"),
+        ("archive_index", "user_id = ?"),
+    )
+    
+    # 分片之间共用的表：迁移用户前整表复制到目标分片，不从源分片删除
+    SHARD_SHARED_TABLES = ("codec_dictionaries",)
+    
+    # 可以压缩的文本列
+    TEXT_COLUMNS = (
+        ("user_messages", "content"),
+        ("analysis_results", "insights"),
+    )
+    
+    def __init__(
+        self,
+        db_path="data/symphony_mvp.db",
+        max_readers=4,
+        busy_timeout_ms=5000,
+        write_behind=False,
+        batch_size=500,
+        flush_interval_ms=50,
+        max_pending=10000,
+        synchronous="NORMAL",
+        retention_days=None,
+        archive_dir=None,
+        archive_compress=False,
+        compress_text=False,
+        compress_min_length=200
+    ):
+        """
+        write_behind=True 时写入进入内存队列，按 batch_size 行或
+        flush_interval_ms 毫秒组提交，save_* 返回最终得到行 id 的 Future。
+        队列中尚未提交的写入对 get_* 不可见，需要时调用 flush()。
+        synchronous 控制组提交的持久化级别（NORMAL / FULL）。
+        retention_days 设置后，archive_old_data() 把更早的消息和分析结果
+        按月移入 archive_dir 下的归档库（archive_compress 时 zlib 压缩正文）。
+        compress_text=True 时消息正文和分析结果按库里最新的字典压缩存储
+        （不短于 compress_min_length 字节的才压缩，见 text_codec），读取时只解压返回的行。
+        """
         self.db_path = Path(db_path)
         self.db_path.parent.mkdir(exist_ok=True)
+        self._pool = SQLitePool(
+            self.db_path,
+            max_readers=max_readers,
+            busy_timeout_ms=busy_timeout_ms
+        )
         self._init_db()
-    
-    def _init_db(self):
-        """初始化数据库"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        # 用户消息表
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS user_messages (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id TEXT NOT NULL,
-                content TEXT NOT NULL,
-                message_type TEXT DEFAULT 'direct_message',
-                metadata TEXT DEFAULT '{}',
-                timestamp TEXT NOT NULL
-            )
-        ''')
         
-        # 分析结果表
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS analysis_results (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id TEXT NOT NULL,
-                framework TEXT NOT NULL,
-                insights TEXT NOT NULL,
-                confidence REAL DEFAULT 0.8,
-                timestamp TEXT NOT NULL
-            )
-        ''')
+        self.text_codec = TextCodec(self._pool, enabled=compress_text, min_length=compress_min_length)
+        self.archiver = MessageArchiver(
+            self._pool,
+            archive_dir or self.db_path.parent / "archive",
+            retention_days=retention_days,
+            compress=archive_compress,
+            decode=self.text_codec.decode
+        )
         
-        # 行动计划表
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS action_plans (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id TEXT NOT NULL,
-                title TEXT NOT NULL,
-                steps TEXT NOT NULL,
-                created_at TEXT NOT NULL,
-                due_date TEXT
+        self._writer = None
+        if write_behind:
+            self._writer = WriteBehindQueue(
+                self.db_path,
+                batch_size=batch_size,
+                flush_interval_ms=flush_interval_ms,
+                max_pending=max_pending,
+                synchronous=synchronous
             )
-        ''')
+    
+    def _init_db(self):
+        """初始化数据库（执行尚未应用的版本迁移）"""
+        with self._pool.write() as conn:
+            apply_migrations(conn, MIGRATIONS)
+    
+    def _insert(self, sql: str, params: tuple):
+        """执行单行 INSERT；写后模式下入队并返回 Future"""
+        if self._writer is not None:
+            return self._writer.submit(sql, params)
         
-        conn.commit()
-        conn.close()
+        with self._pool.write() as conn:
+            cursor = conn.execute(sql, params)
+        return cursor.lastrowid
+    
+    def flush(self, timeout: Optional[float] = None):
+        """等待写后队列中的写入全部提交"""
+        if self._writer is not None:
+            self._writer.flush(timeout)
+    
+    def close(self):
+        """刷出写后队列，关闭数据库线程池和连接池"""
+        self._shutdown_db_executor()
+        if self._writer is not None:
+            self._writer.close()
+        self._pool.close()
     
     def save_message(self, user_id: str, content: str, message_type="direct_message", metadata=None):
         """保存用户消息"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            INSERT INTO user_messages 
-            (user_id, content, message_type, metadata, timestamp)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (
+        return self._insert(INSERT_MESSAGE_SQL, (
             user_id, 
-            content, 
+            self.text_codec.encode(content), 
             message_type,
             json.dumps(metadata or {}),
-            datetime.now().isoformat()
+            now_ms()
         ))
+    
+    def get_user_messages(self, user_id: str, limit=50, before: Optional[int] = None) -> List[Dict]:
+        """获取用户消息（按时间倒序），在线数据不足时继续从归档库读取"""
+        with self._pool.read() as conn:
+            rows = conn.execute('''
+                SELECT * FROM user_messages 
+                WHERE user_id = ? AND timestamp < ? 
+                ORDER BY timestamp DESC, id DESC 
+                LIMIT ?
+            ''', (user_id, before if before is not None else 2 ** 63 - 1, limit)).fetchall()
         
-        conn.commit()
-        conn.close()
-        return cursor.lastrowid
+        messages = [self.text_codec.decode_row(dict(row)) for row in rows]
+        
+        if len(messages) < limit:
+            oldest = messages[-1]['timestamp'] if messages else before
+            messages.extend(self.archiver.fetch_user_messages(user_id, oldest, limit - len(messages)))
+        
+        return messages
+    
+    def iter_user_messages(
+        self,
+        user_id: str,
+        after: Union[int, Tuple[int, int], None] = None,
+        batch_size: int = 500
+    ) -> Iterator[Dict]:
+        """
+        按 (timestamp, id) 升序流式遍历用户消息，内存占用与历史长度无关
+        after 可以是 epoch 毫秒（只返回更晚的消息），也可以是上次遍历到的
+        (timestamp, id) 游标，用于断点续读
+        """
+        return self._iter_keyset('user_messages', 'timestamp', user_id, after, batch_size)
     
-    def get_user_messages(self, user_id: str, limit=50) -> List[Dict]:
-        """获取用户消息"""
-        conn = sqlite3.connect(self.db_path)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
+    def _iter_keyset(self, table: str, time_column: str, user_id: str, after, batch_size: int) -> Iterator[Dict]:
+        """键集分页：每批一次短查询，从 (时间, id) 游标之后继续"""
+        if after is None:
+            key = _KEYSET_START
+        elif isinstance(after, tuple):
+            key = after
+        else:
+            key = (after, 2 ** 63 - 1)
         
-        cursor.execute('''
-            SELECT * FROM user_messages 
-            WHERE user_id = ? 
-            ORDER BY timestamp DESC 
+        query = f'''
+            SELECT * FROM {table}
+            WHERE user_id = ? AND ({time_column}, id) > (?, ?)
+            ORDER BY {time_column}, id
             LIMIT ?
-        ''', (user_id, limit))
+        '''
         
-        rows = cursor.fetchall()
-        conn.close()
-        
-        return [dict(row) for row in rows]
+        while True:
+            # 每批单独借还连接，不在 yield 期间占着读事务
+            with self._pool.read() as conn:
+                rows = conn.execute(query, (user_id, key[0], key[1], batch_size)).fetchall()
+            
+            for row in rows:
+                yield self.text_codec.decode_row(dict(row))
+            
+            if len(rows) < batch_size:
+                return
+            key = (rows[-1][time_column], rows[-1]['id'])
+    
+    def archive_old_data(self, retention_days: Optional[int] = None) -> Dict:
+        """把超过保留期的数据移入按月归档库，并增量回收空间"""
+        return self.archiver.run(retention_days)
     
     def save_analysis(self, user_id: str, framework: str, insights: List[str], confidence=0.8):
         """保存分析结果"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            INSERT INTO analysis_results 
-            (user_id, framework, insights, confidence, timestamp)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (
+        return self._insert(INSERT_ANALYSIS_SQL, (
             user_id,
             framework,
-            json.dumps(insights),
+            self.text_codec.encode(json.dumps(insights)),
             confidence,
-            datetime.now().isoformat()
+            now_ms()
         ))
-        
-        conn.commit()
-        conn.close()
-        return cursor.lastrowid
     
     def save_action_plan(self, user_id: str, title: str, steps: List[Dict], overview: str = ""):
         """保存行动计划"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
         plan_data = {
             "overview": overview,
             "steps": steps
         }
         
-        cursor.execute('''
-            INSERT INTO action_plans 
-            (user_id, title, steps, created_at)
-            VALUES (?, ?, ?, ?)
-        ''', (
+        return self._insert(INSERT_ACTION_PLAN_SQL, (
             user_id,
             title,
             json.dumps(plan_data),
-            datetime.now().isoformat()
+            now_ms()
         ))
-        
-        conn.commit()
-        conn.close()
-        return cursor.lastrowid
     
     def get_action_plans(self, user_id: str, limit=10) -> List[Dict]:
         """获取用户的行动计划"""
-        conn = sqlite3.connect(self.db_path)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT * FROM action_plans 
-            WHERE user_id = ? 
-            ORDER BY created_at DESC 
-            LIMIT ?
-        ''', (user_id, limit))
-        
-        rows = cursor.fetchall()
-        conn.close()
+        with self._pool.read() as conn:
+            rows = conn.execute('''
+                SELECT * FROM action_plans 
+                WHERE user_id = ? 
+                ORDER BY created_at DESC, id DESC 
+                LIMIT ?
+            ''', (user_id, limit)).fetchall()
         
         return [dict(row) for row in rows]
+    
+    def iter_action_plans(
+        self,
+        user_id: str,
+        after: Union[int, Tuple[int, int], None] = None,
+        batch_size: int = 500
+    ) -> Iterator[Dict]:
+        """按 (created_at, id) 升序流式遍历行动计划，参数同 iter_user_messages"""
+        return self._iter_keyset('action_plans', 'created_at', user_id, after, batch_size)
+    
+    # ==================== 异步接口 ====================
+    
+    asave_message = async_method(save_message)
+    aget_user_messages = async_method(get_user_messages)
+    asave_analysis = async_method(save_analysis)
+    asave_action_plan = async_method(save_action_plan)
+    aget_action_plans = async_method(get_action_plans)
+    aarchive_old_data = async_method(archive_old_data)
 
 # 全局存储实例
-storage = SimpleStorage()
\ No newline at end of file
+storage = SimpleStorage()
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+SQLite Pool - SQLite 连接池
+复用长连接，启用 WAL 日志模式，读写连接分离
+"""
+
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+
+
+class SQLitePool:
+    """SQLite 连接池 - 长连接复用 + WAL + 只读连接"""
+
+    def __init__(
+        self,
+        db_path,
+        max_writers: int = 2,
+        max_readers: int = 4,
+        busy_timeout_ms: int = 5000,
+        synchronous: str = "NORMAL"
+    ):
+        self.db_path = Path(db_path)
+        self.busy_timeout_ms = busy_timeout_ms
+        self.synchronous = synchronous
+
+        self._writers = queue.LifoQueue()
+        self._readers = queue.LifoQueue()
+        self._limits = {"write": max_writers, "read": max_readers}
+        self._opened = {"write": 0, "read": 0}
+        self._all = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    # ==================== 连接创建 ====================
+
+    def _connect(self, readonly: bool) -> sqlite3.Connection:
+        """创建一个配置好的连接"""
+        timeout = self.busy_timeout_ms / 1000
+        if readonly:
+            uri = f"{self.db_path.resolve().as_uri()}?mode=ro"
+            conn = sqlite3.connect(uri, uri=True, timeout=timeout, check_same_thread=False)
+            conn.execute('PRAGMA query_only = ON')
+        else:
+            conn = sqlite3.connect(self.db_path, timeout=timeout, check_same_thread=False)
+            # WAL 是持久化设置，写连接上设置一次即可
+            conn.execute('PRAGMA journal_mode = WAL')
+
+        conn.execute(f'PRAGMA synchronous = {self.synchronous}')
+        conn.execute(f'PRAGMA busy_timeout = {int(self.busy_timeout_ms)}')
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def open_reader(self) -> sqlite3.Connection:
+        """创建一个不进池的只读连接，由调用方独占使用（连接池关闭时一并关闭）"""
+        conn = self._connect(readonly=True)
+        with self._lock:
+            self._all.append(conn)
+        return conn
+
+    def confine_to_thread(self):
+        """为当前线程创建专属的读写连接（用作线程池 initializer）"""
+        confined = {
+            "write": self._connect(readonly=False),
+            "read": self._connect(readonly=True)
+        }
+        with self._lock:
+            self._all.extend(confined.values())
+        self._local.connections = confined
+
+    def _acquire(self, kind: str) -> sqlite3.Connection:
+        """从池中取出连接，池未满时按需创建"""
+        confined = getattr(self._local, "connections", None)
+        if confined is not None:
+            return confined[kind]
+
+        pool = self._writers if kind == "write" else self._readers
+
+        try:
+            return pool.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            can_open = self._opened[kind] < self._limits[kind]
+            if can_open:
+                self._opened[kind] += 1
+
+        if can_open:
+            try:
+                conn = self._connect(readonly=(kind == "read"))
+            except Exception:
+                with self._lock:
+                    self._opened[kind] -= 1
+                raise
+            with self._lock:
+                self._all.append(conn)
+            return conn
+
+        return pool.get()
+
+    def _release(self, kind: str, conn: sqlite3.Connection):
+        """归还连接"""
+        confined = getattr(self._local, "connections", None)
+        if confined is not None and confined[kind] is conn:
+            return
+
+        pool = self._writers if kind == "write" else self._readers
+        pool.put(conn)
+
+    # ==================== 公共接口 ====================
+
+    @contextmanager
+    def write(self):
+        """获取写连接，退出时提交事务（异常时回滚）"""
+        conn = self._acquire("write")
+        try:
+            with conn:
+                yield conn
+        finally:
+            self._release("write", conn)
+
+    @contextmanager
+    def read(self):
+        """获取只读连接"""
+        conn = self._acquire("read")
+        try:
+            yield conn
+        finally:
+            # 确保不会把未结束的读事务留在池里
+            if conn.in_transaction:
+                conn.rollback()
+            self._release("read", conn)
+
+    def close(self):
+        """关闭所有连接"""
+        with self._lock:
+            connections, self._all = self._all, []
+            self._opened = {"write": 0, "read": 0}
+            self._writers = queue.LifoQueue()
+            self._readers = queue.LifoQueue()
+
+        for conn in connections:
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
@@ -0,0 +1,344 @@
+#!/usr/bin/env python3
+"""
+Text Codec - 文本列的字典压缩
+长文本压缩成 BLOB 存回原来的 TEXT 列（SQLite 的列类型不限制值的类型），短文本和压缩后不变小的文本原样保存；
+读取时按值的类型解码，所以开启压缩前后写入的行、用不同字典压缩的行可以混在同一张表里
+
+BLOB 格式：MAGIC(1 字节) + 字典 id(4 字节, 大端) + 压缩数据
+- 字典存在库里的 codec_dictionaries 表，id 取字典内容的哈希：同一份字典在任何库里 id 相同，
+  行在分片之间原样复制后照常解压；id 0 表示不带预置字典的 zlib
+- 字典轮换：训练出新字典后新写入改用它，旧字典保留，旧行照常解压（recompress 可以按批改用新字典）
+- 有 zstandard 时训练 zstd 字典，否则用 zlib 预置字典
+- 不带 MAGIC 的 BLOB 是消息归档写入的普通 zlib 数据
+
+用法:
+    python -m storage.text_codec train --kind storage --db data/symphony_mvp.db --recompress
+    python -m storage.text_codec report --kind memory --db data/memory_palace.db
+"""
+
+import argparse
+import hashlib
+import json
+import re
+import struct
+import threading
+import zlib
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from storage.migrations import now_ms
+
+try:
+    import zstandard
+except ImportError:  # 没有 zstandard 时只用 zlib
+    zstandard = None
+
+
+MAGIC = b'\xa7'
+_HEADER = struct.Struct('>cI')
+
+# zlib 的窗口是 32KB，更长的预置字典只有最后 32KB 起作用
+ZLIB_DICTIONARY_SIZE = 32 * 1024
+ZSTD_DICTIONARY_SIZE = 64 * 1024
+
+# 训练 zlib 字典时按标点和换行把样本切成片段
+_SEGMENT = re.compile(r'[^。！？；，、：\n.!?;,:]+[。！？；，、：\n.!?;,:]*')
+
+
+def create_codec_table(conn):
+    """建字典表（在迁移事务中调用）"""
+    conn.execute('''
+        CREATE TABLE codec_dictionaries (
+            id INTEGER PRIMARY KEY,
+            algorithm TEXT NOT NULL,
+            dictionary BLOB NOT NULL,
+            created_at INTEGER NOT NULL
+        )
+    ''')
+
+
+def dictionary_id(algorithm: str, dictionary: bytes) -> int:
+    """字典内容的哈希（非 0 的 32 位整数）"""
+    digest = hashlib.sha1(algorithm.encode('ascii') + b'\0' + dictionary).digest()
+    return int.from_bytes(digest[:4], 'big') or 1
+
+
+def train_zlib_dictionary(samples: List[str], size: int = ZLIB_DICTIONARY_SIZE) -> bytes:
+    """
+    zlib 预置字典：在多个样本里重复出现的片段按 (出现次数 - 1) × 长度 取价值最高的，
+    直到填满 size 字节；价值高的放在末尾，离被压缩的数据近，引用距离短
+    """
+    counts = Counter()
+    for sample in samples:
+        counts.update(set(_SEGMENT.findall(sample)))
+
+    scored = sorted(
+        ((count - 1) * len(segment.encode('utf-8')), segment)
+        for segment, count in counts.items()
+        if count > 1 and len(segment) > 1
+    )
+
+    chosen, total = [], 0
+    for _, segment in reversed(scored):
+        data = segment.encode('utf-8')
+        if total + len(data) > size:
+            continue
+        chosen.append(data)
+        total += len(data)
+    return b''.join(reversed(chosen))
+
+
+class TextCodec:
+    """文本编解码器 - 压缩用最新的字典，解压按 BLOB 头里的字典 id"""
+
+    def __init__(self, pool, enabled: bool = False, min_length: int = 200, level: int = 6):
+        """
+        enabled: 新写入的文本是否压缩（关闭时照常读取已压缩的行）
+        min_length: 短于该字节数的文本不压缩
+        level: zlib / zstd 的压缩级别
+        """
+        self.enabled = enabled
+        self.min_length = min_length
+        self.level = level
+        self._pool = pool
+        self._dictionaries: Dict[int, Tuple[str, bytes]] = {0: ('zlib', b'')}
+        self._active = 0
+        self._compressors = {}
+        self._lock = threading.Lock()
+        self._loaded = False
+
+        # raw / stored: 压缩过的文本压缩前后的字节数
+        self.stats = {"compressed": 0, "stored_plain": 0, "decoded": 0, "raw_bytes": 0, "stored_bytes": 0}
+
+    # ==================== 编解码 ====================
+
+    def encode(self, text: Optional[str]):
+        """写入前调用：够长且压缩后变小的文本 -> BLOB，否则原样返回"""
+        if not self.enabled or text is None:
+            return text
+        data = text.encode('utf-8')
+        if len(data) < self.min_length:
+            self.stats["stored_plain"] += 1
+            return text
+
+        dictionary_id = self._active_id()
+        payload = self._compress(dictionary_id, data)
+        if len(payload) + _HEADER.size >= len(data):
+            self.stats["stored_plain"] += 1
+            return text
+
+        self.stats["compressed"] += 1
+        self.stats["raw_bytes"] += len(data)
+        self.stats["stored_bytes"] += len(payload) + _HEADER.size
+        return _HEADER.pack(MAGIC, dictionary_id) + payload
+
+    def decode(self, value):
+        """读出后调用：BLOB 解压回文本，文本原样返回"""
+        if not isinstance(value, bytes):
+            return value
+        if value[:1] != MAGIC:
+            return zlib.decompress(value).decode('utf-8')
+
+        _, dictionary_id = _HEADER.unpack_from(value)
+        algorithm, dictionary = self._dictionary(dictionary_id)
+        payload = memoryview(value)[_HEADER.size:]
+        self.stats["decoded"] += 1
+
+        if algorithm == 'zstd':
+            if zstandard is None:
+                raise RuntimeError("zstandard is required to read zstd-compressed text")
+            decompressor = zstandard.ZstdDecompressor(dict_data=zstandard.ZstdCompressionDict(dictionary))
+            return decompressor.decompress(payload).decode('utf-8')
+
+        decompressor = zlib.decompressobj(-15, zdict=dictionary) if dictionary else zlib.decompressobj(-15)
+        return (decompressor.decompress(payload) + decompressor.flush()).decode('utf-8')
+
+    def decode_row(self, row: Dict, column: str = 'content') -> Dict:
+        """解码结果字典里的文本列（原地修改并返回）"""
+        value = row.get(column)
+        if isinstance(value, bytes):
+            row[column] = self.decode(value)
+        return row
+
+    def _compress(self, dictionary_id: int, data: bytes) -> bytes:
+        entry = self._compressors.get(dictionary_id)
+        if entry is None:
+            algorithm, dictionary = self._dictionary(dictionary_id)
+            if algorithm == 'zstd':
+                compressor = zstandard.ZstdCompressor(
+                    level=self.level,
+                    dict_data=zstandard.ZstdCompressionDict(dictionary),
+                    write_dict_id=False
+                )
+            elif dictionary:
+                compressor = zlib.compressobj(self.level, zlib.DEFLATED, -15, zdict=dictionary)
+            else:
+                compressor = zlib.compressobj(self.level, zlib.DEFLATED, -15)
+            entry = self._compressors[dictionary_id] = (algorithm, compressor)
+
+        algorithm, compressor = entry
+        if algorithm == 'zstd':
+            # ZstdCompressor 不能被多个线程同时使用
+            with self._lock:
+                return compressor.compress(data)
+        # 装好预置字典的压缩器作为模板，每次复制一份（比每次重新装字典快）
+        stream = compressor.copy()
+        return stream.compress(data) + stream.flush()
+
+    # ==================== 字典 ====================
+
+    def _active_id(self) -> int:
+        if not self._loaded:
+            self.load()
+        return self._active
+
+    def _dictionary(self, dictionary_id: int) -> Tuple[str, bytes]:
+        entry = self._dictionaries.get(dictionary_id)
+        if entry is None:
+            # 其它进程训练的新字典，或从其它分片复制过来的行
+            self.load()
+            entry = self._dictionaries.get(dictionary_id)
+            if entry is None:
+                raise ValueError(f"unknown text dictionary: {dictionary_id:#010x}")
+        return entry
+
+    def load(self):
+        """从库里读出全部字典，最新的一份作为压缩用的字典"""
+        with self._pool.read() as conn:
+            rows = conn.execute(
+                'SELECT id, algorithm, dictionary FROM codec_dictionaries ORDER BY created_at, rowid'
+            ).fetchall()
+        with self._lock:
+            for dictionary_id, algorithm, dictionary in rows:
+                self._dictionaries[dictionary_id] = (algorithm, bytes(dictionary))
+            if rows:
+                self._active = rows[-1][0]
+            self._loaded = True
+
+    def train(self, columns: Iterable[Tuple[str, str]], sample_rows: int = 5000, algorithm: Optional[str] = None) -> int:
+        """
+        用各 (表, 列) 最近的 sample_rows 行训练新字典并设为当前字典，返回字典 id
+        只有达到 min_length 的文本参与训练（更短的不会被压缩）
+        """
+        samples = []
+        with self._pool.read() as conn:
+            for table, column in columns:
+                for (value,) in conn.execute(
+                    f'SELECT {column} FROM {table} ORDER BY id DESC LIMIT ?', (sample_rows,)
+                ):
+                    text = self.decode(value)
+                    if text and len(text.encode('utf-8')) >= self.min_length:
+                        samples.append(text)
+        if not samples:
+            raise ValueError("no text long enough to train a dictionary")
+
+        algorithm = algorithm or ('zstd' if zstandard is not None else 'zlib')
+        if algorithm == 'zstd':
+            dictionary = zstandard.train_dictionary(
+                ZSTD_DICTIONARY_SIZE, [sample.encode('utf-8') for sample in samples]
+            ).as_bytes()
+        else:
+            dictionary = train_zlib_dictionary(samples)
+
+        new_id = dictionary_id(algorithm, dictionary)
+        with self._pool.write() as conn:
+            conn.execute('''
+                INSERT INTO codec_dictionaries (id, algorithm, dictionary, created_at) VALUES (?, ?, ?, ?)
+                ON CONFLICT (id) DO UPDATE SET created_at = excluded.created_at
+            ''', (new_id, algorithm, dictionary, now_ms()))
+        self.load()
+        return new_id
+
+    # ==================== 批量维护 ====================
+
+    def recompress(self, table: str, column: str, batch_size: int = 500) -> int:
+        """
+        按 id 分批把该列改用当前字典（或按当前设置改回文本），每批一个短事务，返回改写的行数
+        字典轮换后调用；已经是当前字典的行跳过
+        """
+        active = self._active_id()
+        current = _HEADER.pack(MAGIC, active)
+        rewritten = 0
+        last_id = 0
+        while True:
+            with self._pool.write() as conn:
+                rows = conn.execute(
+                    f'SELECT id, {column} FROM {table} WHERE id > ? ORDER BY id LIMIT ?', (last_id, batch_size)
+                ).fetchall()
+                if not rows:
+                    break
+
+                updates = []
+                for row_id, value in rows:
+                    if isinstance(value, bytes) and value[:_HEADER.size] == current:
+                        continue
+                    encoded = self.encode(self.decode(value))
+                    if encoded != value:
+                        updates.append((encoded, row_id))
+                conn.executemany(f'UPDATE {table} SET {column} = ? WHERE id = ?', updates)
+
+            rewritten += len(updates)
+            last_id = rows[-1][0]
+        return rewritten
+
+    def report(self, columns: Iterable[Tuple[str, str]]) -> Dict:
+        """各列的压缩情况：行数、压缩行数、原始和实际存储的字节数"""
+        report = {}
+        with self._pool.read() as conn:
+            conn.execute('BEGIN')
+            for table, column in columns:
+                rows, stored = conn.execute(
+                    f'SELECT COUNT(*), COALESCE(SUM(length(CAST({column} AS BLOB))), 0) FROM {table}'
+                ).fetchone()
+                compressed, raw = 0, stored
+                for (value,) in conn.execute(f"SELECT {column} FROM {table} WHERE typeof({column}) = 'blob'"):
+                    compressed += 1
+                    raw += len(self.decode(value).encode('utf-8')) - len(value)
+                report[f'{table}.{column}'] = {
+                    "rows": rows,
+                    "compressed_rows": compressed,
+                    "raw_bytes": raw,
+                    "stored_bytes": stored,
+                    "ratio": round(raw / stored, 2) if stored else 1.0,
+                }
+        return report
+
+
+def _open_store(kind: str, db: str, **options):
+    if kind == "storage":
+        from storage.simple_storage import SimpleStorage
+        return SimpleStorage(db, **options)
+    from storage.memory_palace import MemoryPalace
+    return MemoryPalace(db, **options)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Symphony 文本压缩字典")
+    parser.add_argument("command", choices=["train", "report"])
+    parser.add_argument("--kind", choices=["storage", "memory"], required=True)
+    parser.add_argument("--db", required=True)
+    parser.add_argument("--sample-rows", type=int, default=5000)
+    parser.add_argument("--min-length", type=int, default=200)
+    parser.add_argument("--recompress", action="store_true", help="训练后把已有的行改用新字典")
+    args = parser.parse_args()
+
+    store = _open_store(args.kind, args.db, compress_text=True, compress_min_length=args.min_length)
+    codec = store.text_codec
+    result = {}
+    if args.command == "train":
+        try:
+            result["dictionary"] = f'{codec.train(store.TEXT_COLUMNS, args.sample_rows):#010x}'
+        except ValueError as error:
+            store.close()
+            parser.error(str(error))
+        if args.recompress:
+            result["recompressed"] = {
+                f'{table}.{column}': codec.recompress(table, column) for table, column in store.TEXT_COLUMNS
+            }
+    result["report"] = codec.report(store.TEXT_COLUMNS)
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    store.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+"""
+Tokenizer - 中英文混合分词
+正则和停用词表在导入时构建一次；中文按相邻二元组切分，其它文字按单词切分
+"""
+
+import re
+from typing import List
+
+
+CJK_RANGES = '\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff'
+
+# 一段连续的中文（第 1 组），或一个不含中文的单词
+_TOKEN_PATTERN = re.compile(f'([{CJK_RANGES}]+)|[^\\W_{CJK_RANGES}]+')
+_CJK_PATTERN = re.compile(f'[{CJK_RANGES}]+')
+
+STOPWORDS = frozenset({
+    '的', '了', '是', '在', '我', '有', '和', '就', '不', '人', '都', '一', '一个',
+    '上', '也', '很', '到', '说', '要', '去', '你', '会', '着', '没有', '看', '好',
+    '自己', '这',
+})
+
+
+def is_cjk(token: str) -> bool:
+    """token 是否全部由中文字符组成"""
+    return _CJK_PATTERN.fullmatch(token) is not None
+
+
+def segment(text: str) -> List[str]:
+    """分词：小写化，中文连续段切成相邻二元组（单字保留），其它按单词"""
+    tokens = []
+    for match in _TOKEN_PATTERN.finditer(text.lower()):
+        run = match.group()
+        if match.lastindex and len(run) > 1:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+        else:
+            tokens.append(run)
+    return tokens
+
+
+def search_text(content: str, keywords_str: str) -> str:
+    """全文索引的分词文本：关键词和正文分词后以空格连接（FTS5 的 unicode61 按空格切回词元）"""
+    return ' '.join(segment(f'{keywords_str} {content}'))
+
+
+def extract_keywords(text: str, limit: int = 5) -> List[str]:
+    """
+    提取关键词：去掉停用词和单字，按出现顺序去重
+    两个字都是停用词的中文二元组（如“我的”）也去掉
+    """
+    keywords = []
+    seen = set()
+    for token in segment(text):
+        if len(token) < 2 or token in STOPWORDS or token in seen:
+            continue
+        if len(token) == 2 and token[0] in STOPWORDS and token[1] in STOPWORDS:
+            continue
+        seen.add(token)
+        keywords.append(token)
+        if len(keywords) >= limit:
+            break
+    return keywords
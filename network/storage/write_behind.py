@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+Write Behind - 写后队列
+把零散的 INSERT 攒成批，在一个事务里 executemany 组提交
+"""
+
+import atexit
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import List, Sequence, Tuple
+
+from storage.sqlite_pool import SQLitePool
+
+
+_STOP = object()
+
+
+class WriteBehindQueue:
+    """写后队列 - 有界内存队列 + 后台线程按行数/时间组提交"""
+
+    def __init__(
+        self,
+        db_path,
+        batch_size: int = 500,
+        flush_interval_ms: int = 50,
+        max_pending: int = 10000,
+        synchronous: str = "NORMAL"
+    ):
+        """
+        batch_size: 攒够多少行立即提交
+        flush_interval_ms: 第一行入队后最多等待多久提交
+        max_pending: 队列上限，写满后 submit 会阻塞（背压）
+        synchronous: 持久化级别，FULL 表示每批提交都 fsync
+        """
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval_ms / 1000
+        self._pool = SQLitePool(db_path, max_writers=1, max_readers=0, synchronous=synchronous)
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._closed = False
+
+        self.stats = {"rows": 0, "batches": 0, "errors": 0}
+
+        self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    # ==================== 公共接口 ====================
+
+    def submit(self, sql: str, params: Sequence) -> Future:
+        """提交一条 INSERT，返回最终得到行 id 的 Future"""
+        if self._closed:
+            raise RuntimeError("write-behind queue is closed")
+
+        future = Future()
+        self._queue.put((sql, tuple(params), future))
+        return future
+
+    def flush(self, timeout: float = None):
+        """等待此前提交的所有写入落盘"""
+        if self._closed:
+            return
+        marker = Future()
+        self._queue.put((None, None, marker))
+        marker.result(timeout)
+
+    def close(self, timeout: float = None):
+        """刷出剩余写入并停止后台线程"""
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+        self._pool.close()
+        atexit.unregister(self.close)
+
+    # ==================== 后台提交 ====================
+
+    def _run(self):
+        """后台线程：收集一批后提交"""
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            if item is _STOP:
+                break
+
+            batch = [item]
+            deadline = time.monotonic() + self.flush_interval
+
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+                # flush() 标记：不必再等，立即提交
+                if item[0] is None:
+                    break
+
+            self._commit(batch)
+
+        # 停止前把队列里剩下的全部写掉
+        rest = []
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not _STOP:
+                rest.append(item)
+        if rest:
+            self._commit(rest)
+
+    def _commit(self, batch: List[Tuple]):
+        """在一个事务中写入一批，按语句分组 executemany"""
+        groups = []
+        markers = []
+        for sql, params, future in batch:
+            if sql is None:
+                markers.append(future)
+            elif groups and groups[-1][0] == sql:
+                groups[-1][1].append(params)
+                groups[-1][2].append(future)
+            else:
+                groups.append((sql, [params], [future]))
+
+        results = []
+        try:
+            with self._pool.write() as conn:
+                for sql, rows, futures in groups:
+                    conn.executemany(sql, rows)
+                    # 事务内独占写锁，AUTOINCREMENT 分配的 id 是连续的
+                    last_id = conn.execute('SELECT last_insert_rowid()').fetchone()[0]
+                    first_id = last_id - len(rows) + 1
+                    results.extend(zip(futures, range(first_id, last_id + 1)))
+        except Exception as e:
+            self.stats["errors"] += 1
+            for _, _, futures in groups:
+                for future in futures:
+                    future.set_exception(e)
+        else:
+            self.stats["batches"] += 1
+            self.stats["rows"] += len(results)
+            for future, row_id in results:
+                future.set_result(row_id)
+
+        for marker in markers:
+            marker.set_result(None)
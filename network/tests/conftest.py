@@ -0,0 +1,19 @@
+"""
+测试公共设置
+- storage 包以 network 目录为根导入
+- 导入 storage.memory_palace / storage.simple_storage 时会在当前目录下创建全局实例（data/*.db），
+  测试切到临时目录运行，不碰仓库里的数据库
+- slow 标记的测试（如百万行数据集）默认也运行，快速检查时用 -m "not slow" 跳过
+"""
+
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.chdir(tempfile.mkdtemp(prefix="symphony-tests-"))
+
+
+def pytest_configure(config):
+    config.addinivalue_line("markers", "slow: 大数据集上的测试，用 -m \"not slow\" 跳过")
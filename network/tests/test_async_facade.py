@@ -0,0 +1,79 @@
+"""
+异步门面：阻塞的 SQLite 调用在数据库线程池里执行，不卡事件循环
+"""
+
+import asyncio
+import sqlite3
+import statistics
+import threading
+
+from storage.memory_palace import MemoryPalace
+from storage.simple_storage import SimpleStorage
+
+
+TICK_S = 0.005
+LOCK_HELD_S = 0.5
+SAVES = 500
+BUILDS = 40
+
+
+async def _lags(work):
+    """await work 期间计时协程每次醒来比预定晚了多久"""
+    loop = asyncio.get_running_loop()
+    lags = []
+    done = asyncio.Event()
+
+    async def ticker():
+        while not done.is_set():
+            started = loop.time()
+            await asyncio.sleep(TICK_S)
+            lags.append(loop.time() - started - TICK_S)
+
+    ticker_task = asyncio.create_task(ticker())
+    result = await work
+    done.set()
+    await ticker_task
+    return result, lags
+
+
+def test_async_calls_do_not_block_event_loop(tmp_path):
+    """写锁被别的连接占住时，500 个并发 asave_message 在线程里等待，计时协程的延迟与空载时持平"""
+    storage = SimpleStorage(tmp_path / "symphony.db")
+    palace = MemoryPalace(tmp_path / "memory.db")
+    for i in range(20):
+        palace.add_long_term_memory(f"u{i % 4}", "insight", f"第 {i} 条关于成长和目标的洞察", ["成长", "目标"])
+
+    # 另一个线程持有写锁 LOCK_HELD_S 秒：同步执行的写入会让事件循环停住这么久
+    blocker = sqlite3.connect(tmp_path / "symphony.db", check_same_thread=False)
+    release = threading.Timer(LOCK_HELD_S, blocker.rollback)
+
+    async def scenario():
+        # 同一次运行里先量空载时的延迟作为基线，不依赖机器快慢
+        _, baseline = await _lags(asyncio.sleep(LOCK_HELD_S))
+
+        blocker.execute("BEGIN IMMEDIATE")
+        release.start()
+        results, loaded = await _lags(asyncio.gather(
+            *(storage.asave_message(f"u{i % 4}", f"消息 {i}") for i in range(SAVES)),
+            *(palace.abuild_context(f"u{i % 4}", "成长") for i in range(BUILDS))
+        ))
+        return results, baseline, loaded
+
+    try:
+        results, baseline, loaded = asyncio.run(scenario())
+    finally:
+        if release.ident is not None:
+            release.join()
+        blocker.close()
+        storage.close()
+        palace.close()
+
+    message_ids = results[:SAVES]
+    contexts = results[SAVES:]
+    assert len(set(message_ids)) == SAVES
+    assert all(context["relevant_long_term"] for context in contexts)
+    # 写锁确实让写入等待过，计时协程在此期间持续运行
+    assert sum(loaded) + len(loaded) * TICK_S >= LOCK_HELD_S
+    # 延迟保持平稳：中位数与基线同一量级，最坏一次远小于写锁被占住的时间
+    assert statistics.median(loaded) < statistics.median(baseline) * 5 + TICK_S
+    assert max(loaded) < max(baseline) + LOCK_HELD_S / 5
@@ -0,0 +1,119 @@
+"""
+记忆整理：合并后关联不留自环和重复边，合并期间写回的访问次数不丢；提升出的长期记忆不在了时重新提升
+"""
+
+import json
+import threading
+
+import pytest
+
+from storage.memory_palace import MemoryPalace
+
+
+@pytest.fixture
+def palace(tmp_path):
+    store = MemoryPalace(tmp_path / "memory.db")
+    yield store
+    store.close()
+
+
+def _associations(palace):
+    with palace._pool.read() as conn:
+        return [tuple(row) for row in conn.execute(
+            'SELECT memory_id_1, memory_id_2, association_type, strength FROM memory_associations ORDER BY id'
+        )]
+
+
+def test_merge_keeps_strongest_edge_without_self_loops(palace):
+    survivor = palace.add_long_term_memory("u1", "insight", "坚持每天复盘工作中的得失", ["复盘"])
+    other = palace.add_long_term_memory("u1", "insight", "和家人沟通时先倾听再表达", ["沟通"])
+    duplicate = palace.add_long_term_memory("u1", "insight", "坚持每天复盘工作中的得失", ["工作"])
+    palace.create_association(survivor, other, "related", 0.4)
+    palace.create_association(other, duplicate, "related", 0.8)
+    palace.create_association(duplicate, other, "contrast", 0.6)
+    palace.create_association(survivor, duplicate, "related", 0.9)
+
+    stats = palace.consolidate_memories()
+
+    assert stats["long_term_merged"] == 1
+    assert sorted(_associations(palace)) == sorted([
+        (other, survivor, "related", 0.8),
+        (survivor, other, "contrast", 0.6),
+    ])
+
+
+def test_merge_deletes_associations_by_index(palace):
+    palace.add_long_term_memory("u1", "insight", "坚持每天复盘工作中的得失", ["复盘"])
+    palace.add_long_term_memory("u1", "insight", "坚持每天复盘工作中的得失", ["工作"])
+
+    palace._pool.confine_to_thread()
+    connections = palace._pool._local.connections.values()
+    statements = []
+    for conn in connections:
+        conn.set_trace_callback(statements.append)
+    try:
+        palace.consolidate_memories()
+    finally:
+        for conn in connections:
+            conn.set_trace_callback(None)
+
+    deletes = [sql for sql in statements if 'DELETE FROM memory_associations' in sql]
+    assert deletes
+    with palace._pool.read() as conn:
+        for sql in deletes:
+            plan = ' | '.join(row['detail'] for row in conn.execute('EXPLAIN QUERY PLAN ' + sql))
+            assert "SCAN memory_associations" not in plan
+
+
+def test_merge_keeps_access_counts_flushed_meanwhile(tmp_path):
+    palace = MemoryPalace(tmp_path / "memory.db", access_flush_interval_ms=60000)
+    try:
+        survivor = palace.add_long_term_memory("u1", "insight", "坚持每天复盘工作中的得失", ["复盘"])
+        palace.add_long_term_memory("u1", "insight", "坚持每天复盘工作中的得失", ["工作"])
+
+        palace._pool.confine_to_thread()
+        conn = palace._pool._local.connections["write"]
+        flusher = threading.Thread(target=palace.flush_access_stats, daemon=True)
+
+        def on_statement(sql):
+            # 合并读完两行、写回合并结果之前另一个线程写回一次访问：合并持有写锁，写回要等合并的事务提交
+            if 'SET access_count' in sql and 'keywords' in sql and flusher.ident is None:
+                palace._access.record([survivor])
+                flusher.start()
+                flusher.join(timeout=0.2)
+
+        conn.set_trace_callback(on_statement)
+        try:
+            assert palace.consolidate_memories()["long_term_merged"] == 1
+        finally:
+            conn.set_trace_callback(None)
+        flusher.join(timeout=10)
+
+        with palace._pool.read() as conn:
+            (count,) = conn.execute('SELECT access_count FROM long_term_memory WHERE id = ?', (survivor,)).fetchone()
+        assert count == 1
+    finally:
+        palace.close()
+
+
+def test_theme_repromoted_when_target_is_gone(palace):
+    for _ in range(3):
+        palace.add_short_term_memory("u1", "最近总是加班到很晚，感觉很累")
+    assert palace.consolidate_memories()["themes_promoted"] == 1
+
+    with palace._pool.read() as conn:
+        (first,) = conn.execute("SELECT id FROM long_term_memory WHERE memory_type = 'recurring_theme'").fetchone()
+    # 模拟配额淘汰
+    with palace._pool.write() as conn:
+        conn.execute('DELETE FROM long_term_memory WHERE id = ?', (first,))
+
+    palace.add_short_term_memory("u1", "最近总是加班到很晚，感觉很累")
+    stats = palace.consolidate_memories()
+    assert stats["themes_promoted"] == 1
+    assert stats["themes_reinforced"] == 0
+
+    with palace._pool.read() as conn:
+        (second,) = conn.execute("SELECT id FROM long_term_memory WHERE memory_type = 'recurring_theme'").fetchone()
+        targets = {json.loads(row[0])['promoted_to'] for row in conn.execute('SELECT metadata FROM short_term_memory')}
+    assert second != first
+    assert targets == {second}
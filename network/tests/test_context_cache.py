@@ -0,0 +1,48 @@
+"""
+上下文缓存：构建期间失效或清空过的结果不再缓存；失效记录不随用户数无限增长
+"""
+
+from storage.context_cache import ContextCache
+
+
+def test_clear_discards_builds_in_flight():
+    cache = ContextCache(max_entries=4)
+    generation = cache.generation("u1")
+    # 构建期间 recompute_relevance / import_users 清空了缓存
+    cache.clear()
+    cache.put("u1", "topic", {"stale": True}, generation)
+    assert cache.get("u1", "topic") is None
+
+    cache.put("u1", "topic", {"stale": False}, cache.generation("u1"))
+    assert cache.get("u1", "topic") == {"stale": False}
+
+
+def test_invalidate_discards_only_that_users_builds():
+    cache = ContextCache(max_entries=4)
+    generation = cache.generation("u1")
+    cache.invalidate("u2")
+    cache.invalidate("u1")
+    cache.put("u1", "topic", {}, generation)
+    cache.put("u2", "topic", {}, cache.generation("u2"))
+    assert cache.get("u1", "topic") is None
+    assert cache.get("u2", "topic") == {}
+
+
+def test_invalidation_records_are_bounded():
+    cache = ContextCache(max_entries=4)
+    for i in range(100):
+        user_id = f"user{i}"
+        cache.put(user_id, "topic", {}, cache.generation(user_id))
+        cache.invalidate(f"writer{i}")
+        cache.invalidate(user_id)
+        cache.put(user_id, "topic", {}, cache.generation(user_id))
+    assert len(cache._invalidated) <= 4
+    assert len(cache._entries) == 4
+
+    # 失效记录被淘汰之后，失效之前开始的构建仍然不会缓存
+    generation = cache.generation("user0")
+    cache.invalidate("user0")
+    for i in range(10):
+        cache.invalidate(f"late{i}")
+    cache.put("user0", "topic", {}, generation)
+    assert cache.get("user0", "topic") is None
@@ -0,0 +1,68 @@
+"""
+键集分页遍历：按 (时间, id) 游标分批读取，内存占用与历史长度无关，批边界上不丢行不重行
+"""
+
+import tracemalloc
+
+import pytest
+
+from storage.simple_storage import SimpleStorage
+
+
+BATCH_SIZE = 500
+# 每批最多 BATCH_SIZE 行字典，全部物化则是全部行；上限远低于后者，且与行数无关
+MAX_PEAK_BYTES = 4 * 1024 * 1024
+
+
+def _fill(store: SimpleStorage, user_id: str, rows: int):
+    """直接批量写入：同一毫秒内有多条消息，游标必须按 (timestamp, id) 推进"""
+    with store._pool.write() as conn:
+        conn.executemany(
+            'INSERT INTO user_messages (user_id, content, message_type, metadata, timestamp) VALUES (?, ?, ?, ?, ?)',
+            ((user_id, f"第 {i} 条消息，" + "内容" * 40, "direct_message", "{}", 1_700_000_000_000 + i // 7)
+             for i in range(rows))
+        )
+        conn.execute("INSERT INTO user_messages (user_id, content, timestamp) VALUES ('other', 'x', 0)")
+
+
+@pytest.mark.parametrize("rows", [100_000, pytest.param(1_000_000, marks=pytest.mark.slow)])
+def test_iter_user_messages_constant_memory(tmp_path, rows):
+    store = SimpleStorage(tmp_path / "symphony.db")
+    try:
+        _fill(store, "u1", rows)
+
+        tracemalloc.start()
+        try:
+            count, last_key, ordered = 0, None, True
+            for message in store.iter_user_messages("u1", batch_size=BATCH_SIZE):
+                key = (message['timestamp'], message['id'])
+                ordered = ordered and (last_key is None or key > last_key)
+                last_key = key
+                count += 1
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+    finally:
+        store.close()
+
+    assert count == rows
+    assert ordered
+    assert peak < MAX_PEAK_BYTES, f"peak {peak} bytes"
+
+
+def test_iter_user_messages_resumes_from_cursor(tmp_path):
+    store = SimpleStorage(tmp_path / "symphony.db")
+    try:
+        _fill(store, "u1", 2000)
+        iterator = store.iter_user_messages("u1", batch_size=64)
+        head = [next(iterator) for _ in range(1000)]
+        iterator.close()
+
+        cursor = (head[-1]['timestamp'], head[-1]['id'])
+        tail = list(store.iter_user_messages("u1", after=cursor, batch_size=64))
+        everything = list(store.iter_user_messages("u1", batch_size=64))
+    finally:
+        store.close()
+
+    assert [m['id'] for m in head + tail] == [m['id'] for m in everything]
+    assert len(everything) == 2000
@@ -0,0 +1,75 @@
+"""
+长期记忆全文索引：外部内容 FTS5 表由触发器按 search_text 列维护，不依赖应用注册的 SQL 函数，
+普通 sqlite3 连接也能增删改长期记忆；整理合并、重新压缩之后索引与表一致
+"""
+
+import sqlite3
+
+import pytest
+
+from storage.memory_palace import MemoryPalace, _fts_query
+
+
+REVIEW = "坚持每天复盘工作中的得失，记录下一步的改进。" * 4
+LISTEN = "和家人沟通时先倾听再表达自己的想法和感受。" * 4
+
+
+@pytest.fixture
+def palace(tmp_path):
+    store = MemoryPalace(tmp_path / "memory.db", compress_text=True, compress_min_length=20)
+    yield store
+    store.close()
+
+
+def _indexed(palace, user_id, keyword):
+    """直接在全文索引上匹配，返回命中的 rowid"""
+    with palace._pool.read() as conn:
+        return sorted(row[0] for row in conn.execute(
+            'SELECT rowid FROM long_term_memory_fts WHERE long_term_memory_fts MATCH ?',
+            (_fts_query(user_id, [keyword]),)
+        ))
+
+
+def _check_index(conn):
+    """FTS5 自带的一致性检查：索引与 long_term_memory 的 search_text 对不上时报错"""
+    conn.execute("INSERT INTO long_term_memory_fts (long_term_memory_fts, rank) VALUES ('integrity-check', 1)")
+
+
+def test_index_follows_compressed_rows(palace):
+    first = palace.add_long_term_memory("u1", "insight", REVIEW, ["复盘"])
+    second = palace.add_long_term_memory("u1", "insight", REVIEW, ["zebra"])
+    other = palace.add_long_term_memory("u2", "insight", LISTEN, ["沟通"])
+    with palace._pool.read() as conn:
+        assert conn.execute('SELECT typeof(content) FROM long_term_memory WHERE id = ?', (first,)).fetchone()[0] == "blob"
+
+    assert _indexed(palace, "u1", "得失") == [first, second]
+    assert [m["id"] for m in palace.search_memories("u2", ["倾听"])] == [other]
+
+    # 合并后 survivor 带上重复记忆的关键词，重复记忆的词条删除
+    assert palace.consolidate_memories()["long_term_merged"] == 1
+    assert _indexed(palace, "u1", "zebra") == [first]
+    assert _indexed(palace, "u1", "得失") == [first]
+
+    palace.text_codec.train(palace.TEXT_COLUMNS)
+    assert palace.text_codec.recompress("long_term_memory", "content") > 0
+    assert _indexed(palace, "u1", "得失") == [first]
+    with palace._pool.write() as conn:
+        _check_index(conn)
+
+
+def test_plain_sqlite_connection_can_write(palace):
+    first = palace.add_long_term_memory("u1", "insight", REVIEW, ["复盘"])
+    other = palace.add_long_term_memory("u2", "insight", LISTEN, ["沟通"])
+
+    # sqlite3 命令行、运维脚本这类连接上没有应用注册的任何函数
+    conn = sqlite3.connect(palace.db_path)
+    try:
+        with conn:
+            conn.execute('DELETE FROM long_term_memory WHERE id = ?', (first,))
+            conn.execute("UPDATE long_term_memory SET keywords = '沟通,家人' WHERE id = ?", (other,))
+        _check_index(conn)
+    finally:
+        conn.close()
+
+    assert _indexed(palace, "u1", "得失") == []
+    assert _indexed(palace, "u2", "家人") == [other]
@@ -0,0 +1,58 @@
+"""
+记忆查询结果只带公开列：search_text、simhash、relevance 和元数据生成列不返回给调用方
+"""
+
+import pytest
+
+from storage.memory_palace import MemoryPalace
+from storage.memory_transfer import LONG_TERM_COLUMNS, SHORT_TERM_COLUMNS
+
+
+INTERNAL = {"search_text", "simhash", "relevance", "meta_framework"}
+
+
+@pytest.fixture
+def palace(tmp_path):
+    store = MemoryPalace(tmp_path / "memory.db", indexed_metadata_fields=("framework",))
+    first = store.add_long_term_memory("u1", "insight", "关于成长和目标的洞察", ["成长"], metadata={"framework": "SWOT"})
+    second = store.add_long_term_memory("u1", "insight", "关于目标拆分的建议", ["目标"], metadata={"framework": "SWOT"})
+    store.create_association(first, second, "related", 0.9)
+    store.add_short_term_memory("u1", "今天聊了成长", metadata={"framework": "SWOT"})
+    store.consolidate_memories()
+    yield store
+    store.close()
+
+
+def _assert_public(rows, columns, extra=()):
+    assert rows
+    for row in rows:
+        assert not INTERNAL & set(row)
+        assert set(columns) <= set(row) <= set(columns) | set(extra)
+
+
+def test_long_term_results_have_public_columns(palace):
+    _assert_public(palace.search_memories("u1", ["成长"]), LONG_TERM_COLUMNS, ["relevance_score"])
+    _assert_public(palace.search_memories("u1", []), LONG_TERM_COLUMNS, ["relevance_score"])
+    _assert_public(
+        palace.search_memories("u1", [], metadata_filters={"framework": "SWOT"}),
+        LONG_TERM_COLUMNS, ["relevance_score"]
+    )
+    _assert_public(palace.get_important_memories("u1", min_importance=0), LONG_TERM_COLUMNS)
+    _assert_public(
+        palace.get_important_memories("u1", min_importance=0, metadata_filters={"framework": "SWOT"}),
+        LONG_TERM_COLUMNS
+    )
+    _assert_public(palace.semantic_search("u1", "成长"), LONG_TERM_COLUMNS, ["similarity"])
+
+    memory_id = palace.search_memories("u1", ["成长"])[0]["id"]
+    _assert_public(palace.get_associated_memories(memory_id), LONG_TERM_COLUMNS, ["association_type", "strength"])
+    _assert_public(palace.get_memory_neighborhood(memory_id), LONG_TERM_COLUMNS, ["hops", "path_strength"])
+
+
+def test_short_term_results_have_public_columns(palace):
+    _assert_public(palace.get_recent_memories("u1"), SHORT_TERM_COLUMNS)
+    _assert_public(palace.get_recent_memories("u1", metadata_filters={"framework": "SWOT"}), SHORT_TERM_COLUMNS)
+
+    context = palace.build_context("u1", "成长")
+    _assert_public(context["recent_memories"], SHORT_TERM_COLUMNS)
+    _assert_public(context["relevant_long_term"], LONG_TERM_COLUMNS, ["relevance_score"])
@@ -0,0 +1,89 @@
+"""
+记忆导入导出：导出按键集分批读取，不在 yield 期间占着池里的读连接和读事务；
+导入边读输入流边写入，期间其它连接的写入不会占用导入分配的 id
+"""
+
+import json
+import threading
+
+import pytest
+
+from storage.memory_palace import MemoryPalace
+from storage.memory_transfer import MemoryTransfer
+
+
+@pytest.fixture
+def palace(tmp_path):
+    store = MemoryPalace(tmp_path / "memory.db", max_readers=1)
+    first = store.add_long_term_memory("u1", "insight", "关于成长和目标的洞察", ["成长"])
+    second = store.add_long_term_memory("u1", "insight", "关于目标拆分的建议", ["目标"])
+    store.create_association(first, second, "related", 0.9)
+    store.add_short_term_memory("u1", "今天聊了成长")
+    yield store
+    store.close()
+
+
+def test_partial_export_releases_read_connection(palace):
+    lines = palace.export_user("u1")
+    assert json.loads(next(lines))["kind"] == "header"
+    assert json.loads(next(lines))["kind"] == "long_term"
+
+    # 池里只有一个读连接：导出停在中途时其它读取照常进行，连接还被占着就会一直等下去
+    reader = threading.Thread(target=palace.get_important_memories, args=("u1",), daemon=True)
+    reader.start()
+    reader.join(timeout=5)
+    assert not reader.is_alive()
+
+    kinds = [json.loads(line)["kind"] for line in lines]
+    assert kinds == ["long_term", "association", "short_term"]
+
+
+def test_import_allocates_ids_under_write_lock(palace, tmp_path):
+    lines = list(palace.export_user("u1"))
+    target = MemoryPalace(tmp_path / "target.db")
+    concurrent = []
+    writer = threading.Thread(
+        target=lambda: concurrent.append(target.add_long_term_memory("u2", "insight", "并发写入", [])),
+        daemon=True
+    )
+
+    def stream():
+        yield from lines[:2]
+        # 第一段还在读输入流时另一个线程写入长期记忆：导入持有写锁，它要等导入的事务提交
+        writer.start()
+        writer.join(timeout=0.2)
+        yield from lines[2:]
+
+    try:
+        stats = target.import_users(stream())
+        writer.join(timeout=10)
+        assert stats["long_term"] == 2
+        assert stats["association"] == 1
+        assert len(concurrent) == 1
+        assert len(target.search_memories("u1", ["目标"])) == 2
+    finally:
+        target.close()
+
+
+def test_batched_export_round_trip(palace, tmp_path):
+    ids = [palace.add_long_term_memory("u1", "note", f"第{i}条记录", [f"k{i}"]) for i in range(7)]
+    for first, second in zip(ids, ids[1:]):
+        palace.create_association(first, second, "next", 0.5)
+    for i in range(7):
+        palace.add_short_term_memory("u1", f"短期记忆 {i}")
+
+    records = list(MemoryTransfer(palace, batch_size=3).export_user("u1"))
+    kinds = [record["kind"] for record in records]
+    assert kinds == ["long_term"] * 9 + ["association"] * 7 + ["short_term"] * 8
+    long_term = [record["id"] for record in records if record["kind"] == "long_term"]
+    assert long_term == sorted(long_term)
+
+    target = MemoryPalace(tmp_path / "target.db")
+    try:
+        stats = MemoryTransfer(target).import_records(iter([{"kind": "header", "format": "memory_palace"}] + records))
+        assert (stats["long_term"], stats["association"], stats["short_term"], stats["skipped"]) == (9, 7, 8, 0)
+        imported = target.search_memories("u1", ["k3"])[0]
+        neighbours = sorted(m["content"] for m in target.get_associated_memories(imported["id"]))
+        assert neighbours == ["第2条记录", "第4条记录"]
+    finally:
+        target.close()
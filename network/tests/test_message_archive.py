@@ -0,0 +1,41 @@
+"""
+消息归档：各分片共用同一目录下的月度归档库，每个分片的 archive_index 只记自己移走的用户，
+重新分片后归档的消息仍能读到
+"""
+
+from storage.message_archive import DAY_MS
+from storage.migrations import now_ms
+from storage.sharding import ShardedStore
+from storage.simple_storage import SimpleStorage
+
+
+USERS = [f"user{i}" for i in range(8)]
+
+
+def _indexed_users(shard):
+    with shard._pool.read() as conn:
+        return sorted(row[0] for row in conn.execute('SELECT DISTINCT user_id FROM archive_index'))
+
+
+def test_shards_index_only_their_own_archived_users(tmp_path):
+    store = ShardedStore(SimpleStorage, tmp_path / "symphony.db", 2)
+    try:
+        for user_id in USERS:
+            store.save_message(user_id, f"{user_id} 的旧消息")
+        for shard in store.shards.values():
+            shard.flush()
+            with shard._pool.write() as conn:
+                conn.execute('UPDATE user_messages SET timestamp = ?', (now_ms() - 40 * DAY_MS,))
+
+        store.fan_out('archive_old_data', 30)
+
+        for shard in store.shards.values():
+            owned = sorted(user_id for user_id in USERS if store.for_user(user_id) is shard)
+            assert owned
+            assert _indexed_users(shard) == owned
+
+        store.rebalance(3)
+        for user_id in USERS:
+            assert [m["content"] for m in store.get_user_messages(user_id)] == [f"{user_id} 的旧消息"]
+    finally:
+        store.close()
@@ -0,0 +1,138 @@
+"""
+查询计划：按用户取数据的查询走 (user_id, 时间) 复合索引，排序不需要临时 B 树；过期行的清理和统计走 expires_at 索引
+被检查的 SQL 由真实调用执行时跟踪得到，不在测试里另写一份
+"""
+
+from typing import Callable, List
+
+import pytest
+
+from storage.memory_palace import MemoryPalace
+from storage.memory_transfer import MemoryTransfer
+from storage.simple_storage import SimpleStorage
+
+
+def _traced(store, call: Callable) -> List[str]:
+    """在当前线程的专属连接上执行 call，返回执行过的语句（参数已展开为字面量）"""
+    store._pool.confine_to_thread()
+    connections = store._pool._local.connections.values()
+    statements = []
+    for conn in connections:
+        conn.set_trace_callback(statements.append)
+    try:
+        call()
+    finally:
+        for conn in connections:
+            conn.set_trace_callback(None)
+    return statements
+
+
+def _plans(store, call: Callable, table: str, verbs=('SELECT',)) -> List[str]:
+    """call 执行的涉及 table 的 SELECT（或 verbs 指定的语句）各自的 EXPLAIN QUERY PLAN（每条计划的各行用 | 连接）"""
+    plans = []
+    with store._pool.read() as conn:
+        # 触发器执行时同一条语句会被跟踪到多次
+        for sql in dict.fromkeys(_traced(store, call)):
+            if sql.lstrip().upper().startswith(verbs) and table in sql:
+                rows = conn.execute('EXPLAIN QUERY PLAN ' + sql).fetchall()
+                plans.append(' | '.join(row['detail'] for row in rows))
+    assert plans, f"no SELECT on {table} was executed"
+    return plans
+
+
+@pytest.fixture
+def storage(tmp_path):
+    store = SimpleStorage(tmp_path / "symphony.db")
+    for i in range(50):
+        store.save_message(f"u{i % 5}", f"消息 {i}")
+        store.save_action_plan(f"u{i % 5}", f"计划 {i}", [{"step": i}])
+    yield store
+    store.close()
+
+
+def test_get_user_messages_uses_user_time_index(storage):
+    for plan in _plans(storage, lambda: storage.get_user_messages("u1", limit=5), "user_messages"):
+        assert "SEARCH user_messages USING INDEX idx_messages_user_ts (user_id=? AND timestamp<?)" in plan
+        assert "TEMP B-TREE" not in plan
+
+
+def test_get_action_plans_uses_user_created_index(storage):
+    for plan in _plans(storage, lambda: storage.get_action_plans("u1", limit=5), "action_plans"):
+        assert "SEARCH action_plans USING INDEX idx_plans_user_created (user_id=?)" in plan
+        assert "TEMP B-TREE" not in plan
+
+
+def test_analysis_results_have_user_time_index(storage):
+    with storage._pool.read() as conn:
+        rows = conn.execute('''
+            EXPLAIN QUERY PLAN
+            SELECT * FROM analysis_results WHERE user_id = 'u1' ORDER BY timestamp DESC, id DESC LIMIT 5
+        ''').fetchall()
+    plan = ' | '.join(row['detail'] for row in rows)
+    assert "SEARCH analysis_results USING INDEX idx_analysis_user_ts (user_id=?)" in plan
+    assert "TEMP B-TREE" not in plan
+
+
+def test_keyset_iteration_seeks_user_time_index(storage):
+    call = lambda: list(storage.iter_user_messages("u1", batch_size=4))
+    for plan in _plans(storage, call, "user_messages"):
+        assert "SEARCH user_messages USING INDEX idx_messages_user_ts (user_id=? AND timestamp>?)" in plan
+        assert "TEMP B-TREE" not in plan
+
+    call = lambda: list(storage.iter_action_plans("u1", batch_size=4))
+    for plan in _plans(storage, call, "action_plans"):
+        assert "SEARCH action_plans USING INDEX idx_plans_user_created (user_id=? AND created_at>?)" in plan
+        assert "TEMP B-TREE" not in plan
+
+
+@pytest.fixture
+def palace(tmp_path):
+    store = MemoryPalace(tmp_path / "memory.db", recent_per_user=5)
+    for i in range(40):
+        content_type = "note" if i % 2 else "message"
+        store.add_short_term_memory(f"u{i % 4}", f"短期记忆 {i}", content_type=content_type, ttl_hours=0 if i % 3 else 24)
+    yield store
+    store.close()
+
+
+def test_recent_memories_use_user_time_index(palace):
+    # limit 超过内存层容量时查库；内存层自己加载时也是同一个索引
+    for limit in (10, 3):
+        for plan in _plans(palace, lambda: palace.get_recent_memories("u1", limit=limit), "short_term_memory"):
+            assert "SEARCH short_term_memory USING INDEX idx_stm_user_ts (user_id=?)" in plan
+            assert "TEMP B-TREE" not in plan
+
+
+def test_recent_memories_by_type_use_user_type_time_index(palace):
+    call = lambda: palace.get_recent_memories("u1", limit=10, content_type="note")
+    for plan in _plans(palace, call, "short_term_memory"):
+        assert "SEARCH short_term_memory USING INDEX idx_stm_user_type_ts (user_id=? AND content_type=?)" in plan
+        assert "TEMP B-TREE" not in plan
+
+
+def test_expiry_paths_use_covering_expires_index(palace):
+    for plan in _plans(palace, lambda: palace.get_memory_stats_many(["u1", "u2"]), "short_term_memory"):
+        assert "SEARCH short_term_memory USING COVERING INDEX idx_stm_expires (expires_at<?)" in plan
+
+    plans = _plans(palace, palace.cleanup_expired_memories, "short_term_memory", verbs=('DELETE',))
+    for plan in plans:
+        assert "SEARCH short_term_memory USING COVERING INDEX idx_stm_expires (expires_at<?)" in plan
+        assert "SCAN short_term_memory" not in plan
+
+
+def test_export_batches_seek_indexes(palace):
+    ids = [palace.add_long_term_memory("u1", "note", f"记录 {i}", []) for i in range(7)]
+    for first, second in zip(ids, ids[1:]):
+        palace.create_association(first, second, "next", 0.5)
+
+    call = lambda: list(MemoryTransfer(palace, batch_size=3).export_user("u1"))
+    plans = _plans(palace, call, "memory_embeddings")
+    for plan in plans:
+        assert "idx_embeddings_user (user_id=? AND memory_id>?)" in plan
+        assert "TEMP B-TREE" not in plan
+    for plan in _plans(palace, call, "memory_associations"):
+        assert "SEARCH a USING INDEX idx_assoc_m1 (memory_id_1=?)" in plan
+        assert "SEARCH m2 USING INTEGER PRIMARY KEY (rowid=?)" in plan
+    for plan in _plans(palace, call, "FROM short_term_memory"):
+        assert "SEARCH short_term_memory USING INDEX idx_stm_user_ts (user_id=? AND timestamp>?)" in plan
+        assert "TEMP B-TREE" not in plan
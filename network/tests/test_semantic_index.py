@@ -0,0 +1,95 @@
+"""
+语义索引缓存：新增记忆后只追加新向量（含 LSH 桶），有删除时整体重新加载；按最近使用淘汰用户
+"""
+
+import pytest
+
+from storage.memory_palace import MemoryPalace
+from storage.semantic_index import SemanticIndex, np
+
+
+TOPICS = ["职业规划", "家庭关系", "健康习惯", "学习方法", "财务目标", "情绪管理", "时间管理", "人际沟通"]
+
+
+def _text(i: int) -> str:
+    return f"{TOPICS[i % len(TOPICS)]}相关的第{i}条记录 note{i} 编号{i * 7919 % 1000}"
+
+
+@pytest.fixture
+def palace(tmp_path):
+    store = MemoryPalace(tmp_path / "memory.db", semantic_index=SemanticIndex(ann_threshold=200, cache_users=2))
+    yield store
+    store.close()
+
+
+def _full_load(palace, user_id):
+    """不带缓存的新索引整体加载同一用户"""
+    fresh = SemanticIndex(ann_threshold=palace.semantic_index.ann_threshold)
+    with palace._pool.read() as conn:
+        return fresh._load(conn, user_id)
+
+
+def _embedding_reads(palace, call):
+    """执行 call，返回在当前线程专属连接上读 memory_embeddings 的语句"""
+    palace._pool.confine_to_thread()
+    conn = palace._pool._local.connections["read"]
+    statements = []
+    conn.set_trace_callback(statements.append)
+    try:
+        call()
+    finally:
+        conn.set_trace_callback(None)
+    return [sql for sql in statements if "FROM memory_embeddings" in sql]
+
+
+def test_new_memories_extend_cached_vectors(palace):
+    for i in range(150):
+        palace.add_long_term_memory("u1", "note", _text(i), [])
+    palace.semantic_search("u1", "职业规划")
+
+    def insert_then_search():
+        for i in range(150, 300):
+            memory_id = palace.add_long_term_memory("u1", "note", _text(i), [])
+            assert palace.semantic_search("u1", _text(i), limit=1)[0]["id"] == memory_id
+
+    reads = _embedding_reads(palace, insert_then_search)
+    # 每次只读比缓存更新的向量，不再整体加载
+    assert len(reads) == 150
+    assert all("memory_id >" in sql for sql in reads)
+
+    extended = palace.semantic_index._cache["u1"]
+    # 跨过 ann_threshold 后建的近似索引在之后的追加里逐条放进桶
+    assert extended.planes is not None
+
+    reference = _full_load(palace, "u1")
+    assert list(extended.ids) == list(reference.ids)
+    assert np.array_equal(extended.matrix, reference.matrix)
+    for table in extended.buckets:
+        rows = np.sort(np.concatenate(list(table.values())))
+        assert np.array_equal(rows, np.arange(len(extended.ids)))
+
+
+def test_delete_reloads_cached_vectors(palace):
+    ids = [palace.add_long_term_memory("u1", "note", _text(i), []) for i in range(20)]
+    palace.semantic_search("u1", "职业规划")
+
+    with palace._pool.write() as conn:
+        conn.execute('DELETE FROM long_term_memory WHERE id = ?', (ids[3],))
+    palace.add_long_term_memory("u1", "note", _text(99), [])
+
+    palace.semantic_search("u1", _text(3))
+    entry = palace.semantic_index._cache["u1"]
+    assert ids[3] not in list(entry.ids)
+    assert list(entry.ids) == list(_full_load(palace, "u1").ids)
+
+
+def test_cache_evicts_least_recently_used_user(palace):
+    for user_id in ("u1", "u2", "u3"):
+        palace.add_long_term_memory(user_id, "note", _text(1), [])
+
+    palace.semantic_search("u1", "职业")
+    palace.semantic_search("u2", "职业")
+    palace.semantic_search("u1", "职业")
+    palace.semantic_search("u3", "职业")
+
+    assert list(palace.semantic_index._cache) == ["u1", "u3"]